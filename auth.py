@@ -1,17 +1,28 @@
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
-from fastapi import HTTPException, status, Depends
+from fastapi import HTTPException, status, Depends, Request
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 import os
+import uuid
+
+from utils.revocation_utils import esta_revocado
+from utils.permission_utils import mascara, permisos_de_token
+from utils.jwks_utils import JWT_ALGORITHM, firmar_jwt, verificar_jwt
 
 # Configuración de seguridad
-SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-here-change-in-production")
-ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_HOURS = 24
+# Los tokens se firman con RS256 (ver utils/jwks_utils.py). SECRET_KEY solo se
+# usa para aceptar tokens HS256 emitidos antes del cambio, si se habilita.
+ALGORITHM = JWT_ALGORITHM
+SECRET_KEY = os.getenv("SECRET_KEY")
+JWT_ACEPTAR_HS256 = bool(SECRET_KEY) and os.getenv("JWT_ACEPTAR_HS256", "false").lower() == "true"
+# Access tokens cortos: las sesiones largas se mantienen con /auth/refresh
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
 
 # Configuración de encriptación de contraseñas
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Subir BCRYPT_ROUNDS hace que los hashes existentes se actualicen en el siguiente login
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
 
 # Configuración de Bearer token
 security = HTTPBearer()
@@ -31,45 +42,78 @@ def create_access_token(data: dict, expires_delta: timedelta = None) -> str:
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
+        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     
-    to_encode.update({"exp": expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    # jti identifica el token para poder revocarlo (logout)
+    to_encode.update({"exp": expire, "jti": to_encode.get("jti") or uuid.uuid4().hex})
+    encoded_jwt = firmar_jwt(to_encode)
     return encoded_jwt
 
-def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)) -> str:
-    """Verificar y decodificar token JWT"""
+def decodificar_jwt(token: str) -> dict:
+    """Verificar firma y expiración de un token emitido por este sistema"""
+    if JWT_ACEPTAR_HS256 and jwt.get_unverified_header(token).get("alg") == "HS256":
+        return jwt.decode(token, SECRET_KEY, algorithms=["HS256"])
+    return verificar_jwt(token)
+
+def get_principal(
+    request: Request,
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> dict:
+    """Verificar el token una sola vez por request y cachear el resultado.
+
+    El principal (claims, rol y departamento) queda en request.state.principal;
+    el resto de dependencias de autenticación lo reutilizan.
+    """
+    principal = getattr(request.state, "principal", None)
+    if principal is not None:
+        return principal
+    
     try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        
-        if user_id is None:
-            raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token inválido: no se encontró el usuario",
-                headers={"WWW-Authenticate": "Bearer"}
-            )
-        
-        return user_id
-        
+        payload = decodificar_jwt(credentials.credentials)
     except JWTError as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Token inválido: {str(e)}",
             headers={"WWW-Authenticate": "Bearer"}
         )
-    except Exception as e:
+    
+    if payload.get("sub") is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Token inválido: no se encontró el usuario",
+            headers={"WWW-Authenticate": "Bearer"}
+        )
+    
+    jti = payload.get("jti")
+    if jti and esta_revocado(jti):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
-            detail=f"Error verificando token: {str(e)}",
+            detail="Token revocado",
             headers={"WWW-Authenticate": "Bearer"}
         )
+    
+    principal = {
+        "user_id": payload.get("sub"),
+        "username": payload.get("username"),
+        "role": payload.get("role"),
+        "dept_id": payload.get("dept_id"),
+        "exp": payload.get("exp"),
+        "jti": jti,
+        "rol_bits": BIT_ROL.get(payload.get("role"), 0),
+        "permisos": permisos_de_token(payload),
+        "payload": payload
+    }
+    request.state.principal = principal
+    return principal
+
+def verify_token(principal: dict = Depends(get_principal)) -> str:
+    """Verificar token JWT y devolver el id del usuario"""
+    return principal["user_id"]
 
 def decode_token(token: str) -> dict:
     """Decodificar token sin verificar (para inspección)"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decodificar_jwt(token)
         return payload
     except JWTError:
         return None
@@ -77,7 +121,7 @@ def decode_token(token: str) -> dict:
 def is_token_expired(token: str) -> bool:
     """Verificar si un token ha expirado"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decodificar_jwt(token)
         exp_timestamp = payload.get("exp")
         if exp_timestamp:
             exp_datetime = datetime.fromtimestamp(exp_timestamp)
@@ -86,56 +130,37 @@ def is_token_expired(token: str) -> bool:
     except JWTError:
         return True
 
-def refresh_token(token: str) -> str:
-    """Refrescar token si está próximo a expirar"""
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        exp_timestamp = payload.get("exp")
-        
-        if exp_timestamp:
-            exp_datetime = datetime.fromtimestamp(exp_timestamp)
-            time_until_expiry = exp_datetime - datetime.utcnow()
-            
-            # Si expira en menos de 2 horas, generar nuevo token
-            if time_until_expiry < timedelta(hours=2):
-                # Remover timestamp de expiración para crear nuevo token
-                new_payload = {k: v for k, v in payload.items() if k != "exp"}
-                return create_access_token(new_payload)
-        
-        return token  # Retornar token original si no necesita refresh
-        
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token inválido para refresh"
-        )
-
 # Dependencias de autorización por roles
 def require_role(required_roles: list):
     """Crear dependencia que requiere roles específicos"""
-    def role_checker(credentials: HTTPAuthorizationCredentials = Depends(security)):
-        try:
-            token = credentials.credentials
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_role = payload.get("role")
-            
-            if user_role not in required_roles:
-                raise HTTPException(
-                    status_code=status.HTTP_403_FORBIDDEN,
-                    detail=f"Rol insuficiente. Se requiere uno de: {required_roles}"
-                )
-            
-            return payload
-            
-        except JWTError:
+    requerida = sum(BIT_ROL[rol] for rol in set(required_roles))
+    
+    def role_checker(principal: dict = Depends(get_principal)):
+        if not principal["rol_bits"] & requerida:
             raise HTTPException(
-                status_code=status.HTTP_401_UNAUTHORIZED,
-                detail="Token inválido",
-                headers={"WWW-Authenticate": "Bearer"}
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Rol insuficiente. Se requiere uno de: {required_roles}"
             )
+        
+        return principal["payload"]
     
     return role_checker
 
+def require_permission(*permisos: str):
+    """Crear dependencia que requiere todos los permisos indicados"""
+    requerida = mascara(*permisos)
+    
+    def permission_checker(principal: dict = Depends(get_principal)):
+        if principal["permisos"] & requerida != requerida:
+            raise HTTPException(
+                status_code=status.HTTP_403_FORBIDDEN,
+                detail=f"Permiso insuficiente. Se requiere: {list(permisos)}"
+            )
+        
+        return principal["payload"]
+    
+    return permission_checker
+
 # Roles predefinidos
 ROLES = {
     "DIRECTOR": ["DIRECTOR"],
@@ -145,45 +170,39 @@ ROLES = {
     "TODOS": ["DIRECTOR", "MEDICO_ESPECIALISTA", "MEDICO_GENERAL", "ENFERMERO", "EMPLEADO", "PACIENTE"]
 }
 
+# Un bit por rol conocido: require_role compara máscaras en lugar de listas
+BIT_ROL = {rol: 1 << i for i, rol in enumerate(ROLES["TODOS"])}
+
 # Dependencias de autorización comunes
 require_director = require_role(ROLES["DIRECTOR"])
 require_medico = require_role(ROLES["MEDICO"])
 require_enfermero = require_role(ROLES["ENFERMERO"])
 require_empleado = require_role(ROLES["EMPLEADO"])
 require_authenticated = require_role(ROLES["TODOS"])
+require_prescriptor = require_permission("puede_prescribir")
+require_administrador = require_permission("es_administrador")
 
-def get_current_user_info(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
+def get_current_user_info(principal: dict = Depends(get_principal)) -> dict:
     """Obtener información del usuario actual desde el token"""
-    try:
-        token = credentials.credentials
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        
-        return {
-            "user_id": payload.get("sub"),
-            "username": payload.get("username"),
-            "role": payload.get("role"),
-            "dept_id": payload.get("dept_id"),
-            "exp": payload.get("exp")
-        }
-        
-    except JWTError:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token inválido",
-            headers={"WWW-Authenticate": "Bearer"}
-        )
+    return {
+        "user_id": principal["user_id"],
+        "username": principal["username"],
+        "role": principal["role"],
+        "dept_id": principal["dept_id"],
+        "exp": principal["exp"]
+    }
 
 # Utilidades adicionales
 def generate_password_reset_token(user_id: str) -> str:
     """Generar token para reset de contraseña (válido por 1 hora)"""
     expire = datetime.utcnow() + timedelta(hours=1)
     data = {"sub": user_id, "type": "password_reset", "exp": expire}
-    return jwt.encode(data, SECRET_KEY, algorithm=ALGORITHM)
+    return firmar_jwt(data)
 
 def verify_password_reset_token(token: str) -> str:
     """Verificar token de reset de contraseña"""
     try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        payload = decodificar_jwt(token)
         user_id = payload.get("sub")
         token_type = payload.get("type")
         
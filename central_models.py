@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Date, Text, Enum, Numeric, Boolean, JSON
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, ForeignKey, Date, Text, Enum, Numeric, Boolean, JSON, Index, text
 from sqlalchemy.orm import relationship
 from database import CentralBase
 import enum
@@ -118,8 +118,27 @@ class Medicamento(CentralBase):
     precio_compra = Column(Numeric(10,2))
     fecha_vencimiento = Column(Date)
     estado_medicamento = Column(Enum(EstadoMedicamento))
+    id_laboratorio = Column(Integer, ForeignKey("laboratorio.id_laboratorio"))
+    id_categoria = Column(Integer, ForeignKey("categoria_medicamento.id_categoria"))
     created_at = Column(DateTime)
     updated_at = Column(DateTime)
+    
+    # Relaciones
+    laboratorio = relationship("Laboratorio")
+    categoria = relationship("CategoriaMedicamento")
+    
+    __table_args__ = (
+        # Solo los medicamentos en stock bajo: /farmacia/stock-bajo no recorre el catálogo
+        Index("ix_medicamento_stock_bajo", "cod_med", postgresql_where=text("stock_actual <= stock_minimo")),
+        # Solo los que aún se pueden dispensar: lo ya VENCIDO o RETIRADO no
+        # alarga el recorrido del barrido de vencimientos ni de /por-vencer
+        Index(
+            "ix_medicamento_vencimiento_pendiente", "fecha_vencimiento",
+            postgresql_where=text(
+                "estado_medicamento IS NULL OR estado_medicamento IN ('DISPONIBLE', 'AGOTADO')"
+            )
+        ),
+    )
 
 
 class Laboratorio(CentralBase):
@@ -146,10 +165,46 @@ class CategoriaMedicamento(CentralBase):
     created_at = Column(DateTime)
     updated_at = Column(DateTime)
 
-# En la clase Medicamento, agregar estas líneas al final:
-id_laboratorio = Column(Integer, ForeignKey("laboratorio.id_laboratorio"))
-id_categoria = Column(Integer, ForeignKey("categoria_medicamento.id_categoria"))
+class ReservaStock(CentralBase):
+    __tablename__ = "reserva_stock"
+    
+    # Stock apartado para una dispensación. Reservar descuenta de
+    # medicamento.stock_actual; liberar o expirar lo devuelve (ver utils/stock_utils.py)
+    id_reserva = Column(Integer, primary_key=True)
+    id_solicitud = Column(Integer, index=True)  # solicitud_prescripcion (BD Departamento)
+    id_emp = Column(Integer)  # quien reserva (BD Departamento)
+    estado = Column(String(20), nullable=False, default='ACTIVA')
+    expira_en = Column(DateTime, nullable=False)
+    confirmada_en = Column(DateTime)
+    created_at = Column(DateTime)
+    updated_at = Column(DateTime)
+    
+    detalles = relationship("ReservaStockDetalle")
+    
+    __table_args__ = (
+        # Barrido de expiración: solo reservas activas
+        Index("ix_reserva_stock_activa_expira", "expira_en", postgresql_where=text("estado = 'ACTIVA'")),
+    )
+
+class ReservaStockDetalle(CentralBase):
+    __tablename__ = "reserva_stock_detalle"
+    
+    id_reserva = Column(Integer, ForeignKey("reserva_stock.id_reserva"), primary_key=True)
+    cod_med = Column(Integer, ForeignKey("medicamento.cod_med"), primary_key=True)
+    cantidad = Column(Integer, nullable=False)
 
-# Relaciones (agregar al final de la clase)
-laboratorio = relationship("Laboratorio")
-categoria = relationship("CategoriaMedicamento")
\ No newline at end of file
+class EventoStock(CentralBase):
+    __tablename__ = "evento_stock"
+    
+    # Feed de transiciones de stock bajo, escrito por ajustar_stock en la
+    # misma transacción que el cambio bajo lock_eventos_stock, de modo que los
+    # id se asignan en orden de commit; se lee por id creciente
+    id_evento = Column(BigInteger, primary_key=True)
+    cod_med = Column(Integer, ForeignKey("medicamento.cod_med"), nullable=False)
+    tipo = Column(String(20), nullable=False)  # STOCK_BAJO, STOCK_NORMAL
+    stock_anterior = Column(Integer, nullable=False)
+    stock_nuevo = Column(Integer, nullable=False)
+    stock_minimo = Column(Integer)
+    motivo = Column(String(30))
+    referencia = Column(String(50))
+    created_at = Column(DateTime, index=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Date, Text, Enum, Numeric, Boolean, JSON, Time
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Date, Text, Enum, Numeric, Boolean, JSON, Time, Index, text
 from sqlalchemy.orm import relationship
 from database import DeptBase
 import enum
@@ -65,7 +65,7 @@ class Empleado(DeptBase):
     apellido_emp = Column(String(50), nullable=False)
     dir_emp = Column(String(200))
     tel_emp = Column(String(20))
-    email_emp = Column(String(100))
+    email_emp = Column(String(100), index=True)
     fecha_contratacion = Column(Date)
     fecha_nacimiento = Column(Date, nullable=False)
     cedula = Column(String(20), nullable=False, unique=True)
@@ -194,12 +194,28 @@ class SolicitudPrescripcion(DeptBase):
     estado_solicitud = Column(String(20), default='ENVIADA')
     fecha_respuesta_farmacia = Column(DateTime)
     observaciones_farmacia = Column(Text)
+    # Cola de farmacia: farmaceuta que tomó la solicitud y vencimiento de la asignación
+    id_emp_asignado = Column(Integer, ForeignKey("empleado.id_emp"))
+    asignado_hasta = Column(DateTime)
     created_at = Column(DateTime)
     updated_at = Column(DateTime)
     
     # Relaciones
     cita = relationship("Cita", foreign_keys=[id_cita])
     empleado_prescriptor = relationship("Empleado", foreign_keys=[id_emp_prescriptor])
+    detalles = relationship(
+        "DetalleSolicitudMedicamento",
+        order_by="DetalleSolicitudMedicamento.id_detalle_solicitud"
+    )
+    
+    __table_args__ = (
+        # Orden de la cola (/farmacia/cola/claim): solo solicitudes pendientes
+        Index(
+            "ix_solicitud_prescripcion_cola",
+            urgente.desc().nulls_last(), fecha_solicitud,
+            postgresql_where=text("estado_solicitud = 'ENVIADA'")
+        ),
+    )
 
 class DetalleSolicitudMedicamento(DeptBase):
     __tablename__ = "detalle_solicitud_medicamento"
@@ -217,4 +233,55 @@ class DetalleSolicitudMedicamento(DeptBase):
     instrucciones_especiales = Column(Text)
     via_administracion = Column(String(50))
     justificacion_medica = Column(Text)
-    created_at = Column(DateTime)
\ No newline at end of file
+    # medicamento.cod_med (BD Central) resuelto desde el texto libre; NULL si no se pudo
+    cod_med = Column(Integer, index=True)
+    created_at = Column(DateTime)
+
+class MapeoMedicamento(DeptBase):
+    __tablename__ = "mapeo_medicamento"
+    
+    # Resolución memoizada de "nombre concentración | principio activo"
+    # normalizado a cod_med (ver utils/catalogo_utils.py)
+    clave = Column(String(400), primary_key=True)
+    cod_med = Column(Integer)  # NULL: sin resolver
+    metodo = Column(String(20), nullable=False)
+    similitud = Column(Numeric(4, 3))
+    created_at = Column(DateTime)
+
+class CitaDailyStats(DeptBase):
+    __tablename__ = "cita_daily_stats"
+    
+    # Conteo de citas por día/departamento/médico/tipo/estado, mantenido
+    # incrementalmente desde appointment_routes (ver utils/stats_utils.py)
+    fecha = Column(Date, primary_key=True)
+    id_dept = Column(Integer, primary_key=True)
+    id_emp = Column(Integer, primary_key=True)
+    id_tipo_cita = Column(Integer, primary_key=True)
+    estado = Column(String(20), primary_key=True)
+    total = Column(Integer, nullable=False, default=0)
+    updated_at = Column(DateTime)
+
+class TokenRevocado(DeptBase):
+    __tablename__ = "token_revocado"
+    
+    # Tokens de acceso invalidados antes de expirar (logout). Las filas
+    # pueden borrarse una vez pasada expira_en (ver utils/revocation_utils.py)
+    jti = Column(String(64), primary_key=True)
+    id_emp = Column(Integer, ForeignKey("empleado.id_emp"))
+    motivo = Column(String(50))
+    expira_en = Column(DateTime, nullable=False)
+    revocado_en = Column(DateTime, nullable=False, index=True)
+
+class RefreshToken(DeptBase):
+    __tablename__ = "refresh_token"
+    
+    # Solo se guarda el sha256 del token. Cada rotación crea una fila nueva en
+    # la misma familia; reutilizar una fila ya usada revoca toda la familia
+    token_hash = Column(String(64), primary_key=True)
+    family_id = Column(String(32), nullable=False, index=True)
+    id_emp = Column(Integer, ForeignKey("empleado.id_emp"), index=True)
+    claims = Column(JSON, nullable=False)
+    expira_en = Column(DateTime, nullable=False)
+    usado_en = Column(DateTime)
+    revocado = Column(Boolean, nullable=False, default=False)
+    created_at = Column(DateTime)
@@ -0,0 +1,29 @@
+# exportar_analitica.py
+# Ejecutar: python exportar_analitica.py --salida ./export [--tablas cita,paciente] [--completo]
+# Requiere EXPORT_ANON_SALT para seudonimizar los identificadores de pacientes.
+
+import argparse
+
+from utils.export_utils import exportar_analitica
+
+def main():
+    """Exportar datos del departamento a Parquet para BI"""
+    parser = argparse.ArgumentParser(description="Exportación analítica a Parquet")
+    parser.add_argument("--salida", default="export", help="Directorio de salida")
+    parser.add_argument("--tablas", help="Tablas separadas por coma (por defecto todas)")
+    parser.add_argument("--completo", action="store_true", help="Ignorar el estado incremental y exportar todo")
+    args = parser.parse_args()
+    
+    tablas = [t.strip() for t in args.tablas.split(",")] if args.tablas else None
+    
+    print("📦 Exportando datos analíticos a Parquet...")
+    try:
+        resumen = exportar_analitica(args.salida, tablas, args.completo)
+        for tabla, filas in resumen.items():
+            print(f"✅ {tabla}: {filas} filas")
+        print(f"🎉 Exportación completada en {args.salida}")
+    except Exception as e:
+        print(f"❌ Error en la exportación: {e}")
+
+if __name__ == "__main__":
+    main()
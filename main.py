@@ -1,14 +1,38 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.concurrency import run_in_threadpool
 from contextlib import asynccontextmanager
+import asyncio
 from database import get_central_db, get_dept_db
 from central_models import Paciente
 from dept_models import Empleado
+from utils.metrics_utils import obtener_metricas
+from utils.password_utils import cerrar_pool as cerrar_pool_passwords
+from utils.maintenance_utils import bucle_mantenimiento
+from utils.revocation_utils import sincronizar_revocaciones, REVOCACION_SYNC_SECONDS
+from utils.permission_utils import recargar_permisos, PERMISOS_RECARGA_SECONDS
+from utils.refresh_utils import purgar_refresh_tokens
+from utils.jwks_utils import recargar_llaves, JWT_JWKS_CACHE_SECONDS
+from utils.stock_utils import (
+    expirar_reservas, vencer_medicamentos, purgar_eventos_stock,
+    RESERVAS_EXPIRAR_SECONDS, VENCIMIENTO_BARRIDO_SECONDS
+)
 
 # Importar todas las rutas
 from routes import patient_routes, employee_routes
 from routes import appointment_routes, interconsulta_routes, farmacia_routes
-from routes import auth_routes
+from routes import auth_routes, dashboard_routes
+
+# Tareas periódicas de cada worker: (nombre, función, intervalo en segundos)
+TAREAS_MANTENIMIENTO = [
+    ("revocaciones", sincronizar_revocaciones, REVOCACION_SYNC_SECONDS),
+    ("permisos", recargar_permisos, PERMISOS_RECARGA_SECONDS),
+    ("refresh_tokens_expirados", purgar_refresh_tokens, 3600),
+    ("llaves_jwt", recargar_llaves, JWT_JWKS_CACHE_SECONDS),
+    ("reservas_expiradas", expirar_reservas, RESERVAS_EXPIRAR_SECONDS),
+    ("medicamentos_vencidos", vencer_medicamentos, VENCIMIENTO_BARRIDO_SECONDS),
+    ("eventos_stock_antiguos", purgar_eventos_stock, 3600),
+]
 
 # ========== LIFESPAN EVENTS (REEMPLAZA on_event) ==========
 @asynccontextmanager
@@ -31,6 +55,12 @@ async def lifespan(app: FastAPI):
         dept_db.close()
         print(f"✅ BD Departamento conectada - {empleados_count} empleados registrados")
         
+        # Cargar los tokens revocados antes de atender peticiones
+        await run_in_threadpool(sincronizar_revocaciones)
+        print("✅ Revocaciones de tokens cargadas")
+        await run_in_threadpool(recargar_permisos)
+        print("✅ Permisos por rol compilados")
+        
         print("🔐 Sistema de autenticación: Activo")
         print("📋 Gestión de pacientes: Activo")
         print("👥 Gestión de empleados: Activo")
@@ -46,10 +76,15 @@ async def lifespan(app: FastAPI):
         print(f"❌ Error crítico durante el inicio: {e}")
         print("⚠️ Algunas funcionalidades pueden no estar disponibles")
     
+    mantenimiento = asyncio.create_task(bucle_mantenimiento(TAREAS_MANTENIMIENTO))
+    
     yield  # ← PUNTO DONDE LA APP ESTÁ CORRIENDO
     
     # ✅ SHUTDOWN
     print("🔄 Cerrando Hospital API...")
+    mantenimiento.cancel()
+    print("🔐 Deteniendo pool de hashing de contraseñas...")
+    cerrar_pool_passwords()
     print("💾 Cerrando conexiones de base de datos...")
     print("✅ Hospital API cerrado correctamente")
 
@@ -86,6 +121,7 @@ app.include_router(employee_routes.router, prefix="/employees", tags=["employees
 app.include_router(appointment_routes.router, prefix="/appointments", tags=["appointments"])
 app.include_router(interconsulta_routes.router, prefix="/interconsultas", tags=["interconsultas"])
 app.include_router(farmacia_routes.router, prefix="/farmacia", tags=["farmacia"])
+app.include_router(dashboard_routes.router, prefix="/dashboard", tags=["dashboard"])
 
 @app.get("/")
 def read_root():
@@ -100,7 +136,8 @@ def read_root():
             "employees": "/employees", 
             "appointments": "/appointments",
             "interconsultas": "/interconsultas",
-            "farmacia": "/farmacia"
+            "farmacia": "/farmacia",
+            "dashboard": "/dashboard"
         },
         "documentation": {
             "swagger": "/docs",
@@ -156,6 +193,14 @@ def health_check():
             "timestamp": "2025-07-10T12:00:00Z"
         }
 
+@app.get("/metrics")
+def metrics():
+    """Métricas internas del proceso (tiempos de espera de locks, contadores)"""
+    return {
+        "status": "ok",
+        "metrics": obtener_metricas()
+    }
+
 # ========== MANEJO DE ERRORES GLOBALES ==========
 @app.exception_handler(404)
 async def not_found_handler(request, exc):
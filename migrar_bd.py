@@ -0,0 +1,121 @@
+# migrar_bd.py
+# Ejecutar: python migrar_bd.py
+# Crea las tablas e índices nuevos que no existen todavía (idempotente).
+
+from sqlalchemy import text
+
+from database import central_engine, dept_engine
+from dept_models import (
+    Empleado, CitaDailyStats, TokenRevocado, RefreshToken, SolicitudPrescripcion,
+    DetalleSolicitudMedicamento, MapeoMedicamento
+)
+from central_models import Medicamento, ReservaStock, ReservaStockDetalle, EventoStock
+
+# Tablas nuevas de la BD Departamento
+TABLAS_DEPT = [
+    CitaDailyStats.__table__,
+    TokenRevocado.__table__,
+    RefreshToken.__table__,
+    MapeoMedicamento.__table__,
+]
+
+# Tablas nuevas de la BD Central
+TABLAS_CENTRAL = [
+    ReservaStock.__table__,
+    ReservaStockDetalle.__table__,
+    EventoStock.__table__,
+]
+
+# Columnas nuevas en tablas existentes: (engine, columna)
+COLUMNAS = [
+    # Cola de farmacia
+    (dept_engine, SolicitudPrescripcion.__table__.c.id_emp_asignado),
+    (dept_engine, SolicitudPrescripcion.__table__.c.asignado_hasta),
+    # Medicamento de catálogo de cada línea
+    (dept_engine, DetalleSolicitudMedicamento.__table__.c.cod_med),
+]
+
+# Columnas existentes cuyo tipo cambió: (engine, columna)
+TIPOS = [
+    # La clave del mapeo incluye el principio activo
+    (dept_engine, MapeoMedicamento.__table__.c.clave),
+]
+
+def _indice(modelo, nombre):
+    return next(i for i in modelo.__table__.indexes if i.name == nombre)
+
+# Índices nuevos sobre tablas existentes: (engine, índice)
+INDICES = [
+    # Búsqueda de login por email
+    (dept_engine, _indice(Empleado, "ix_empleado_email_emp")),
+    # Cola de farmacia
+    (dept_engine, _indice(SolicitudPrescripcion, "ix_solicitud_prescripcion_cola")),
+    # Demanda por medicamento
+    (dept_engine, _indice(DetalleSolicitudMedicamento, "ix_detalle_solicitud_medicamento_cod_med")),
+    # Barrido de vencimientos y medicamentos por vencer
+    (central_engine, _indice(Medicamento, "ix_medicamento_vencimiento_pendiente")),
+    # Medicamentos en stock bajo
+    (central_engine, _indice(Medicamento, "ix_medicamento_stock_bajo")),
+]
+
+# Índices reemplazados por otros: (engine, nombre)
+INDICES_OBSOLETOS = [
+    # Reemplazado por el parcial ix_medicamento_vencimiento_pendiente
+    (central_engine, "ix_medicamento_fecha_vencimiento"),
+]
+
+def crear_tablas(engine, tablas, nombre_bd):
+    """Crear tablas que aún no existen"""
+    for tabla in tablas:
+        tabla.create(bind=engine, checkfirst=True)
+        print(f"✅ {nombre_bd}: tabla {tabla.name} lista")
+
+def crear_columnas():
+    """Agregar columnas que aún no existen"""
+    for engine, columna in COLUMNAS:
+        definicion = f"{columna.name} {columna.type.compile(dialect=engine.dialect)}"
+        for fk in columna.foreign_keys:
+            definicion += f" REFERENCES {fk.column.table.name} ({fk.column.name})"
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {columna.table.name} ADD COLUMN IF NOT EXISTS {definicion}"))
+        print(f"✅ Columna {columna.table.name}.{columna.name} lista")
+
+def ajustar_tipos():
+    """Llevar columnas existentes a su tipo actual (ALTER ... TYPE es idempotente)"""
+    for engine, columna in TIPOS:
+        tipo = columna.type.compile(dialect=engine.dialect)
+        with engine.begin() as conn:
+            conn.execute(text(f"ALTER TABLE {columna.table.name} ALTER COLUMN {columna.name} TYPE {tipo}"))
+        print(f"✅ Tipo de {columna.table.name}.{columna.name} listo")
+
+def crear_indices():
+    """Crear índices que aún no existen"""
+    for engine, indice in INDICES:
+        indice.create(bind=engine, checkfirst=True)
+        print(f"✅ Índice {indice.name} listo")
+
+def borrar_indices_obsoletos():
+    """Borrar índices que ya no se usan"""
+    for engine, nombre in INDICES_OBSOLETOS:
+        with engine.begin() as conn:
+            conn.execute(text(f"DROP INDEX IF EXISTS {nombre}"))
+        print(f"✅ Índice {nombre} borrado")
+
+def main():
+    """Aplicar todas las migraciones"""
+    print("🛠️ MIGRANDO BASES DE DATOS")
+    print("=" * 50)
+    
+    try:
+        crear_tablas(dept_engine, TABLAS_DEPT, "BD Departamento")
+        crear_tablas(central_engine, TABLAS_CENTRAL, "BD Central")
+        crear_columnas()
+        ajustar_tipos()
+        crear_indices()
+        borrar_indices_obsoletos()
+        print("\n🎉 ¡Migración completada!")
+    except Exception as e:
+        print(f"❌ Error durante la migración: {e}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,32 @@
+# recalcular_stats_citas.py
+# Ejecutar: python recalcular_stats_citas.py [--desde YYYY-MM-DD] [--hasta YYYY-MM-DD]
+# Reconstruye el rollup cita_daily_stats a partir de la tabla cita.
+
+import argparse
+from datetime import datetime
+
+from database import get_dept_db
+from utils.stats_utils import backfill_cita_daily_stats
+
+def parse_fecha(valor):
+    return datetime.strptime(valor, '%Y-%m-%d').date() if valor else None
+
+def main():
+    """Recalcular el rollup diario de citas"""
+    parser = argparse.ArgumentParser(description="Backfill de cita_daily_stats")
+    parser.add_argument("--desde", help="Fecha desde (YYYY-MM-DD), por defecto la primera cita")
+    parser.add_argument("--hasta", help="Fecha hasta (YYYY-MM-DD), por defecto la última cita")
+    args = parser.parse_args()
+    
+    print("📊 Recalculando cita_daily_stats...")
+    db = next(get_dept_db())
+    try:
+        filas = backfill_cita_daily_stats(db, parse_fecha(args.desde), parse_fecha(args.hasta))
+        print(f"✅ Rollup recalculado: {filas} filas escritas")
+    except Exception as e:
+        print(f"❌ Error recalculando rollup: {e}")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+# resolver_cod_med.py
+# Ejecutar: python resolver_cod_med.py [--reintentar]
+# Completa detalle_solicitud_medicamento.cod_med resolviendo el texto libre
+# de cada línea contra el catálogo de la BD Central.
+
+import argparse
+
+from database import get_central_db, get_dept_db
+from utils.catalogo_utils import backfill_cod_med
+
+def main():
+    """Resolver cod_med de las líneas de prescripción existentes"""
+    parser = argparse.ArgumentParser(description="Backfill de cod_med en líneas de prescripción")
+    parser.add_argument("--reintentar", action="store_true",
+                        help="Volver a intentar los textos que antes no se pudieron resolver")
+    args = parser.parse_args()
+    
+    print("💊 Resolviendo medicamentos de las solicitudes de prescripción...")
+    central_db = next(get_central_db())
+    dept_db = next(get_dept_db())
+    try:
+        resultado = backfill_cod_med(central_db, dept_db, reintentar=args.reintentar)
+        print(f"✅ Líneas actualizadas: {resultado['lineas_actualizadas']}")
+        print(f"   Variantes de texto revisadas: {resultado['variantes']}")
+        print(f"   Variantes sin resolver: {resultado['variantes_sin_resolver']}")
+    except Exception as e:
+        dept_db.rollback()
+        print(f"❌ Error resolviendo medicamentos: {e}")
+    finally:
+        central_db.close()
+        dept_db.close()
+
+if __name__ == "__main__":
+    main()
@@ -2,16 +2,21 @@ from fastapi import APIRouter, Depends, HTTPException, status, Query
 from sqlalchemy.orm import Session, joinedload
 from typing import List, Optional
 from datetime import datetime, date, timedelta
-from sqlalchemy import and_, or_, func, desc
+from sqlalchemy import and_, or_, func, desc, tuple_
 
 # Importar dependencias de tu proyecto
 from database import get_central_db, get_dept_db
 from central_models import Paciente, DepartamentoMaster
-from dept_models import Cita, Empleado, TipoCita, Departamento, EstadoCita
+from dept_models import Cita, CitaDailyStats, Empleado, TipoCita, Departamento, EstadoCita
 from schemas import CitaCreate, CitaUpdate, CitaResponse, MessageResponse
+from utils.db_utils import lock_agenda_empleado
+from utils.stats_utils import clave_stats_cita, registrar_cambio_cita
+from utils.analytics_utils import calcular_utilizacion
 
 router = APIRouter()
 
+MAX_DIAS_UTILIZACION = 366
+
 # ===============================================
 # FUNCIONES AUXILIARES
 # ===============================================
@@ -113,6 +118,174 @@ def check_schedule_conflict(
     
     return query.first()
 
+# Desgloses disponibles para las estadísticas: nombre -> (columna clave, columnas descriptivas).
+# La columna clave se expresa para cada fuente: tabla cita y rollup cita_daily_stats.
+DIMENSIONES_STATS_CITAS = {
+    'dia': ({'cita': Cita.fecha_cita, 'rollup': CitaDailyStats.fecha}, []),
+    'medico': ({'cita': Cita.id_emp, 'rollup': CitaDailyStats.id_emp}, [Empleado.nom_emp, Empleado.apellido_emp]),
+    'tipo_cita': ({'cita': Cita.id_tipo_cita, 'rollup': CitaDailyStats.id_tipo_cita}, [TipoCita.nombre_tipo]),
+    'prioridad': ({'cita': Cita.prioridad, 'rollup': None}, [])
+}
+
+def _valor_estado(estado):
+    if isinstance(estado, EstadoCita):
+        return estado.value
+    return estado or 'SIN_ESTADO'
+
+def _clave_desglose(dimension: str, row):
+    """Representación JSON de la clave de un grupo del desglose"""
+    if dimension == 'dia':
+        return {'fecha': row.dia.isoformat() if row.dia else None}
+    if dimension == 'medico':
+        return {
+            'id_emp': row.medico,
+            'nombre': f"{row.nom_emp} {row.apellido_emp}" if row.nom_emp else None
+        }
+    if dimension == 'tipo_cita':
+        return {'id_tipo_cita': row.tipo_cita, 'nombre': row.nombre_tipo}
+    return {'prioridad': row.prioridad}
+
+def calcular_stats_citas(
+    dept_db: Session,
+    fecha_desde: date,
+    fecha_hasta: date,
+    departamento_id: Optional[int] = None,
+    dimensiones: Optional[List[str]] = None
+):
+    """Conteos por estado y desgloses opcionales en una sola consulta.
+
+    Usa GROUPING SETS: un conjunto (estado) para los totales y un conjunto
+    (dimensión, estado) por cada desglose pedido, de modo que el rango de
+    fechas se recorre una sola vez. Se lee del rollup cita_daily_stats
+    (costo proporcional a los días, no a las citas) salvo que se pida el
+    desglose por prioridad, que no forma parte del rollup.
+    """
+    dimensiones = dimensiones or []
+    fuente = 'cita' if 'prioridad' in dimensiones else 'rollup'
+    
+    if fuente == 'rollup':
+        fecha_col, dept_col, estado_col = CitaDailyStats.fecha, CitaDailyStats.id_dept, CitaDailyStats.estado
+        conteo = func.sum(CitaDailyStats.total)
+    else:
+        fecha_col, dept_col, estado_col = Cita.fecha_cita, Cita.id_dept, Cita.estado_cita
+        conteo = func.count()
+    
+    claves = [DIMENSIONES_STATS_CITAS[d][0][fuente] for d in dimensiones]
+    descriptivas = [col for d in dimensiones for col in DIMENSIONES_STATS_CITAS[d][1]]
+    
+    columnas = [
+        estado_col.label('estado'),
+        *[col.label(d) for d, col in zip(dimensiones, claves)],
+        *descriptivas,
+        conteo.label('total')
+    ]
+    if claves:
+        columnas.append(func.grouping(*claves).label('grupo'))
+    
+    query = dept_db.query(*columnas).filter(
+        and_(
+            fecha_col >= fecha_desde,
+            fecha_col <= fecha_hasta
+        )
+    )
+    if 'medico' in dimensiones:
+        query = query.outerjoin(Empleado, Empleado.id_emp == DIMENSIONES_STATS_CITAS['medico'][0][fuente])
+    if 'tipo_cita' in dimensiones:
+        query = query.outerjoin(TipoCita, TipoCita.id_tipo_cita == DIMENSIONES_STATS_CITAS['tipo_cita'][0][fuente])
+    if departamento_id:
+        query = query.filter(dept_col == departamento_id)
+    
+    if claves:
+        conjuntos = [tuple_(estado_col)] + [
+            tuple_(clave, *DIMENSIONES_STATS_CITAS[d][1], estado_col)
+            for d, clave in zip(dimensiones, claves)
+        ]
+        query = query.group_by(func.grouping_sets(*conjuntos))
+    else:
+        query = query.group_by(estado_col)
+    
+    por_estado = {estado.value: 0 for estado in EstadoCita}
+    desgloses = {d: {} for d in dimensiones}
+    todos_agrupados = (1 << len(claves)) - 1
+    
+    for row in query.all():
+        if not row.total:
+            continue
+        estado = _valor_estado(row.estado)
+        total = int(row.total)
+        grupo = row.grupo if claves else todos_agrupados
+        
+        if grupo == todos_agrupados:
+            por_estado[estado] = por_estado.get(estado, 0) + total
+            continue
+        
+        # El bit en 0 indica qué dimensión generó la fila
+        for i, dimension in enumerate(dimensiones):
+            if not grupo & (1 << (len(claves) - 1 - i)):
+                clave = _clave_desglose(dimension, row)
+                item = desgloses[dimension].setdefault(
+                    tuple(clave.values()),
+                    {**clave, 'total': 0, 'por_estado': {}}
+                )
+                item['total'] += total
+                item['por_estado'][estado] = total
+                break
+    
+    return {
+        'total_citas': sum(por_estado.values()),
+        'por_estado': por_estado,
+        **{
+            f'por_{dimension}': [
+                item for clave, item in sorted(
+                    items.items(),
+                    key=lambda kv: (kv[0][0] is None, kv[0][0] if kv[0][0] is not None else 0)
+                )
+            ]
+            for dimension, items in desgloses.items()
+        }
+    }
+
+def obtener_citas_del_dia(
+    central_db: Session,
+    dept_db: Session,
+    fecha: date,
+    departamento_id: Optional[int] = None,
+    empleado_id: Optional[int] = None,
+    estado: Optional[EstadoCita] = None
+):
+    """Citas serializadas de un día, ordenadas por hora"""
+    query = dept_db.query(Cita).options(
+        joinedload(Cita.empleado).joinedload(Empleado.rol),
+        joinedload(Cita.tipo_cita),
+        joinedload(Cita.departamento)
+    ).filter(Cita.fecha_cita == fecha)
+    
+    if departamento_id:
+        query = query.filter(Cita.id_dept == departamento_id)
+    
+    if empleado_id:
+        query = query.filter(Cita.id_emp == empleado_id)
+    
+    if estado:
+        query = query.filter(Cita.estado_cita == estado)
+    
+    citas = query.order_by(Cita.hora_inicio).all()
+    
+    # Obtener datos de pacientes
+    pacientes_ids = [cita.cod_pac for cita in citas]
+    pacientes = central_db.query(Paciente).filter(
+        Paciente.cod_pac.in_(pacientes_ids)
+    ).all()
+    pacientes_dict = {p.cod_pac: p for p in pacientes}
+    
+    citas_serializadas = []
+    for cita in citas:
+        serialized = serialize_cita_complete(cita, pacientes_dict.get(cita.cod_pac))
+        if serialized:
+            citas_serializadas.append(serialized)
+    
+    return citas_serializadas
+
 # ===============================================
 # ENDPOINTS DE CITAS
 # ===============================================
@@ -286,6 +459,9 @@ def create_appointment(
         fecha_cita = datetime.strptime(cita_data.fecha_cita, '%Y-%m-%d').date()
         hora_inicio = datetime.strptime(cita_data.hora_inicio, '%H:%M').time()
         
+        # Serializar reservas del mismo empleado y día hasta el commit
+        lock_agenda_empleado(dept_db, cita_data.id_emp, fecha_cita)
+        
         conflicto = check_schedule_conflict(
             cita_data.id_emp, fecha_cita, hora_inicio, None, dept_db
         )
@@ -326,6 +502,7 @@ def create_appointment(
         )
         
         dept_db.add(nueva_cita)
+        registrar_cambio_cita(dept_db, None, clave_stats_cita(nueva_cita))
         dept_db.commit()
         dept_db.refresh(nueva_cita)
         
@@ -361,25 +538,10 @@ def get_today_appointments(
 ):
     """Obtener citas del día de hoy"""
     try:
-        today = date.today()
-        
-        # Construir query
-        query = dept_db.query(Cita).options(
-            joinedload(Cita.empleado).joinedload(Empleado.rol),
-            joinedload(Cita.tipo_cita),
-            joinedload(Cita.departamento)
-        ).filter(Cita.fecha_cita == today)
-        
-        if departamento_id:
-            query = query.filter(Cita.id_dept == departamento_id)
-        
-        if empleado_id:
-            query = query.filter(Cita.id_emp == empleado_id)
-        
+        estado_enum = None
         if estado:
             try:
                 estado_enum = EstadoCita(estado)
-                query = query.filter(Cita.estado_cita == estado_enum)
             except ValueError:
                 valid_states = [e.value for e in EstadoCita]
                 raise HTTPException(
@@ -387,27 +549,13 @@ def get_today_appointments(
                     detail=f'Estado inválido: {estado}. Estados válidos: {valid_states}'
                 )
         
-        # Ordenar por hora
-        citas = query.order_by(Cita.hora_inicio).all()
-        
-        # Obtener datos de pacientes
-        pacientes_ids = [cita.cod_pac for cita in citas]
-        pacientes = central_db.query(Paciente).filter(
-            Paciente.cod_pac.in_(pacientes_ids)
-        ).all()
-        pacientes_dict = {p.cod_pac: p for p in pacientes}
-        
-        # Serializar resultados
-        citas_serializadas = []
-        for cita in citas:
-            paciente = pacientes_dict.get(cita.cod_pac)
-            serialized = serialize_cita_complete(cita, paciente)
-            if serialized:
-                citas_serializadas.append(serialized)
+        citas_serializadas = obtener_citas_del_dia(
+            central_db, dept_db, date.today(), departamento_id, empleado_id, estado_enum
+        )
         
         return {
             'success': True,
-            'fecha': today.isoformat(),
+            'fecha': date.today().isoformat(),
             'total_citas': len(citas_serializadas),
             'citas': citas_serializadas
         }
@@ -474,9 +622,56 @@ def update_appointment(
         if not cita:
             raise HTTPException(status_code=404, detail='Cita no encontrada')
         
+        clave_antes = clave_stats_cita(cita)
+        
         # Actualizar campos
         update_data = cita_data.dict(exclude_unset=True)
         
+        # Reprogramación: validar el nuevo horario bajo el lock de la agenda
+        nueva_fecha = update_data.pop('fecha_cita', None)
+        nueva_hora = update_data.pop('hora_inicio', None)
+        estados_activos = [EstadoCita.PROGRAMADA.value, EstadoCita.CONFIRMADA.value, EstadoCita.EN_CURSO.value]
+        reactivada = (
+            update_data.get('estado_cita') in estados_activos
+            and cita.estado_cita.value not in estados_activos
+        )
+        if nueva_fecha or nueva_hora or reactivada:
+            try:
+                fecha_cita = datetime.strptime(nueva_fecha, '%Y-%m-%d').date() if nueva_fecha else cita.fecha_cita
+            except ValueError:
+                raise HTTPException(
+                    status_code=400,
+                    detail='Formato de fecha_cita inválido. Use YYYY-MM-DD'
+                )
+            try:
+                hora_inicio = datetime.strptime(nueva_hora, '%H:%M').time() if nueva_hora else cita.hora_inicio
+            except ValueError:
+                raise HTTPException(
+                    status_code=400,
+                    detail='Formato de hora_inicio inválido. Use HH:MM'
+                )
+            
+            lock_agenda_empleado(dept_db, cita.id_emp, fecha_cita)
+            
+            conflicto = check_schedule_conflict(
+                cita.id_emp, fecha_cita, hora_inicio, cita.id_cita, dept_db
+            )
+            if conflicto:
+                raise HTTPException(
+                    status_code=409,
+                    detail={
+                        'error': 'El empleado ya tiene una cita programada en ese horario',
+                        'cita_conflicto': {
+                            'id_cita': conflicto.id_cita,
+                            'paciente': conflicto.cod_pac,
+                            'estado': conflicto.estado_cita.value
+                        }
+                    }
+                )
+            
+            cita.fecha_cita = fecha_cita
+            cita.hora_inicio = hora_inicio
+        
         for field, value in update_data.items():
             if value is not None:
                 if field == 'fecha_seguimiento' and value:
@@ -510,6 +705,7 @@ def update_appointment(
         # Actualizar timestamp
         cita.updated_at = datetime.utcnow()
         
+        registrar_cambio_cita(dept_db, clave_antes, clave_stats_cita(cita))
         dept_db.commit()
         dept_db.refresh(cita)
         
@@ -551,9 +747,11 @@ def cancel_appointment(
             )
         
         # Cambiar estado a cancelada
+        clave_antes = clave_stats_cita(cita)
         cita.estado_cita = EstadoCita.CANCELADA
         cita.updated_at = datetime.utcnow()
         
+        registrar_cambio_cita(dept_db, clave_antes, clave_stats_cita(cita))
         dept_db.commit()
         
         return {
@@ -604,6 +802,10 @@ def get_appointment_stats(
     fecha_desde: Optional[str] = Query(None, description="Fecha desde (YYYY-MM-DD)"),
     fecha_hasta: Optional[str] = Query(None, description="Fecha hasta (YYYY-MM-DD)"),
     departamento_id: Optional[int] = Query(None, description="Filtrar por departamento"),
+    agrupar_por: Optional[str] = Query(
+        None,
+        description=f"Desgloses adicionales separados por coma: {', '.join(DIMENSIONES_STATS_CITAS)}"
+    ),
     dept_db: Session = Depends(get_dept_db)
 ):
     """Obtener estadísticas de citas"""
@@ -614,45 +816,103 @@ def get_appointment_stats(
         if not fecha_hasta:
             fecha_hasta = date.today().isoformat()
         
-        fecha_desde_obj = datetime.strptime(fecha_desde, '%Y-%m-%d').date()
-        fecha_hasta_obj = datetime.strptime(fecha_hasta, '%Y-%m-%d').date()
-        
-        # Query base
-        query = dept_db.query(Cita).filter(
-            and_(
-                Cita.fecha_cita >= fecha_desde_obj,
-                Cita.fecha_cita <= fecha_hasta_obj
+        try:
+            fecha_desde_obj = datetime.strptime(fecha_desde, '%Y-%m-%d').date()
+            fecha_hasta_obj = datetime.strptime(fecha_hasta, '%Y-%m-%d').date()
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail='Formato de fecha inválido. Use YYYY-MM-DD'
             )
-        )
         
-        if departamento_id:
-            query = query.filter(Cita.id_dept == departamento_id)
-        
-        # Obtener estadísticas
-        total_citas = query.count()
+        dimensiones = list(dict.fromkeys(d.strip() for d in agrupar_por.split(',') if d.strip())) if agrupar_por else []
+        invalidas = [d for d in dimensiones if d not in DIMENSIONES_STATS_CITAS]
+        if invalidas:
+            raise HTTPException(
+                status_code=400,
+                detail=f'Desglose inválido: {invalidas}. Válidos: {list(DIMENSIONES_STATS_CITAS)}'
+            )
         
-        stats_por_estado = {}
-        for estado in EstadoCita:
-            count = query.filter(Cita.estado_cita == estado).count()
-            stats_por_estado[estado.value] = count
+        stats = calcular_stats_citas(
+            dept_db, fecha_desde_obj, fecha_hasta_obj, departamento_id, dimensiones
+        )
         
         return {
             'success': True,
             'data': {
-                'total_citas': total_citas,
-                'por_estado': stats_por_estado,
+                **stats,
                 'periodo': {
                     'fecha_desde': fecha_desde,
                     'fecha_hasta': fecha_hasta
                 },
                 'filtros_aplicados': {
-                    'departamento_id': departamento_id
+                    'departamento_id': departamento_id,
+                    'agrupar_por': dimensiones
                 }
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f'Error al obtener estadísticas: {str(e)}'
-        )
\ No newline at end of file
+        )
+
+@router.get("/utilizacion/")
+def get_appointment_utilization(
+    fecha_desde: Optional[str] = Query(None, description="Fecha desde (YYYY-MM-DD)"),
+    fecha_hasta: Optional[str] = Query(None, description="Fecha hasta (YYYY-MM-DD)"),
+    departamento_id: Optional[int] = Query(None, description="Filtrar por departamento"),
+    dept_db: Session = Depends(get_dept_db)
+):
+    """Ocupación de médicos y departamentos (matrices listas para heatmap)"""
+    try:
+        # Fechas por defecto (último mes)
+        if not fecha_desde:
+            fecha_desde = (date.today() - timedelta(days=30)).isoformat()
+        if not fecha_hasta:
+            fecha_hasta = date.today().isoformat()
+        
+        try:
+            fecha_desde_obj = datetime.strptime(fecha_desde, '%Y-%m-%d').date()
+            fecha_hasta_obj = datetime.strptime(fecha_hasta, '%Y-%m-%d').date()
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail='Formato de fecha inválido. Use YYYY-MM-DD'
+            )
+        
+        if fecha_hasta_obj < fecha_desde_obj:
+            raise HTTPException(
+                status_code=400,
+                detail='fecha_hasta debe ser posterior a fecha_desde'
+            )
+        if (fecha_hasta_obj - fecha_desde_obj).days > MAX_DIAS_UTILIZACION:
+            raise HTTPException(
+                status_code=400,
+                detail=f'El rango máximo es de {MAX_DIAS_UTILIZACION} días'
+            )
+        
+        data = calcular_utilizacion(dept_db, fecha_desde_obj, fecha_hasta_obj, departamento_id)
+        
+        return {
+            'success': True,
+            'data': data,
+            'periodo': {
+                'fecha_desde': fecha_desde,
+                'fecha_hasta': fecha_hasta
+            },
+            'filtros_aplicados': {
+                'departamento_id': departamento_id
+            }
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al calcular utilización: {str(e)}'
+        )
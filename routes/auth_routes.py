@@ -1,10 +1,22 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
+from sqlalchemy import func
+from sqlalchemy.orm import Session, joinedload, contains_eager
 from pydantic import BaseModel, EmailStr
 from typing import Optional
 from database import get_dept_db
 from dept_models import Empleado, UsuarioSistema, RolEmpleado
-from auth import verify_password, create_access_token, verify_token, hash_password
+from auth import create_access_token, verify_token, get_principal, require_administrador, ACCESS_TOKEN_EXPIRE_MINUTES
+from utils.password_utils import hashear_password, verificar_password
+from utils.cache_utils import cache_perfiles, invalidar_perfil
+from utils.revocation_utils import revocar_token
+from utils.refresh_utils import (
+    emitir_refresh_token, rotar_refresh_token, revocar_refresh_token, revocar_refresh_tokens_empleado
+)
+from utils.jwks_utils import obtener_jwks
+from utils.permission_utils import compilar_permisos, compilar_permisos_dict, version_permisos
+from utils.throttle_utils import (
+    MAX_INTENTOS_FALLIDOS, ip_cliente, verificar_limite_login, registrar_fallo_login, limpiar_fallos_login
+)
 
 router = APIRouter()
 
@@ -19,6 +31,11 @@ class LoginResponse(BaseModel):
     access_token: str
     token_type: str
     user: dict
+    refresh_token: Optional[str] = None
+    expires_in: Optional[int] = None
+
+class RefreshRequest(BaseModel):
+    refresh_token: str
 
 class UserResponse(BaseModel):
     id: int
@@ -29,70 +46,93 @@ class UserResponse(BaseModel):
     email: str
     permissions: Optional[dict] = None
 
+# Permisos del usuario demo (admin@hospital.com)
+PERMISOS_DEMO = {
+    "puede_prescribir": True,
+    "puede_ver_historias": True,
+    "puede_modificar_historias": True,
+    "puede_agendar_citas": True,
+    "puede_generar_reportes": True
+}
+
 # ===============================================
 # ENDPOINTS DE AUTENTICACIÓN
 # ===============================================
 
 @router.post("/login", response_model=LoginResponse)
-def login(login_data: LoginRequest, db: Session = Depends(get_dept_db)):
+def login(login_data: LoginRequest, request: Request, db: Session = Depends(get_dept_db)):
     """Autenticar usuario y generar token JWT"""
     try:
-        # Buscar usuario por email en la tabla de usuarios del sistema
-        usuario_sistema = db.query(UsuarioSistema).filter(
+        # Cuotas por email e IP antes de tocar la BD o bcrypt
+        verificar_limite_login(login_data.email, ip_cliente(request))
+        
+        # Usuario, empleado, rol y departamento en una sola consulta (índice en email_emp)
+        usuario_sistema = db.query(UsuarioSistema).join(UsuarioSistema.empleado).options(
+            contains_eager(UsuarioSistema.empleado).joinedload(Empleado.rol),
+            contains_eager(UsuarioSistema.empleado).joinedload(Empleado.departamento)
+        ).filter(
+            Empleado.email_emp == login_data.email,
             UsuarioSistema.cuenta_activa == True
-        ).join(Empleado).filter(
-            Empleado.email_emp == login_data.email
         ).first()
         
         if not usuario_sistema:
             # Intentar login con credenciales demo
             if login_data.email == "admin@hospital.com" and login_data.password == "123456":
-                return create_demo_login_response()
+                return create_demo_login_response(db)
             
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Usuario no encontrado o cuenta inactiva"
             )
         
-        # Verificar contraseña
-        if not verify_password(login_data.password, usuario_sistema.password_hash):
-            # Incrementar intentos fallidos
-            usuario_sistema.intentos_fallidos += 1
+        # Verificar contraseña (en el pool de hashing)
+        password_valida, nuevo_hash = verificar_password(login_data.password, usuario_sistema.password_hash)
+        if not password_valida:
+            # Los fallos se cuentan en memoria; la BD solo se escribe al bloquear
+            intentos = registrar_fallo_login(login_data.email)
             
             # Bloquear cuenta después de 5 intentos
-            if usuario_sistema.intentos_fallidos >= 5:
+            if usuario_sistema.intentos_fallidos + intentos >= MAX_INTENTOS_FALLIDOS:
+                usuario_sistema.intentos_fallidos += intentos
                 usuario_sistema.cuenta_activa = False
                 db.commit()
+                limpiar_fallos_login(login_data.email)
                 raise HTTPException(
                     status_code=status.HTTP_401_UNAUTHORIZED,
                     detail="Cuenta bloqueada por múltiples intentos fallidos"
                 )
             
-            db.commit()
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Contraseña incorrecta"
             )
         
         # Reset intentos fallidos en login exitoso
+        limpiar_fallos_login(login_data.email)
         usuario_sistema.intentos_fallidos = 0
+        # Actualizar el hash si se guardó con una política de costo anterior
+        if nuevo_hash:
+            usuario_sistema.password_hash = nuevo_hash
         from datetime import datetime
         usuario_sistema.ultimo_acceso = datetime.utcnow()
-        db.commit()
         
         # Obtener datos del empleado y rol
         empleado = usuario_sistema.empleado
         rol = empleado.rol if empleado.rol else None
         
-        # Crear token JWT
-        access_token = create_access_token(data={
+        # Crear token JWT y refresh token de la nueva sesión
+        claims = {
             "sub": str(empleado.id_emp),
             "username": usuario_sistema.username,
             "role": rol.nombre_rol if rol else "USUARIO",
-            "dept_id": empleado.id_dept
-        })
+            "dept_id": empleado.id_dept,
+            "perm": compilar_permisos(rol) if rol else 0,
+            "pv": version_permisos()
+        }
+        access_token = create_access_token(data=claims)
+        refresh_token = emitir_refresh_token(db, claims, id_emp=empleado.id_emp)
         
-        # Preparar respuesta del usuario
+        # Preparar respuesta del usuario (antes del commit, que expira los objetos cargados)
         user_data = {
             "id": empleado.id_emp,
             "username": usuario_sistema.username,
@@ -104,11 +144,14 @@ def login(login_data: LoginRequest, db: Session = Depends(get_dept_db)):
             "numero_licencia": empleado.numero_licencia,
             "permissions": rol.permisos_sistema if rol else {}
         }
+        db.commit()
         
         return {
             "access_token": access_token,
             "token_type": "bearer",
-            "user": user_data
+            "user": user_data,
+            "refresh_token": refresh_token,
+            "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
         }
         
     except HTTPException:
@@ -119,19 +162,26 @@ def login(login_data: LoginRequest, db: Session = Depends(get_dept_db)):
             detail=f"Error interno durante autenticación: {str(e)}"
         )
 
-def create_demo_login_response():
+def create_demo_login_response(db: Session):
     """Crear respuesta de login para usuario demo"""
     # Crear token demo
-    access_token = create_access_token(data={
+    claims = {
         "sub": "demo_user",
         "username": "admin",
         "role": "MEDICO_ESPECIALISTA",
-        "dept_id": 1
-    })
+        "dept_id": 1,
+        "perm": compilar_permisos_dict(PERMISOS_DEMO),
+        "pv": version_permisos()
+    }
+    access_token = create_access_token(data=claims)
+    refresh_token = emitir_refresh_token(db, claims)
+    db.commit()
     
     return {
         "access_token": access_token,
         "token_type": "bearer",
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
         "user": {
             "id": 999,
             "username": "admin",
@@ -141,16 +191,37 @@ def create_demo_login_response():
             "email": "admin@hospital.com",
             "especialidad": "Cardiología Intervencionista",
             "numero_licencia": "DEMO123456",
-            "permissions": {
-                "puede_prescribir": True,
-                "puede_ver_historias": True,
-                "puede_modificar_historias": True,
-                "puede_agendar_citas": True,
-                "puede_generar_reportes": True
-            }
+            "permissions": PERMISOS_DEMO
         }
     }
 
+@router.post("/refresh")
+def refresh(refresh_data: RefreshRequest, db: Session = Depends(get_dept_db)):
+    """Emitir un nuevo access token rotando el refresh token (sin contraseña)"""
+    try:
+        claims, nuevo_refresh = rotar_refresh_token(db, refresh_data.refresh_token)
+        
+        return {
+            "access_token": create_access_token(data=claims),
+            "refresh_token": nuevo_refresh,
+            "token_type": "bearer",
+            "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error refrescando token: {str(e)}"
+        )
+
+@router.get("/jwks")
+def get_jwks():
+    """Llaves públicas (JWKS) para verificar los tokens en otros nodos"""
+    return obtener_jwks()
+
 @router.get("/me", response_model=UserResponse)
 def get_current_user(token: str = Depends(verify_token), db: Session = Depends(get_dept_db)):
     """Obtener información del usuario autenticado"""
@@ -170,37 +241,40 @@ def get_current_user(token: str = Depends(verify_token), db: Session = Depends(g
                 "role": "MEDICO_ESPECIALISTA",
                 "department": "Cardiología",
                 "email": "admin@hospital.com",
-                "permissions": {
-                    "puede_prescribir": True,
-                    "puede_ver_historias": True,
-                    "puede_modificar_historias": True,
-                    "puede_agendar_citas": True,
-                    "puede_generar_reportes": True
-                }
+                "permissions": PERMISOS_DEMO
             }
         
-        # Buscar empleado por ID del token
-        empleado = db.query(Empleado).filter(Empleado.id_emp == int(token)).first()
-        if not empleado:
+        id_emp = int(token)
+        perfil = cache_perfiles.get(id_emp)
+        if perfil is not None:
+            return perfil
+        
+        # Empleado, usuario del sistema, rol y departamento en una sola consulta
+        resultado = db.query(Empleado, UsuarioSistema.username).outerjoin(
+            UsuarioSistema, UsuarioSistema.id_emp == Empleado.id_emp
+        ).options(
+            joinedload(Empleado.rol),
+            joinedload(Empleado.departamento)
+        ).filter(Empleado.id_emp == id_emp).first()
+        if not resultado:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Usuario no encontrado"
             )
         
-        # Buscar usuario del sistema
-        usuario_sistema = db.query(UsuarioSistema).filter(
-            UsuarioSistema.id_emp == empleado.id_emp
-        ).first()
+        empleado, username = resultado
         
-        return {
+        perfil = {
             "id": empleado.id_emp,
-            "username": usuario_sistema.username if usuario_sistema else empleado.cedula,
+            "username": username if username else empleado.cedula,
             "name": f"{empleado.nom_emp} {empleado.apellido_emp}",
             "role": empleado.rol.nombre_rol if empleado.rol else "USUARIO",
             "department": empleado.departamento.nom_dept if empleado.departamento else "Sin departamento",
             "email": empleado.email_emp,
             "permissions": empleado.rol.permisos_sistema if empleado.rol else {}
         }
+        cache_perfiles.set(id_emp, perfil)
+        return perfil
         
     except HTTPException:
         raise
@@ -211,8 +285,31 @@ def get_current_user(token: str = Depends(verify_token), db: Session = Depends(g
         )
 
 @router.post("/logout")
-def logout():
-    """Cerrar sesión (en el frontend se debe eliminar el token)"""
+def logout(
+    refresh_data: Optional[RefreshRequest] = None,
+    principal: dict = Depends(get_principal),
+    db: Session = Depends(get_dept_db)
+):
+    """Cerrar sesión revocando el token actual y, si se envía, su refresh token"""
+    try:
+        if refresh_data:
+            revocar_refresh_token(db, refresh_data.refresh_token)
+        if principal["jti"]:
+            from datetime import datetime
+            revocar_token(
+                db,
+                principal["jti"],
+                expira_en=datetime.utcfromtimestamp(principal["exp"]),
+                id_emp=int(principal["user_id"]) if principal["user_id"].isdigit() else None
+            )
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Error cerrando sesión: {str(e)}"
+        )
+    
     return {
         "message": "Sesión cerrada exitosamente",
         "success": True
@@ -245,7 +342,8 @@ def change_password(
             )
         
         # Verificar contraseña actual
-        if not verify_password(current_password, usuario_sistema.password_hash):
+        password_valida, _ = verificar_password(current_password, usuario_sistema.password_hash)
+        if not password_valida:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Contraseña actual incorrecta"
@@ -259,11 +357,14 @@ def change_password(
             )
         
         # Actualizar contraseña
-        usuario_sistema.password_hash = hash_password(new_password)
+        usuario_sistema.password_hash = hashear_password(new_password)
         from datetime import datetime
         usuario_sistema.updated_at = datetime.utcnow()
+        # Cerrar las demás sesiones del usuario
+        revocar_refresh_tokens_empleado(db, usuario_sistema.id_emp)
         
         db.commit()
+        invalidar_perfil(usuario_sistema.id_emp)
         
         return {
             "message": "Contraseña actualizada exitosamente",
@@ -284,7 +385,8 @@ def register_user(
     empleado_id: int,
     username: str,
     password: str,
-    db: Session = Depends(get_dept_db)
+    db: Session = Depends(get_dept_db),
+    _: dict = Depends(require_administrador)
 ):
     """Registrar nuevo usuario del sistema (solo para administradores)"""
     try:
@@ -323,7 +425,7 @@ def register_user(
         nuevo_usuario = UsuarioSistema(
             id_emp=empleado_id,
             username=username,
-            password_hash=hash_password(password),
+            password_hash=hashear_password(password),
             salt=secrets.token_hex(16),
             fecha_creacion=datetime.utcnow(),
             ultimo_acceso=None,
@@ -338,6 +440,7 @@ def register_user(
         db.add(nuevo_usuario)
         db.commit()
         db.refresh(nuevo_usuario)
+        invalidar_perfil(empleado_id)
         
         return {
             "message": "Usuario registrado exitosamente",
@@ -358,13 +461,45 @@ def register_user(
 
 @router.get("/users")
 def get_all_users(
-    skip: int = 0,
-    limit: int = 50,
-    db: Session = Depends(get_dept_db)
+    skip: int = Query(0, ge=0, description="Registros a saltar (solo sin cursor)"),
+    limit: int = Query(50, ge=1, le=500),
+    cursor: Optional[int] = Query(None, description="id_usuario del último registro de la página anterior"),
+    activo: Optional[bool] = Query(None, description="Filtrar por cuenta activa"),
+    rol: Optional[str] = Query(None, description="Nombre del rol"),
+    departamento_id: Optional[int] = Query(None),
+    db: Session = Depends(get_dept_db),
+    _: dict = Depends(require_administrador)
 ):
     """Obtener lista de usuarios del sistema (solo para administradores)"""
     try:
-        usuarios = db.query(UsuarioSistema).join(Empleado).offset(skip).limit(limit).all()
+        filtros = []
+        if activo is not None:
+            filtros.append(UsuarioSistema.cuenta_activa == activo)
+        if rol:
+            filtros.append(RolEmpleado.nombre_rol == rol)
+        if departamento_id:
+            filtros.append(Empleado.id_dept == departamento_id)
+        
+        # Total real con los mismos filtros, sin cargar filas
+        total = db.query(func.count(UsuarioSistema.id_usuario)).join(
+            UsuarioSistema.empleado
+        ).outerjoin(Empleado.rol).filter(*filtros).scalar()
+        
+        # Usuario, empleado, rol y departamento en una sola consulta
+        query = db.query(UsuarioSistema).join(UsuarioSistema.empleado).outerjoin(Empleado.rol).options(
+            contains_eager(UsuarioSistema.empleado).contains_eager(Empleado.rol),
+            contains_eager(UsuarioSistema.empleado).joinedload(Empleado.departamento)
+        ).filter(*filtros).order_by(UsuarioSistema.id_usuario)
+        
+        if cursor is not None:
+            query = query.filter(UsuarioSistema.id_usuario > cursor)
+        else:
+            query = query.offset(skip)
+        
+        # Una fila extra indica si hay página siguiente
+        usuarios = query.limit(limit + 1).all()
+        hay_mas = len(usuarios) > limit
+        usuarios = usuarios[:limit]
         
         result = []
         for usuario in usuarios:
@@ -382,12 +517,13 @@ def get_all_users(
         
         return {
             "success": True,
-            "total": len(result),
-            "users": result
+            "total": total,
+            "users": result,
+            "next_cursor": usuarios[-1].id_usuario if hay_mas else None
         }
         
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Error obteniendo usuarios: {str(e)}"
-        )
\ No newline at end of file
+        )
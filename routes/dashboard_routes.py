@@ -0,0 +1,114 @@
+import asyncio
+import os
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
+from typing import Optional
+from datetime import datetime, date, timedelta
+
+from database import CentralSessionLocal, DeptSessionLocal
+from central_models import Paciente
+from dept_models import Empleado
+from routes.appointment_routes import calcular_stats_citas, obtener_citas_del_dia
+from routes.interconsulta_routes import calcular_stats_interconsultas
+from utils.cache_utils import TTLCache
+
+router = APIRouter()
+
+# El dashboard se recalcula como máximo una vez cada TTL por departamento
+DASHBOARD_CACHE_TTL_SECONDS = float(os.getenv("DASHBOARD_CACHE_TTL_SECONDS", "15"))
+DASHBOARD_DIAS_STATS = 30
+
+_cache_dashboard = TTLCache("dashboard", ttl_seconds=DASHBOARD_CACHE_TTL_SECONDS, max_entries=256)
+
+# ===============================================
+# FUNCIONES AUXILIARES
+# ===============================================
+# Cada agregación abre su propia sesión: las sesiones de SQLAlchemy no
+# se comparten entre hilos y aquí las consultas corren en paralelo.
+
+def _con_sesion(session_factory, funcion, *args):
+    db = session_factory()
+    try:
+        return funcion(db, *args)
+    finally:
+        db.close()
+
+def _con_ambas_sesiones(funcion, *args):
+    central_db = CentralSessionLocal()
+    dept_db = DeptSessionLocal()
+    try:
+        return funcion(central_db, dept_db, *args)
+    finally:
+        central_db.close()
+        dept_db.close()
+
+def _contar_pacientes(central_db):
+    return central_db.query(Paciente).count()
+
+def _contar_empleados(dept_db, departamento_id):
+    query = dept_db.query(Empleado)
+    if departamento_id:
+        query = query.filter(Empleado.id_dept == departamento_id)
+    return query.count()
+
+async def _calcular_dashboard(departamento_id: Optional[int]):
+    """Ejecutar todas las agregaciones del dashboard en paralelo"""
+    hoy = date.today()
+    desde = hoy - timedelta(days=DASHBOARD_DIAS_STATS)
+    
+    (
+        stats_citas,
+        stats_interconsultas,
+        total_pacientes,
+        total_empleados,
+        citas_hoy
+    ) = await asyncio.gather(
+        run_in_threadpool(_con_sesion, DeptSessionLocal, calcular_stats_citas, desde, hoy, departamento_id),
+        run_in_threadpool(_con_sesion, DeptSessionLocal, calcular_stats_interconsultas, desde, hoy, departamento_id),
+        run_in_threadpool(_con_sesion, CentralSessionLocal, _contar_pacientes),
+        run_in_threadpool(_con_sesion, DeptSessionLocal, _contar_empleados, departamento_id),
+        run_in_threadpool(_con_ambas_sesiones, obtener_citas_del_dia, hoy, departamento_id)
+    )
+    
+    return {
+        'generado_en': datetime.utcnow().isoformat(),
+        'periodo_stats': {
+            'fecha_desde': desde.isoformat(),
+            'fecha_hasta': hoy.isoformat()
+        },
+        'citas': stats_citas,
+        'interconsultas': stats_interconsultas,
+        'pacientes': {'total': total_pacientes},
+        'empleados': {'total': total_empleados},
+        'citas_hoy': {
+            'fecha': hoy.isoformat(),
+            'total_citas': len(citas_hoy),
+            'citas': citas_hoy
+        }
+    }
+
+# ===============================================
+# ENDPOINTS DE DASHBOARD
+# ===============================================
+
+@router.get("/")
+async def get_dashboard(
+    departamento_id: Optional[int] = Query(None, description="Filtrar por departamento")
+):
+    """Resumen del hospital para el dashboard (cacheado unos segundos)"""
+    try:
+        data = await _cache_dashboard.get_or_compute(
+            departamento_id,
+            lambda: _calcular_dashboard(departamento_id)
+        )
+        return {
+            'success': True,
+            'data': data,
+            'cache_ttl_segundos': DASHBOARD_CACHE_TTL_SECONDS
+        }
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al obtener dashboard: {str(e)}'
+        )
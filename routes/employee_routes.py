@@ -4,6 +4,8 @@ from typing import List, Optional
 from database import get_dept_db
 from dept_models import Empleado, RolEmpleado, Departamento
 from schemas import EmployeeCreate, EmployeeUpdate, EmployeeResponse, MessageResponse, CountResponse
+from utils.cache_utils import invalidar_perfil
+from utils.refresh_utils import revocar_refresh_tokens_empleado
 
 router = APIRouter()
 
@@ -457,8 +459,14 @@ def update_employee(
                
                setattr(db_employee, field, value)
        
+       # Un cambio de rol o departamento exige un nuevo login para actualizar los claims
+       if 'id_rol' in employee_data or 'id_dept' in employee_data:
+           revocar_refresh_tokens_empleado(db, employee_id)
+       
        db.commit()
        db.refresh(db_employee)
+       # Nombre, rol, departamento o email pueden haber cambiado
+       invalidar_perfil(employee_id)
        
        return {
            "success": True,
@@ -502,6 +510,7 @@ def delete_employee(
        estado_anterior = db_employee.estado_empleado.value if db_employee.estado_empleado else "ACTIVO"
        db_employee.estado_empleado = EstadoEmpleado.INACTIVO
        db.commit()
+       invalidar_perfil(employee_id)
        
        return {
            "success": True,
@@ -1,13 +1,26 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session, joinedload
+from sqlalchemy.orm import Session, joinedload, selectinload
 from typing import Optional
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 
 from database import get_central_db, get_dept_db
-from sqlalchemy import and_, or_, func
-from central_models import Paciente, HistoriaClinica, Medicamento, Laboratorio, CategoriaMedicamento
-from dept_models import SolicitudPrescripcion, DetalleSolicitudMedicamento, Empleado
-from schemas import SolicitudPrescripcionCreate, SolicitudPrescripcionResponse, MessageResponse
+from sqlalchemy import and_, or_, func, select, update
+from central_models import (
+    Paciente, HistoriaClinica, Medicamento, Laboratorio, CategoriaMedicamento, EstadoMedicamento,
+    ReservaStock, EventoStock
+)
+from dept_models import SolicitudPrescripcion, DetalleSolicitudMedicamento, Empleado, Cita
+from schemas import (
+    SolicitudPrescripcionCreate, SolicitudPrescripcionLote, SolicitudPrescripcionResponse,
+    MessageResponse, ReservaStockCreate
+)
+from auth import require_prescriptor, require_empleado
+from utils.forecast_utils import calcular_sugerencias_reorden, HISTORIA_DIAS_DEFAULT, LEAD_TIME_DIAS_DEFAULT
+from utils.prescription_utils import validar_referencias, insertar_solicitudes
+from utils.stock_utils import (
+    StockInsuficiente, reservar_stock, confirmar_reserva, liberar_reserva, ESTADO_ACTIVA,
+    ESTADOS_DISPENSABLES
+)
 
 router = APIRouter()
 
@@ -26,7 +39,11 @@ def buscar_medicamentos(
 ):
     """Buscar medicamentos disponibles en farmacia central"""
     try:
-        query = central_db.query(Medicamento).options(
+        hoy = date.today()
+        query = central_db.query(
+            Medicamento,
+            (Medicamento.fecha_vencimiento - hoy).label('dias_hasta_vencimiento')
+        ).options(
             joinedload(Medicamento.laboratorio),
             joinedload(Medicamento.categoria)
         )
@@ -43,15 +60,19 @@ def buscar_medicamentos(
             )
         
         if solo_disponibles:
-            from central_models import EstadoMedicamento
+            # Sin el stock vencido que el barrido todavía no marcó
             query = query.filter(
                 and_(
                     Medicamento.estado_medicamento == EstadoMedicamento.DISPONIBLE,
-                    Medicamento.stock_actual > 0
+                    Medicamento.stock_actual > 0,
+                    or_(
+                        Medicamento.fecha_vencimiento.is_(None),
+                        Medicamento.fecha_vencimiento >= hoy
+                    )
                 )
             )
         
-        medicamentos = query.limit(limit).all()
+        filas = query.limit(limit).all()
         
         result = [{
             'cod_med': med.cod_med,
@@ -72,8 +93,8 @@ def buscar_medicamentos(
             } if med.categoria else None,
             'fecha_vencimiento': med.fecha_vencimiento.isoformat() if med.fecha_vencimiento else None,
             'estado': med.estado_medicamento.value,
-            'dias_hasta_vencimiento': (med.fecha_vencimiento - date.today()).days if med.fecha_vencimiento else None
-        } for med in medicamentos]
+            'dias_hasta_vencimiento': dias_hasta_vencimiento
+        } for med, dias_hasta_vencimiento in filas]
         
         return {
             'success': True,
@@ -93,6 +114,62 @@ def buscar_medicamentos(
             detail=f'Error al buscar medicamentos: {str(e)}'
         )
 
+@router.get("/medicamentos/por-vencer")
+def get_medicamentos_por_vencer(
+    dias: int = Query(30, ge=0, le=365, description="Vencen dentro de estos días"),
+    solo_con_stock: bool = Query(True, description="Solo medicamentos con stock"),
+    limit: int = Query(100, ge=1, le=500),
+    central_db: Session = Depends(get_central_db)
+):
+    """Medicamentos que vencen en los próximos N días, del más próximo al más lejano"""
+    try:
+        hoy = date.today()
+        query = central_db.query(
+            Medicamento.cod_med,
+            Medicamento.nom_med,
+            Medicamento.principio_activo,
+            Medicamento.concentracion,
+            Medicamento.stock_actual,
+            Medicamento.fecha_vencimiento,
+            Medicamento.estado_medicamento,
+            (Medicamento.fecha_vencimiento - hoy).label('dias_hasta_vencimiento')
+        ).filter(
+            # Rango sobre ix_medicamento_vencimiento_pendiente (mismo predicado de estado)
+            Medicamento.fecha_vencimiento >= hoy,
+            Medicamento.fecha_vencimiento <= hoy + timedelta(days=dias),
+            or_(
+                Medicamento.estado_medicamento.is_(None),
+                Medicamento.estado_medicamento.in_(ESTADOS_DISPENSABLES)
+            )
+        )
+        
+        if solo_con_stock:
+            query = query.filter(Medicamento.stock_actual > 0)
+        
+        filas = query.order_by(Medicamento.fecha_vencimiento, Medicamento.cod_med).limit(limit).all()
+        
+        return {
+            'success': True,
+            'medicamentos': [{
+                'cod_med': f.cod_med,
+                'nom_med': f.nom_med,
+                'principio_activo': f.principio_activo,
+                'concentracion': f.concentracion,
+                'stock_actual': f.stock_actual,
+                'fecha_vencimiento': f.fecha_vencimiento.isoformat(),
+                'dias_hasta_vencimiento': f.dias_hasta_vencimiento,
+                'estado': f.estado_medicamento.value if f.estado_medicamento else None
+            } for f in filas],
+            'total': len(filas),
+            'dias': dias
+        }
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al obtener medicamentos por vencer: {str(e)}'
+        )
+
 @router.get("/solicitudes-prescripcion")
 def get_solicitudes_prescripcion(
     skip: int = Query(0, ge=0),
@@ -106,10 +183,7 @@ def get_solicitudes_prescripcion(
 ):
     """Listar solicitudes de prescripción a farmacia"""
     try:
-        query = dept_db.query(SolicitudPrescripcion).options(
-            joinedload(SolicitudPrescripcion.empleado_prescriptor),
-            joinedload(SolicitudPrescripcion.cita)
-        )
+        query = dept_db.query(SolicitudPrescripcion)
         
         if estado:
             query = query.filter(SolicitudPrescripcion.estado_solicitud == estado)
@@ -134,10 +208,18 @@ def get_solicitudes_prescripcion(
         
         # Obtener total y aplicar paginación
         total = query.count()
-        solicitudes = query.order_by(
+        # Página con médico y fecha de la cita en la misma consulta; los
+        # medicamentos de toda la página llegan en un único IN (selectinload)
+        filas = query.add_columns(Cita.fecha_cita).outerjoin(
+            Cita, Cita.id_cita == SolicitudPrescripcion.id_cita
+        ).options(
+            joinedload(SolicitudPrescripcion.empleado_prescriptor),
+            selectinload(SolicitudPrescripcion.detalles)
+        ).order_by(
             SolicitudPrescripcion.urgente.desc(),
             SolicitudPrescripcion.fecha_solicitud.desc()
         ).offset(skip).limit(limit).all()
+        solicitudes = [sol for sol, _ in filas]
         
         # Obtener datos de pacientes de BD Central
         pacientes_ids = [sol.cod_pac for sol in solicitudes]
@@ -147,13 +229,9 @@ def get_solicitudes_prescripcion(
         pacientes_dict = {p.cod_pac: p for p in pacientes}
         
         result = []
-        for sol in solicitudes:
+        for sol, fecha_cita in filas:
             paciente = pacientes_dict.get(sol.cod_pac)
-            
-            # Obtener medicamentos solicitados
-            medicamentos = dept_db.query(DetalleSolicitudMedicamento).filter(
-                DetalleSolicitudMedicamento.id_solicitud == sol.id_solicitud
-            ).all()
+            medicamentos = sol.detalles
             
             result.append({
                 'id_solicitud': sol.id_solicitud,
@@ -171,15 +249,20 @@ def get_solicitudes_prescripcion(
                 },
                 'cita': {
                     'id': sol.id_cita,
-                    'fecha': sol.cita.fecha_cita.isoformat() if sol.cita else None
-                } if sol.cita else None,
+                    'fecha': fecha_cita.isoformat()
+                } if fecha_cita else None,
                 'diagnostico': sol.diagnostico,
                 'observaciones_medicas': sol.observaciones_medicas,
                 'urgente': sol.urgente,
                 'fecha_solicitud': sol.fecha_solicitud.isoformat(),
                 'estado': sol.estado_solicitud,
+                'asignacion': {
+                    'id_emp': sol.id_emp_asignado,
+                    'hasta': sol.asignado_hasta.isoformat()
+                } if sol.asignado_hasta and sol.asignado_hasta > datetime.utcnow() else None,
                 'total_medicamentos': len(medicamentos),
                 'medicamentos': [{
+                    'cod_med': med.cod_med,
                     'nombre': med.nombre_medicamento,
                     'principio_activo': med.principio_activo,
                     'concentracion': med.concentracion,
@@ -212,7 +295,8 @@ def get_solicitudes_prescripcion(
 def create_solicitud_prescripcion(
     solicitud_data: SolicitudPrescripcionCreate,
     central_db: Session = Depends(get_central_db),
-    dept_db: Session = Depends(get_dept_db)
+    dept_db: Session = Depends(get_dept_db),
+    _: dict = Depends(require_prescriptor)
 ):
     """Crear solicitud de prescripción a farmacia central"""
     try:
@@ -223,71 +307,314 @@ def create_solicitud_prescripcion(
                 detail='Debe incluir al menos un medicamento'
             )
         
-        # Verificar paciente e historia clínica
-        paciente = central_db.query(Paciente).filter(
-            Paciente.cod_pac == solicitud_data.cod_pac
-        ).first()
-        if not paciente:
-            raise HTTPException(status_code=404, detail='Paciente no encontrado')
-        
-        historia = central_db.query(HistoriaClinica).filter(
-            HistoriaClinica.cod_hist == solicitud_data.cod_hist
-        ).first()
-        if not historia:
-            raise HTTPException(status_code=404, detail='Historia clínica no encontrada')
-        
-        # Verificar empleado
-        empleado = dept_db.query(Empleado).filter(
-            Empleado.id_emp == solicitud_data.id_emp_prescriptor
-        ).first()
-        if not empleado:
-            raise HTTPException(status_code=404, detail='Empleado no encontrado')
-        
-        # Crear solicitud
-        nueva_solicitud = SolicitudPrescripcion(
-            cod_pac=solicitud_data.cod_pac,
-            cod_hist=solicitud_data.cod_hist,
-            id_cita=solicitud_data.id_cita,
-            id_emp_prescriptor=solicitud_data.id_emp_prescriptor,
-            diagnostico=solicitud_data.diagnostico,
-            observaciones_medicas=solicitud_data.observaciones_medicas,
-            urgente=solicitud_data.urgente,
-            estado_solicitud='ENVIADA',
-            fecha_solicitud=datetime.utcnow(),
-            created_at=datetime.utcnow(),
-            updated_at=datetime.utcnow()
+        # Paciente, historia y prescriptor: una consulta por BD, en paralelo
+        validar_referencias(central_db, dept_db, [solicitud_data])
+        
+        creada, = insertar_solicitudes(central_db, dept_db, [solicitud_data])
+        dept_db.commit()
+        
+        return {
+            'success': True,
+            'message': 'Solicitud de prescripción creada exitosamente',
+            'data': creada
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        dept_db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al crear solicitud de prescripción: {str(e)}'
+        )
+
+@router.post("/solicitudes-prescripcion/lote")
+def create_solicitudes_prescripcion_lote(
+    lote_data: SolicitudPrescripcionLote,
+    central_db: Session = Depends(get_central_db),
+    dept_db: Session = Depends(get_dept_db),
+    _: dict = Depends(require_prescriptor)
+):
+    """Crear varias solicitudes de prescripción en una transacción (p. ej. egreso)"""
+    try:
+        for solicitud in lote_data.solicitudes:
+            if not solicitud.medicamentos:
+                raise HTTPException(
+                    status_code=400,
+                    detail='Cada solicitud debe incluir al menos un medicamento'
+                )
+        
+        validar_referencias(central_db, dept_db, lote_data.solicitudes)
+        
+        creadas = insertar_solicitudes(central_db, dept_db, lote_data.solicitudes)
+        dept_db.commit()
+        
+        return {
+            'success': True,
+            'message': f'{len(creadas)} solicitudes de prescripción creadas exitosamente',
+            'data': creadas
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        dept_db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al crear solicitudes de prescripción: {str(e)}'
+        )
+
+@router.get("/reabastecimiento/sugerencias")
+def get_sugerencias_reabastecimiento(
+    historia_dias: int = Query(HISTORIA_DIAS_DEFAULT, ge=7, le=730, description="Días de historia de demanda"),
+    lead_time_dias: int = Query(LEAD_TIME_DIAS_DEFAULT, ge=1, le=120, description="Días de reposición del proveedor"),
+    solo_sugeridos: bool = Query(True, description="Solo medicamentos que deben reordenarse"),
+    central_db: Session = Depends(get_central_db),
+    dept_db: Session = Depends(get_dept_db)
+):
+    """Pronóstico de consumo y sugerencias de reorden para todo el catálogo"""
+    try:
+        data = calcular_sugerencias_reorden(
+            central_db, dept_db, historia_dias, lead_time_dias, solo_sugeridos
         )
+        return {
+            'success': True,
+            'data': data
+        }
         
-        dept_db.add(nueva_solicitud)
-        dept_db.flush()  # Para obtener el ID
-        
-        # Agregar medicamentos
-        medicamentos_creados = []
-        for med_data in solicitud_data.medicamentos:
-            detalle = DetalleSolicitudMedicamento(
-                id_solicitud=nueva_solicitud.id_solicitud,
-                nombre_medicamento=med_data.nombre_medicamento,
-                principio_activo=med_data.principio_activo,
-                concentracion=med_data.concentracion,
-                forma_farmaceutica=med_data.forma_farmaceutica,
-                dosis=med_data.dosis,
-                frecuencia=med_data.frecuencia,
-                duracion_dias=med_data.duracion_dias,
-                cantidad_solicitada=med_data.cantidad_solicitada,
-                instrucciones_especiales=med_data.instrucciones_especiales,
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al calcular sugerencias de reabastecimiento: {str(e)}'
+        )
+
+# ===============================================
+# RESERVAS DE STOCK (DISPENSACIÓN)
+# ===============================================
+
+def _reserva_a_dict(reserva: ReservaStock) -> dict:
+    return {
+        'id_reserva': reserva.id_reserva,
+        'id_solicitud': reserva.id_solicitud,
+        'id_emp': reserva.id_emp,
+        'estado': reserva.estado,
+        'expira_en': reserva.expira_en.isoformat() if reserva.expira_en else None,
+        'confirmada_en': reserva.confirmada_en.isoformat() if reserva.confirmada_en else None,
+        'lineas': [{
+            'cod_med': det.cod_med,
+            'cantidad': det.cantidad
+        } for det in reserva.detalles]
+    }
+
+def _id_emp_farmaceuta(payload: dict) -> int:
+    sub = str(payload.get("sub", ""))
+    if not sub.isdigit():
+        raise HTTPException(status_code=403, detail='La operación requiere un empleado')
+    return int(sub)
+
+def _error_reserva(central_db: Session, id_reserva: int, accion: str):
+    """404 si la reserva no existe, 409 si ya no está activa o venció"""
+    reserva = central_db.query(ReservaStock.estado, ReservaStock.expira_en).filter(
+        ReservaStock.id_reserva == id_reserva
+    ).first()
+    if not reserva:
+        return HTTPException(status_code=404, detail='Reserva no encontrada')
+    if reserva.estado == ESTADO_ACTIVA:
+        return HTTPException(status_code=409, detail=f'No se puede {accion}: la reserva está vencida')
+    return HTTPException(status_code=409, detail=f'No se puede {accion}: la reserva está {reserva.estado}')
+
+@router.post("/reservas")
+def create_reserva_stock(
+    reserva_data: ReservaStockCreate,
+    central_db: Session = Depends(get_central_db),
+    payload: dict = Depends(require_empleado)
+):
+    """Reservar de una vez el stock de todas las líneas de una dispensación"""
+    try:
+        # La reserva queda a nombre de quien la hace (token), no del cuerpo
+        id_emp = _id_emp_farmaceuta(payload)
+        
+        if not reserva_data.lineas:
+            raise HTTPException(
+                status_code=400,
+                detail='Debe incluir al menos una línea'
             )
-            dept_db.add(detalle)
-            medicamentos_creados.append(detalle)
         
+        reserva = reservar_stock(
+            central_db,
+            [(linea.cod_med, linea.cantidad) for linea in reserva_data.lineas],
+            id_solicitud=reserva_data.id_solicitud,
+            id_emp=id_emp,
+            ttl_minutos=reserva_data.ttl_minutos
+        )
+        data = _reserva_a_dict(reserva)
+        central_db.commit()
+        
+        return {
+            'success': True,
+            'message': 'Stock reservado exitosamente',
+            'data': data
+        }
+        
+    except StockInsuficiente as e:
+        central_db.rollback()
+        raise HTTPException(
+            status_code=409,
+            detail={'message': 'Stock insuficiente', 'faltantes': e.faltantes}
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        central_db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al reservar stock: {str(e)}'
+        )
+
+@router.get("/reservas/{id_reserva}")
+def get_reserva_stock(
+    id_reserva: int,
+    central_db: Session = Depends(get_central_db),
+    _: dict = Depends(require_empleado)
+):
+    """Obtener una reserva de stock con sus líneas"""
+    try:
+        reserva = central_db.query(ReservaStock).options(
+            selectinload(ReservaStock.detalles)
+        ).filter(ReservaStock.id_reserva == id_reserva).first()
+        
+        if not reserva:
+            raise HTTPException(status_code=404, detail='Reserva no encontrada')
+        
+        return {
+            'success': True,
+            'data': _reserva_a_dict(reserva)
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al obtener reserva: {str(e)}'
+        )
+
+@router.post("/reservas/{id_reserva}/confirmar")
+def confirmar_reserva_stock(
+    id_reserva: int,
+    central_db: Session = Depends(get_central_db),
+    _: dict = Depends(require_empleado)
+):
+    """Confirmar la dispensación de una reserva activa"""
+    try:
+        if not confirmar_reserva(central_db, id_reserva):
+            central_db.rollback()
+            raise _error_reserva(central_db, id_reserva, 'confirmar')
+        central_db.commit()
+        
+        return {
+            'success': True,
+            'message': 'Dispensación confirmada exitosamente'
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        central_db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al confirmar reserva: {str(e)}'
+        )
+
+@router.post("/reservas/{id_reserva}/liberar")
+def liberar_reserva_stock(
+    id_reserva: int,
+    central_db: Session = Depends(get_central_db),
+    _: dict = Depends(require_empleado)
+):
+    """Cancelar una reserva activa y devolver su stock"""
+    try:
+        if not liberar_reserva(central_db, id_reserva):
+            central_db.rollback()
+            raise _error_reserva(central_db, id_reserva, 'liberar')
+        central_db.commit()
+        
+        return {
+            'success': True,
+            'message': 'Reserva liberada exitosamente'
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        central_db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al liberar reserva: {str(e)}'
+        )
+
+# ===============================================
+# COLA DE TRABAJO DE FARMACIA
+# ===============================================
+
+@router.post("/cola/claim")
+def claim_solicitudes_cola(
+    n: int = Query(5, ge=1, le=50, description="Cantidad de solicitudes a tomar"),
+    lease_minutos: int = Query(10, ge=1, le=240, description="Duración de la asignación"),
+    dept_db: Session = Depends(get_dept_db),
+    payload: dict = Depends(require_empleado)
+):
+    """Tomar las siguientes solicitudes pendientes de la cola sin chocar con otros farmaceutas"""
+    try:
+        id_emp = _id_emp_farmaceuta(payload)
+        ahora = datetime.utcnow()
+        orden = (
+            SolicitudPrescripcion.urgente.desc().nulls_last(),
+            SolicitudPrescripcion.fecha_solicitud
+        )
+        
+        # Un solo UPDATE: las filas que otro farmaceuta está tomando se saltan
+        # (SKIP LOCKED) y las asignaciones vencidas vuelven a la cola
+        candidatas = select(SolicitudPrescripcion.id_solicitud).where(
+            SolicitudPrescripcion.estado_solicitud == 'ENVIADA',
+            or_(
+                SolicitudPrescripcion.asignado_hasta.is_(None),
+                SolicitudPrescripcion.asignado_hasta <= ahora
+            )
+        ).order_by(*orden).limit(n).with_for_update(skip_locked=True)
+        
+        filas = dept_db.execute(
+            update(SolicitudPrescripcion).where(
+                SolicitudPrescripcion.id_solicitud.in_(candidatas.scalar_subquery())
+            ).values(
+                id_emp_asignado=id_emp,
+                asignado_hasta=ahora + timedelta(minutes=lease_minutos),
+                updated_at=ahora
+            ).returning(
+                SolicitudPrescripcion.id_solicitud,
+                SolicitudPrescripcion.cod_pac,
+                SolicitudPrescripcion.diagnostico,
+                SolicitudPrescripcion.urgente,
+                SolicitudPrescripcion.fecha_solicitud,
+                SolicitudPrescripcion.asignado_hasta
+            ),
+            execution_options={"synchronize_session": False}
+        ).all()
         dept_db.commit()
         
+        filas.sort(key=lambda f: (not f.urgente, f.fecha_solicitud or datetime.max))
+        
         return {
             'success': True,
-            'message': 'Solicitud de prescripción creada exitosamente',
-            'data': {
-                'id_solicitud': nueva_solicitud.id_solicitud,
-                'medicamentos': [med.nombre_medicamento for med in medicamentos_creados]
-            }
+            'solicitudes': [{
+                'id_solicitud': f.id_solicitud,
+                'cod_pac': f.cod_pac,
+                'diagnostico': f.diagnostico,
+                'urgente': f.urgente,
+                'fecha_solicitud': f.fecha_solicitud.isoformat() if f.fecha_solicitud else None,
+                'asignado_hasta': f.asignado_hasta.isoformat()
+            } for f in filas],
+            'total': len(filas)
         }
         
     except HTTPException:
@@ -296,5 +623,138 @@ def create_solicitud_prescripcion(
         dept_db.rollback()
         raise HTTPException(
             status_code=500,
-            detail=f'Error al crear solicitud de prescripción: {str(e)}'
-        )
\ No newline at end of file
+            detail=f'Error al tomar solicitudes de la cola: {str(e)}'
+        )
+
+@router.post("/cola/{id_solicitud}/liberar")
+def liberar_solicitud_cola(
+    id_solicitud: int,
+    dept_db: Session = Depends(get_dept_db),
+    payload: dict = Depends(require_empleado)
+):
+    """Devolver a la cola una solicitud tomada por el farmaceuta actual"""
+    try:
+        id_emp = _id_emp_farmaceuta(payload)
+        
+        liberada = dept_db.query(SolicitudPrescripcion).filter(
+            SolicitudPrescripcion.id_solicitud == id_solicitud,
+            SolicitudPrescripcion.id_emp_asignado == id_emp,
+            SolicitudPrescripcion.asignado_hasta > datetime.utcnow()
+        ).update({
+            'id_emp_asignado': None,
+            'asignado_hasta': None,
+            'updated_at': datetime.utcnow()
+        }, synchronize_session=False)
+        dept_db.commit()
+        
+        if not liberada:
+            raise HTTPException(
+                status_code=409,
+                detail='La solicitud no está asignada a este farmaceuta'
+            )
+        
+        return {
+            'success': True,
+            'message': 'Solicitud devuelta a la cola'
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        dept_db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al liberar solicitud: {str(e)}'
+        )
+
+# ===============================================
+# STOCK BAJO
+# ===============================================
+
+@router.get("/stock-bajo")
+def get_stock_bajo(
+    limit: int = Query(200, ge=1, le=1000),
+    central_db: Session = Depends(get_central_db),
+    _: dict = Depends(require_empleado)
+):
+    """Medicamentos con stock en o por debajo del mínimo, de mayor a menor déficit"""
+    try:
+        # Cursor para seguir los cambios con /stock-bajo/eventos; se lee antes
+        # que la lista para que un evento confirmado entre ambas consultas se
+        # reciba en el feed (a lo sumo repetido), nunca se pierda
+        ultimo_id = central_db.query(func.max(EventoStock.id_evento)).scalar() or 0
+        
+        # El filtro coincide con el predicado de ix_medicamento_stock_bajo:
+        # se leen solo las filas en stock bajo, no el catálogo
+        deficit = (Medicamento.stock_minimo - Medicamento.stock_actual).label('deficit')
+        filas = central_db.query(
+            Medicamento.cod_med,
+            Medicamento.nom_med,
+            Medicamento.concentracion,
+            Medicamento.stock_actual,
+            Medicamento.stock_minimo,
+            Medicamento.stock_maximo,
+            Medicamento.estado_medicamento,
+            deficit
+        ).filter(
+            Medicamento.stock_actual <= Medicamento.stock_minimo
+        ).order_by(deficit.desc(), Medicamento.cod_med).limit(limit).all()
+        
+        return {
+            'success': True,
+            'medicamentos': [{
+                'cod_med': f.cod_med,
+                'nom_med': f.nom_med,
+                'concentracion': f.concentracion,
+                'stock_actual': f.stock_actual,
+                'stock_minimo': f.stock_minimo,
+                'stock_maximo': f.stock_maximo,
+                'deficit': f.deficit,
+                'estado': f.estado_medicamento.value if f.estado_medicamento else None
+            } for f in filas],
+            'total': len(filas),
+            'ultimo_evento_id': ultimo_id
+        }
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al obtener medicamentos con stock bajo: {str(e)}'
+        )
+
+@router.get("/stock-bajo/eventos")
+def get_eventos_stock_bajo(
+    desde_id: int = Query(0, ge=0, description="Último id de evento ya recibido"),
+    limit: int = Query(100, ge=1, le=1000),
+    central_db: Session = Depends(get_central_db),
+    _: dict = Depends(require_empleado)
+):
+    """Transiciones de stock bajo posteriores a desde_id, en orden"""
+    try:
+        eventos = central_db.query(EventoStock).filter(
+            EventoStock.id_evento > desde_id
+        ).order_by(EventoStock.id_evento).limit(limit).all()
+        
+        return {
+            'success': True,
+            'eventos': [{
+                'id_evento': ev.id_evento,
+                'cod_med': ev.cod_med,
+                'tipo': ev.tipo,
+                'stock_anterior': ev.stock_anterior,
+                'stock_nuevo': ev.stock_nuevo,
+                'stock_minimo': ev.stock_minimo,
+                'motivo': ev.motivo,
+                'referencia': ev.referencia,
+                'fecha': ev.created_at.isoformat() if ev.created_at else None
+            } for ev in eventos],
+            'total': len(eventos),
+            'ultimo_id': eventos[-1].id_evento if eventos else desde_id,
+            'hay_mas': len(eventos) == limit
+        }
+        
+    except Exception as e:
+        raise HTTPException(
+            status_code=500,
+            detail=f'Error al obtener eventos de stock: {str(e)}'
+        )
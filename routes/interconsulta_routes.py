@@ -7,11 +7,107 @@ from database import get_central_db, get_dept_db
 from central_models import Paciente
 from dept_models import Interconsulta, Empleado
 from schemas import InterconsultaCreate, InterconsultaResponse, MessageResponse
-from sqlalchemy import and_
+from sqlalchemy import and_, func, cast, Float, tuple_
 from datetime import timedelta
 
 router = APIRouter()
 
+# ===============================================
+# FUNCIONES AUXILIARES
+# ===============================================
+
+def calcular_stats_interconsultas(
+    dept_db: Session,
+    fecha_desde: date,
+    fecha_hasta: date,
+    departamento_id: Optional[int] = None
+):
+    """Conteos, tiempos de respuesta y desglose por destino en una sola consulta.
+
+    GROUPING SETS ((), (dept_destino_nombre)) devuelve en la misma pasada la
+    fila del total general y una fila por departamento destino.
+    """
+    hoy = date.today()
+    dias_respuesta = Interconsulta.fecha_respuesta_recibida - Interconsulta.fecha_solicitud
+    respondida = Interconsulta.estado_interconsulta == 'RESPONDIDA'
+    
+    query = dept_db.query(
+        Interconsulta.dept_destino_nombre,
+        func.grouping(Interconsulta.dept_destino_nombre).label('es_total'),
+        func.count().label('total'),
+        func.count().filter(Interconsulta.urgente == True).label('urgentes'),
+        func.count().filter(Interconsulta.estado_interconsulta == 'PENDIENTE').label('pendientes'),
+        func.count().filter(respondida).label('respondidas'),
+        func.count().filter(
+            and_(
+                ~respondida,
+                Interconsulta.fecha_respuesta_esperada < hoy
+            )
+        ).label('vencidas'),
+        func.count().filter(
+            and_(
+                respondida,
+                Interconsulta.fecha_respuesta_recibida > Interconsulta.fecha_respuesta_esperada
+            )
+        ).label('respondidas_fuera_de_plazo'),
+        cast(func.percentile_cont(0.5).within_group(dias_respuesta), Float).label('mediana_dias'),
+        cast(func.percentile_cont(0.9).within_group(dias_respuesta), Float).label('p90_dias')
+    ).filter(
+        and_(
+            Interconsulta.fecha_solicitud >= fecha_desde,
+            Interconsulta.fecha_solicitud <= fecha_hasta
+        )
+    )
+    
+    if departamento_id:
+        query = query.filter(Interconsulta.id_dept_solicitante == departamento_id)
+    
+    query = query.group_by(
+        func.grouping_sets(tuple_(), tuple_(Interconsulta.dept_destino_nombre))
+    )
+    
+    def _serializar(row):
+        return {
+            'total': row.total,
+            'urgentes': row.urgentes,
+            'pendientes': row.pendientes,
+            'respondidas': row.respondidas,
+            'vencidas': row.vencidas,
+            'respondidas_fuera_de_plazo': row.respondidas_fuera_de_plazo,
+            'tiempo_respuesta_dias': {
+                'mediana': row.mediana_dias,
+                'p90': row.p90_dias
+            }
+        }
+    
+    general = None
+    por_destino = []
+    for row in query.all():
+        if row.es_total:
+            general = _serializar(row)
+        else:
+            por_destino.append({'dept_destino': row.dept_destino_nombre, **_serializar(row)})
+    
+    if general is None:
+        general = {
+            'total': 0, 'urgentes': 0, 'pendientes': 0, 'respondidas': 0,
+            'vencidas': 0, 'respondidas_fuera_de_plazo': 0,
+            'tiempo_respuesta_dias': {'mediana': None, 'p90': None}
+        }
+    
+    por_destino.sort(key=lambda item: item['total'], reverse=True)
+    
+    return {
+        'total_interconsultas': general['total'],
+        'urgentes': general['urgentes'],
+        'pendientes': general['pendientes'],
+        'respondidas': general['respondidas'],
+        'vencidas': general['vencidas'],
+        'respondidas_fuera_de_plazo': general['respondidas_fuera_de_plazo'],
+        'tiempo_respuesta_dias': general['tiempo_respuesta_dias'],
+        'por_dept_destino': por_destino
+    }
+
 # ===============================================
 # ENDPOINTS DE INTERCONSULTAS
 # ===============================================
@@ -283,6 +379,7 @@ def get_interconsulta(
 def get_interconsultas_stats(
     fecha_desde: Optional[str] = Query(None),
     fecha_hasta: Optional[str] = Query(None),
+    departamento_id: Optional[int] = Query(None, description="Filtrar por departamento solicitante"),
     dept_db: Session = Depends(get_dept_db)
 ):
     """Estadísticas de interconsultas"""
@@ -292,28 +389,23 @@ def get_interconsultas_stats(
         if not fecha_hasta:
             fecha_hasta = date.today().isoformat()
         
-        fecha_desde_obj = datetime.strptime(fecha_desde, '%Y-%m-%d').date()
-        fecha_hasta_obj = datetime.strptime(fecha_hasta, '%Y-%m-%d').date()
-        
-        query = dept_db.query(Interconsulta).filter(
-            and_(
-                Interconsulta.fecha_solicitud >= fecha_desde_obj,
-                Interconsulta.fecha_solicitud <= fecha_hasta_obj
+        try:
+            fecha_desde_obj = datetime.strptime(fecha_desde, '%Y-%m-%d').date()
+            fecha_hasta_obj = datetime.strptime(fecha_hasta, '%Y-%m-%d').date()
+        except ValueError:
+            raise HTTPException(
+                status_code=400,
+                detail='Formato de fecha inválido. Use YYYY-MM-DD'
             )
-        )
         
-        total = query.count()
-        urgentes = query.filter(Interconsulta.urgente == True).count()
-        pendientes = query.filter(Interconsulta.estado_interconsulta == 'PENDIENTE').count()
-        respondidas = query.filter(Interconsulta.estado_interconsulta == 'RESPONDIDA').count()
+        stats = calcular_stats_interconsultas(
+            dept_db, fecha_desde_obj, fecha_hasta_obj, departamento_id
+        )
         
         return {
             'success': True,
             'data': {
-                'total_interconsultas': total,
-                'urgentes': urgentes,
-                'pendientes': pendientes,
-                'respondidas': respondidas,
+                **stats,
                 'periodo': {
                     'desde': fecha_desde,
                     'hasta': fecha_hasta
@@ -321,8 +413,10 @@ def get_interconsultas_stats(
             }
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500,
             detail=f'Error al obtener estadísticas: {str(e)}'
-        )
\ No newline at end of file
+        )
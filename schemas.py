@@ -175,6 +175,8 @@ class CitaUpdate(BaseModel):
     recomendaciones: Optional[str] = None
     duracion_real_min: Optional[int] = None
     estado_cita: Optional[str] = None
+    fecha_cita: Optional[str] = None  # YYYY-MM-DD (reprogramar)
+    hora_inicio: Optional[str] = None  # HH:MM (reprogramar)
     hora_fin: Optional[str] = None
     requiere_seguimiento: Optional[bool] = None
     fecha_seguimiento: Optional[str] = None
@@ -253,6 +255,18 @@ class SolicitudPrescripcionCreate(BaseModel):
     urgente: Optional[bool] = False
     medicamentos: List[MedicamentoSolicitud]
 
+class SolicitudPrescripcionLote(BaseModel):
+    solicitudes: List[SolicitudPrescripcionCreate] = Field(..., min_length=1, max_length=50)
+
+class LineaReserva(BaseModel):
+    cod_med: int
+    cantidad: int = Field(..., gt=0)
+
+class ReservaStockCreate(BaseModel):
+    lineas: List[LineaReserva]
+    id_solicitud: Optional[int] = None
+    ttl_minutos: Optional[int] = Field(None, gt=0, le=24 * 60)
+
 class SolicitudPrescripcionResponse(BaseModel):
     id_solicitud: int
     cod_pac: int
@@ -0,0 +1,21 @@
+import os
+import sys
+
+import pytest
+
+# Las pruebas corren contra SQLite en memoria; database.py lee las URLs al importarse
+os.environ.setdefault("CENTRAL_DATABASE_URL", "sqlite://")
+os.environ.setdefault("DEPT_DATABASE_URL", "sqlite://")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+@pytest.fixture(autouse=True)
+def llaves_jwt_temporales(tmp_path, monkeypatch):
+    """Generar las llaves JWT en un directorio temporal, no en ./keys"""
+    from utils import jwks_utils
+    monkeypatch.setattr(jwks_utils, "JWT_KEYS_DIR", str(tmp_path / "keys"))
+    monkeypatch.setattr(jwks_utils, "_firma", None)
+    monkeypatch.setattr(jwks_utils, "_verificacion", {})
+    monkeypatch.setattr(jwks_utils, "_jwks_locales", [])
+    monkeypatch.setattr(jwks_utils, "_cargado_en", None)
+    monkeypatch.setattr(jwks_utils, "_remoto_cargado_en", None)
@@ -0,0 +1,65 @@
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from database import DeptBase
+from dept_models import Departamento, Empleado, RefreshToken, RolEmpleado, UsuarioSistema
+from routes.auth_routes import LoginRequest, login
+
+EMAIL = "medico@hospital.com"
+PASSWORD = "clave-segura"
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://", connect_args={"check_same_thread": False}, poolclass=StaticPool)
+    DeptBase.metadata.create_all(engine, tables=[
+        Departamento.__table__, RolEmpleado.__table__, Empleado.__table__,
+        UsuarioSistema.__table__, RefreshToken.__table__
+    ])
+    sesion = sessionmaker(bind=engine)()
+    sesion.add(Departamento(id_dept=1, nom_dept="Cardiología"))
+    sesion.add(RolEmpleado(id_rol=1, nombre_rol="MEDICO", permisos_sistema={"puede_prescribir": True}))
+    sesion.add(Empleado(
+        id_emp=10, id_dept=1, id_rol=1, nom_emp="Ana", apellido_emp="Pérez", email_emp=EMAIL,
+        fecha_nacimiento=date(1985, 4, 2), cedula="1020304050"
+    ))
+    sesion.add(UsuarioSistema(
+        id_usuario=1, id_emp=10, username="aperez",
+        password_hash="$2b$12$hash-de-prueba", salt="", cuenta_activa=True, intentos_fallidos=0
+    ))
+    sesion.commit()
+    sesion.expunge_all()
+    yield sesion
+    sesion.close()
+    engine.dispose()
+
+def contar_consultas(sesion):
+    sentencias = []
+
+    def registrar(conn, cursor, statement, parameters, context, executemany):
+        sentencias.append(statement.lstrip().split(None, 1)[0].upper())
+
+    event.listen(sesion.get_bind(), "before_cursor_execute", registrar)
+    return sentencias
+
+def test_login_carga_el_principal_en_una_sola_consulta(db, monkeypatch):
+    # bcrypt no interesa aquí: solo se cuentan las sentencias SQL del login
+    monkeypatch.setattr(
+        "routes.auth_routes.verificar_password",
+        lambda password, password_hash: (password == PASSWORD, None)
+    )
+    sentencias = contar_consultas(db)
+    peticion = SimpleNamespace(client=SimpleNamespace(host="10.1.2.3"), headers={})
+
+    respuesta = login(LoginRequest(email=EMAIL, password=PASSWORD), peticion, db)
+
+    assert respuesta["user"]["department"] == "Cardiología"
+    assert respuesta["user"]["role"] == "MEDICO"
+    # Usuario, empleado, rol y departamento llegan en un único SELECT; el resto
+    # son las escrituras de la sesión (refresh token y último acceso)
+    assert sentencias.count("SELECT") == 1
+    assert set(sentencias) <= {"SELECT", "INSERT", "UPDATE"}
@@ -0,0 +1,228 @@
+import unicodedata
+from itertools import chain
+from datetime import date, timedelta
+from typing import Optional
+
+import numpy as np
+from sqlalchemy import Integer, and_, cast, extract, func
+from sqlalchemy.orm import Session
+
+from dept_models import Cita, Departamento, Empleado, EstadoCita, TipoCita
+
+# ===============================================
+# UTILIZACIÓN DE MÉDICOS Y DEPARTAMENTOS
+# ===============================================
+# Las citas del rango se traen como arreglos de enteros (médico, día,
+# minuto de inicio, minuto de fin) y toda la agregación se hace con
+# operaciones vectorizadas de NumPy.
+
+HORAS_DIA = 24
+MINUTOS_HORA = 60
+DURACION_DEFAULT_MIN = 30
+# Horario asumido cuando el departamento no define horario_atencion: L-V 08:00-17:00
+HORARIO_DEFAULT = {dia: (8 * 60, 17 * 60) for dia in range(5)}
+# Tamaño de bloque para el cálculo de solapamiento por hora (filas x 24)
+BLOQUE_INTERVALOS = 100_000
+
+_DIAS_SEMANA = {
+    "lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3,
+    "viernes": 4, "sabado": 5, "domingo": 6
+}
+
+def _sin_acentos(texto: str) -> str:
+    return "".join(
+        c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c)
+    ).lower().strip()
+
+def _a_minutos(valor: str) -> int:
+    horas, minutos = str(valor).strip().split(":")[:2]
+    return int(horas) * 60 + int(minutos)
+
+def _rango(valor):
+    """Aceptar "08:00-17:00" o {"inicio": "08:00", "fin": "17:00"}"""
+    if isinstance(valor, str) and "-" in valor:
+        inicio, fin = valor.split("-", 1)
+        return _a_minutos(inicio), _a_minutos(fin)
+    if isinstance(valor, dict):
+        inicio = valor.get("inicio") or valor.get("apertura")
+        fin = valor.get("fin") or valor.get("cierre")
+        if inicio and fin:
+            return _a_minutos(inicio), _a_minutos(fin)
+    return None
+
+def parsear_horario(horario_atencion) -> dict:
+    """Convertir horario_atencion (JSON libre) a {día_semana: (inicio_min, fin_min)}"""
+    if not horario_atencion:
+        return dict(HORARIO_DEFAULT)
+    try:
+        horario = {}
+        general = _rango(horario_atencion)
+        if general:
+            dias = horario_atencion.get("dias") if isinstance(horario_atencion, dict) else None
+            indices = [_DIAS_SEMANA[_sin_acentos(d)] for d in dias] if dias else list(range(5))
+            return {dia: general for dia in indices}
+        for clave, valor in horario_atencion.items():
+            dia = _DIAS_SEMANA.get(_sin_acentos(clave))
+            rango = _rango(valor)
+            if dia is not None and rango:
+                horario[dia] = rango
+        return horario or dict(HORARIO_DEFAULT)
+    except (AttributeError, KeyError, ValueError):
+        return dict(HORARIO_DEFAULT)
+
+def disponibilidad_por_hora(horario: dict) -> np.ndarray:
+    """Minutos disponibles por (día de semana, hora): matriz 7 x 24"""
+    inicios_hora = np.arange(HORAS_DIA) * MINUTOS_HORA
+    disponible = np.zeros((7, HORAS_DIA))
+    for dia, (inicio, fin) in horario.items():
+        disponible[dia] = np.clip(
+            np.minimum(fin, inicios_hora + MINUTOS_HORA) - np.maximum(inicio, inicios_hora), 0, None
+        )
+    return disponible
+
+def _solapamiento_por_hora(inicio: np.ndarray, fin: np.ndarray) -> np.ndarray:
+    """Minutos de cada intervalo que caen en cada hora del día (n x 24)"""
+    inicios_hora = np.arange(HORAS_DIA) * MINUTOS_HORA
+    return np.clip(
+        np.minimum(fin[:, None], inicios_hora + MINUTOS_HORA) - np.maximum(inicio[:, None], inicios_hora),
+        0, None
+    )
+
+def _ratio(ocupado: np.ndarray, capacidad: np.ndarray):
+    """ocupado / capacidad redondeado, None donde no hay capacidad"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ratio = np.where(capacidad > 0, ocupado / capacidad, np.nan)
+    resultado = np.round(ratio, 4).astype(object)
+    resultado[np.isnan(ratio)] = None
+    return resultado.tolist()
+
+def calcular_utilizacion(
+    dept_db: Session,
+    fecha_desde: date,
+    fecha_hasta: date,
+    departamento_id: Optional[int] = None
+) -> dict:
+    """Ocupación por médico/día, por día/hora y por departamento"""
+    n_dias = (fecha_hasta - fecha_desde).days + 1
+    dias = [fecha_desde + timedelta(days=i) for i in range(n_dias)]
+    dias_semana = (np.arange(n_dias) + fecha_desde.weekday()) % 7
+
+    # Intervalos reservados como enteros, calculados en la BD
+    inicio_min = cast(extract("hour", Cita.hora_inicio) * 60 + extract("minute", Cita.hora_inicio), Integer)
+    fin_min = func.coalesce(
+        cast(extract("hour", Cita.hora_fin) * 60 + extract("minute", Cita.hora_fin), Integer),
+        inicio_min + func.coalesce(TipoCita.duracion_default_min, DURACION_DEFAULT_MIN)
+    )
+    query = dept_db.query(
+        Cita.id_emp,
+        Cita.id_dept,
+        cast(Cita.fecha_cita - fecha_desde, Integer).label("dia"),
+        inicio_min.label("inicio"),
+        fin_min.label("fin")
+    ).join(TipoCita, TipoCita.id_tipo_cita == Cita.id_tipo_cita).filter(
+        and_(
+            Cita.fecha_cita >= fecha_desde,
+            Cita.fecha_cita <= fecha_hasta,
+            Cita.estado_cita != EstadoCita.CANCELADA
+        )
+    )
+    if departamento_id:
+        query = query.filter(Cita.id_dept == departamento_id)
+
+    filas = query.all()
+    datos = np.fromiter(
+        chain.from_iterable(filas), dtype=np.int64, count=len(filas) * 5
+    ).reshape(-1, 5)
+    id_emp, id_dept, dia, inicio, fin = datos.T
+    fin = np.minimum(fin, HORAS_DIA * MINUTOS_HORA)
+    duracion = np.clip(fin - inicio, 0, None)
+
+    # Médicos y departamentos involucrados
+    medicos_ids, medico_idx = np.unique(id_emp, return_inverse=True)
+    deptos_ids, dept_idx = np.unique(id_dept, return_inverse=True)
+
+    empleados = dept_db.query(
+        Empleado.id_emp, Empleado.nom_emp, Empleado.apellido_emp, Empleado.id_dept
+    ).filter(Empleado.id_emp.in_(medicos_ids.tolist())).all() if len(medicos_ids) else []
+    empleados_dict = {e.id_emp: e for e in empleados}
+
+    ids_deptos = set(deptos_ids.tolist()) | {e.id_dept for e in empleados if e.id_dept}
+    departamentos = dept_db.query(Departamento).filter(
+        Departamento.id_dept.in_(ids_deptos)
+    ).all() if ids_deptos else []
+    disponibilidad = {d.id_dept: disponibilidad_por_hora(parsear_horario(d.horario_atencion)) for d in departamentos}
+    disponibilidad_default = disponibilidad_por_hora(HORARIO_DEFAULT)
+
+    # Disponibilidad por médico (7 x 24) según el horario de su departamento
+    disp_medico = np.array([
+        disponibilidad.get(
+            empleados_dict[m].id_dept if m in empleados_dict else None,
+            disponibilidad_default
+        )
+        for m in medicos_ids.tolist()
+    ]).reshape(-1, 7, HORAS_DIA)
+
+    # Médico x día
+    n_medicos = len(medicos_ids)
+    ocupado_medico_dia = np.bincount(
+        medico_idx * n_dias + dia, weights=duracion, minlength=n_medicos * n_dias
+    ).reshape(n_medicos, n_dias)
+    capacidad_medico_dia = disp_medico.sum(axis=2)[:, dias_semana]
+
+    # Día x hora
+    ocupado_dia_hora = np.zeros((n_dias, HORAS_DIA))
+    for i in range(0, len(inicio), BLOQUE_INTERVALOS):
+        solape = _solapamiento_por_hora(inicio[i:i + BLOQUE_INTERVALOS], fin[i:i + BLOQUE_INTERVALOS])
+        dia_bloque = dia[i:i + BLOQUE_INTERVALOS]
+        for hora in range(HORAS_DIA):
+            ocupado_dia_hora[:, hora] += np.bincount(dia_bloque, weights=solape[:, hora], minlength=n_dias)
+    capacidad_dia_hora = disp_medico.sum(axis=0)[dias_semana]
+
+    # Día de semana x hora (perfil típico del período)
+    ocupado_semana_hora = np.zeros((7, HORAS_DIA))
+    capacidad_semana_hora = np.zeros((7, HORAS_DIA))
+    np.add.at(ocupado_semana_hora, dias_semana, ocupado_dia_hora)
+    np.add.at(capacidad_semana_hora, dias_semana, capacidad_dia_hora)
+
+    # Departamento x día: citas frente a capacidad_atencion
+    n_deptos = len(deptos_ids)
+    citas_dept_dia = np.bincount(
+        dept_idx * n_dias + dia, minlength=n_deptos * n_dias
+    ).reshape(n_deptos, n_dias)
+    deptos_dict = {d.id_dept: d for d in departamentos}
+
+    resumen_departamentos = []
+    for i, id_d in enumerate(deptos_ids.tolist()):
+        depto = deptos_dict.get(id_d)
+        capacidad = depto.capacidad_atencion if depto and depto.capacidad_atencion else 0
+        resumen_departamentos.append({
+            'id_dept': id_d,
+            'nombre': depto.nom_dept if depto else None,
+            'capacidad_atencion': capacidad or None,
+            'citas_por_dia': citas_dept_dia[i].tolist(),
+            'ocupacion_por_dia': _ratio(citas_dept_dia[i].astype(float), np.full(n_dias, capacidad, dtype=float))
+        })
+
+    total_ocupado = ocupado_medico_dia.sum(axis=1)
+    total_capacidad = capacidad_medico_dia.sum(axis=1)
+    resumen_medicos = []
+    for i, id_m in enumerate(medicos_ids.tolist()):
+        emp = empleados_dict.get(id_m)
+        resumen_medicos.append({
+            'id_emp': id_m,
+            'nombre': f"{emp.nom_emp} {emp.apellido_emp}" if emp else None,
+            'minutos_reservados': int(total_ocupado[i]),
+            'minutos_disponibles': int(total_capacidad[i]),
+            'ocupacion': _ratio(total_ocupado[i:i + 1], total_capacidad[i:i + 1])[0]
+        })
+
+    return {
+        'dias': [d.isoformat() for d in dias],
+        'horas': list(range(HORAS_DIA)),
+        'total_citas': int(len(filas)),
+        'medicos': resumen_medicos,
+        'ocupacion_medico_dia': _ratio(ocupado_medico_dia, capacidad_medico_dia),
+        'ocupacion_dia_hora': _ratio(ocupado_dia_hora, capacidad_dia_hora),
+        'ocupacion_semana_hora': _ratio(ocupado_semana_hora, capacidad_semana_hora),
+        'departamentos': resumen_departamentos
+    }
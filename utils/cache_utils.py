@@ -0,0 +1,104 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from utils.metrics_utils import incrementar
+
+_MISSING = object()
+
+# ===============================================
+# CACHE EN MEMORIA CON EXPIRACIÓN
+# ===============================================
+
+class TTLCache:
+    """Cache en memoria del proceso con expiración por entrada y límite de tamaño.
+
+    get_or_compute agrupa a los llamadores concurrentes de una misma clave
+    para que compartan un único cálculo (single-flight).
+    """
+    
+    def __init__(self, nombre: str, ttl_seconds: float, max_entries: int = 1024):
+        self.nombre = nombre
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._datos = OrderedDict()
+        self._lock = threading.Lock()
+        self._en_vuelo = {}
+    
+    def get(self, key, default=None):
+        """Obtener un valor vigente o default"""
+        with self._lock:
+            entrada = self._datos.get(key)
+            if entrada is not None:
+                expira, valor = entrada
+                if expira > time.monotonic():
+                    self._datos.move_to_end(key)
+                    incrementar(f"cache.{self.nombre}.hit")
+                    return valor
+                del self._datos[key]
+        incrementar(f"cache.{self.nombre}.miss")
+        return default
+    
+    def set(self, key, value):
+        """Guardar un valor con el TTL del cache"""
+        with self._lock:
+            self._datos[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._datos.move_to_end(key)
+            while len(self._datos) > self.max_entries:
+                self._datos.popitem(last=False)
+    
+    def invalidate(self, key):
+        """Eliminar una entrada"""
+        with self._lock:
+            self._datos.pop(key, None)
+    
+    def clear(self):
+        """Vaciar el cache"""
+        with self._lock:
+            self._datos.clear()
+    
+    async def get_or_compute(self, key, factory):
+        """Devolver el valor cacheado o calcularlo con factory (corrutina).
+
+        Si ya hay un cálculo en curso para la clave, se espera ese mismo
+        resultado en lugar de lanzar otro.
+        """
+        valor = self.get(key, _MISSING)
+        if valor is not _MISSING:
+            return valor
+        
+        tarea = self._en_vuelo.get(key)
+        if tarea is None:
+            tarea = asyncio.ensure_future(self._calcular(key, factory))
+            self._en_vuelo[key] = tarea
+        else:
+            incrementar(f"cache.{self.nombre}.compartido")
+        # shield: si un llamador se cancela, el cálculo sigue para los demás
+        return await asyncio.shield(tarea)
+    
+    async def _calcular(self, key, factory):
+        try:
+            valor = await factory()
+            self.set(key, valor)
+            return valor
+        finally:
+            self._en_vuelo.pop(key, None)
+
+# ===============================================
+# CACHES COMPARTIDOS ENTRE ROUTERS
+# ===============================================
+# Perfil de /auth/me por id_emp. Se invalida desde las rutas que modifican
+# el empleado, su usuario o su rol; el TTL acota lo que pueda quedar
+# desactualizado en otros procesos del servidor.
+PERFIL_CACHE_TTL_SECONDS = float(os.getenv("PERFIL_CACHE_TTL_SECONDS", "300"))
+cache_perfiles = TTLCache("perfil_usuario", ttl_seconds=PERFIL_CACHE_TTL_SECONDS, max_entries=4096)
+
+def invalidar_perfil(id_emp):
+    """Descartar el perfil cacheado de un empleado"""
+    cache_perfiles.invalidate(int(id_emp))
+
+def invalidar_perfiles():
+    """Descartar todos los perfiles (p. ej. al cambiar la definición de un rol)"""
+    cache_perfiles.clear()
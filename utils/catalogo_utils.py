@@ -0,0 +1,254 @@
+import difflib
+import os
+import re
+import threading
+import unicodedata
+from datetime import datetime
+from typing import Iterable, List, Optional, Tuple
+
+from sqlalchemy import Integer, String, column, or_, update, values
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from central_models import EstadoMedicamento, Medicamento
+from dept_models import DetalleSolicitudMedicamento, MapeoMedicamento
+from utils.cache_utils import TTLCache
+from utils.metrics_utils import incrementar
+
+# ===============================================
+# RESOLUCIÓN DE MEDICAMENTOS EN TEXTO LIBRE
+# ===============================================
+# Las líneas de prescripción llegan como texto libre. Cada "nombre
+# concentración | principio activo" normalizado se resuelve una sola vez
+# contra el catálogo central, en este orden: nombre exacto, principio activo y, por último,
+# nombre parecido según difflib; la concentración debe coincidir siempre
+# (o, si la línea no la trae, el nombre debe tener una sola). El resultado
+# (también los que no se pudieron resolver) queda en mapeo_medicamento y en
+# memoria, de modo que las consultas posteriores unen por cod_med.
+
+CATALOGO_CACHE_TTL_SECONDS = float(os.getenv("CATALOGO_CACHE_TTL_SECONDS", "600"))
+RESOLUCION_SIMILITUD_MINIMA = float(os.getenv("RESOLUCION_SIMILITUD_MINIMA", "0.85"))
+BACKFILL_LOTE = 1000
+
+METODO_EXACTO = "EXACTO"
+METODO_NOMBRE = "NOMBRE"
+METODO_PRINCIPIO = "PRINCIPIO"
+METODO_APROXIMADO = "APROXIMADO"
+METODO_SIN_RESOLVER = "SIN_RESOLVER"
+
+_SIN_CACHE = object()
+_mapeos = TTLCache("mapeo_medicamento", ttl_seconds=3600, max_entries=20000)
+_indice = None
+_indice_cargado_en = None
+_indice_lock = threading.Lock()
+
+def normalizar_nombre(texto) -> str:
+    """Minúsculas, sin acentos y con espacios colapsados"""
+    if not texto:
+        return ""
+    sin_acentos = "".join(
+        c for c in unicodedata.normalize("NFKD", texto) if not unicodedata.combining(c)
+    )
+    return " ".join(sin_acentos.lower().split())
+
+def clave_linea(nombre, concentracion=None) -> str:
+    """Clave de memoización: nombre y concentración normalizados ("500 mg" == "500mg")"""
+    clave = normalizar_nombre(f"{nombre or ''} {concentracion or ''}")
+    return re.sub(r"(\d)\s+(?=[a-z%])", r"\1", clave)
+
+def clave_mapeo(nombre, principio_activo=None, concentracion=None) -> str:
+    """Clave en mapeo_medicamento: incluye el principio activo porque el resolver también lo usa"""
+    return f"{clave_linea(nombre, concentracion)}|{normalizar_nombre(principio_activo)}"
+
+class IndiceCatalogo:
+    """Índices en memoria del catálogo para resolver líneas"""
+
+    def __init__(self, filas):
+        # nombre normalizado -> {concentración normalizada: cod_med}
+        self.por_nombre = {}
+        self.por_principio = {}
+        # "nombre concentración" completo, para líneas que traen la concentración en el nombre
+        self.por_clave = {}
+        for cod_med, nom_med, principio_activo, concentracion in filas:
+            self.por_clave.setdefault(clave_linea(nom_med, concentracion), cod_med)
+            self.por_nombre.setdefault(normalizar_nombre(nom_med), {}).setdefault(
+                clave_linea(concentracion), cod_med
+            )
+            self.por_principio.setdefault(normalizar_nombre(principio_activo), {}).setdefault(
+                clave_linea(concentracion), cod_med
+            )
+        self.nombres = list(self.por_nombre)
+
+    @staticmethod
+    def _presentacion(presentaciones: dict, concentracion) -> Optional[int]:
+        # La concentración nunca se aproxima: 600 mg no es 800 mg
+        if not presentaciones:
+            return None
+        if concentracion:
+            return presentaciones.get(clave_linea(concentracion))
+        return next(iter(presentaciones.values())) if len(presentaciones) == 1 else None
+
+    def resolver(self, nombre, principio_activo=None, concentracion=None) -> Tuple[Optional[int], str, Optional[float]]:
+        """(cod_med, método, similitud) para una línea"""
+        clave = clave_linea(nombre, concentracion)
+        if clave in self.por_clave:
+            return self.por_clave[clave], METODO_EXACTO, 1.0
+
+        nombre = normalizar_nombre(nombre)
+        cod_med = self._presentacion(self.por_nombre.get(nombre), concentracion)
+        if cod_med is not None:
+            return cod_med, METODO_NOMBRE, 1.0
+
+        if principio_activo:
+            cod_med = self._presentacion(self.por_principio.get(normalizar_nombre(principio_activo)), concentracion)
+            if cod_med is not None:
+                return cod_med, METODO_PRINCIPIO, 1.0
+
+        if nombre not in self.por_nombre:
+            parecidos = difflib.get_close_matches(nombre, self.nombres, n=1, cutoff=RESOLUCION_SIMILITUD_MINIMA)
+            if parecidos:
+                cod_med = self._presentacion(self.por_nombre[parecidos[0]], concentracion)
+                if cod_med is not None:
+                    similitud = difflib.SequenceMatcher(None, nombre, parecidos[0]).ratio()
+                    return cod_med, METODO_APROXIMADO, round(similitud, 3)
+
+        return None, METODO_SIN_RESOLVER, None
+
+def _obtener_indice(central_db: Session) -> IndiceCatalogo:
+    global _indice, _indice_cargado_en
+    with _indice_lock:
+        vencido = _indice_cargado_en is None or (
+            (datetime.utcnow() - _indice_cargado_en).total_seconds() >= CATALOGO_CACHE_TTL_SECONDS
+        )
+        if vencido:
+            filas = central_db.query(
+                Medicamento.cod_med,
+                Medicamento.nom_med,
+                Medicamento.principio_activo,
+                Medicamento.concentracion
+            ).filter(
+                # Sin estado cuenta como dispensable (igual que en ajustar_stock)
+                or_(
+                    Medicamento.estado_medicamento.is_(None),
+                    Medicamento.estado_medicamento != EstadoMedicamento.RETIRADO
+                )
+            ).order_by(Medicamento.cod_med).all()
+            _indice = IndiceCatalogo(filas)
+            _indice_cargado_en = datetime.utcnow()
+        return _indice
+
+def invalidar_resoluciones():
+    """Olvidar el catálogo y los mapeos en memoria (p. ej. tras un backfill)"""
+    global _indice_cargado_en
+    with _indice_lock:
+        _indice_cargado_en = None
+    _mapeos.clear()
+
+def resolver_lineas(central_db: Session, dept_db: Session,
+                    lineas: Iterable[Tuple[str, Optional[str], Optional[str]]]) -> List[Optional[int]]:
+    """cod_med de cada línea (nombre, principio_activo, concentración); registra los mapeos nuevos (no hace commit)"""
+    lineas = list(lineas)
+    claves = [
+        clave_mapeo(nombre, principio_activo, concentracion)
+        for nombre, principio_activo, concentracion in lineas
+    ]
+
+    resueltas = {}
+    pendientes = set()
+    for clave in set(claves):
+        cod_med = _mapeos.get(clave, _SIN_CACHE)
+        if cod_med is _SIN_CACHE:
+            pendientes.add(clave)
+        else:
+            resueltas[clave] = cod_med
+
+    if pendientes:
+        for clave, cod_med in dept_db.query(MapeoMedicamento.clave, MapeoMedicamento.cod_med).filter(
+            MapeoMedicamento.clave.in_(pendientes)
+        ).all():
+            resueltas[clave] = cod_med
+            _mapeos.set(clave, cod_med)
+            pendientes.discard(clave)
+
+    if pendientes:
+        indice = _obtener_indice(central_db)
+        ahora = datetime.utcnow()
+        nuevas = []
+        for (nombre, principio_activo, concentracion), clave in zip(lineas, claves):
+            if clave not in pendientes or clave in resueltas:
+                continue
+            cod_med, metodo, similitud = indice.resolver(nombre, principio_activo, concentracion)
+            resueltas[clave] = cod_med
+            nuevas.append({
+                'clave': clave,
+                'cod_med': cod_med,
+                'metodo': metodo,
+                'similitud': similitud,
+                'created_at': ahora
+            })
+            incrementar(f"catalogo.resolucion_{metodo.lower()}")
+        dept_db.execute(
+            pg_insert(MapeoMedicamento).values(nuevas).on_conflict_do_nothing(
+                index_elements=[MapeoMedicamento.clave]
+            )
+        )
+        for fila in nuevas:
+            _mapeos.set(fila['clave'], fila['cod_med'])
+
+    return [resueltas[clave] for clave in claves]
+
+def backfill_cod_med(central_db: Session, dept_db: Session, reintentar: bool = False) -> dict:
+    """Completar cod_med en las líneas existentes, por lotes (hace commit)"""
+    if reintentar:
+        # Volver a intentar lo que no se resolvió (p. ej. medicamentos nuevos en el catálogo)
+        dept_db.query(MapeoMedicamento).filter(
+            MapeoMedicamento.cod_med.is_(None)
+        ).delete(synchronize_session=False)
+        dept_db.commit()
+        invalidar_resoluciones()
+
+    variantes = dept_db.query(
+        DetalleSolicitudMedicamento.nombre_medicamento,
+        DetalleSolicitudMedicamento.principio_activo,
+        DetalleSolicitudMedicamento.concentracion
+    ).filter(
+        DetalleSolicitudMedicamento.cod_med.is_(None)
+    ).group_by(
+        DetalleSolicitudMedicamento.nombre_medicamento,
+        DetalleSolicitudMedicamento.principio_activo,
+        DetalleSolicitudMedicamento.concentracion
+    ).all()
+
+    lineas_actualizadas = 0
+    sin_resolver = 0
+    for inicio in range(0, len(variantes), BACKFILL_LOTE):
+        lote = variantes[inicio:inicio + BACKFILL_LOTE]
+        codigos = resolver_lineas(central_db, dept_db, lote)
+        datos = [
+            (nombre, principio_activo, concentracion, cod_med)
+            for (nombre, principio_activo, concentracion), cod_med in zip(lote, codigos)
+            if cod_med is not None
+        ]
+        sin_resolver += len(lote) - len(datos)
+        if datos:
+            resueltas = values(
+                column("nombre", String), column("principio_activo", String),
+                column("concentracion", String), column("cod_med", Integer),
+                name="resueltas"
+            ).data(datos)
+            lineas_actualizadas += dept_db.execute(
+                update(DetalleSolicitudMedicamento).where(
+                    DetalleSolicitudMedicamento.cod_med.is_(None),
+                    DetalleSolicitudMedicamento.nombre_medicamento == resueltas.c.nombre,
+                    DetalleSolicitudMedicamento.principio_activo.is_not_distinct_from(resueltas.c.principio_activo),
+                    DetalleSolicitudMedicamento.concentracion.is_not_distinct_from(resueltas.c.concentracion)
+                ).values(cod_med=resueltas.c.cod_med),
+                execution_options={"synchronize_session": False}
+            ).rowcount
+        dept_db.commit()
+
+    return {
+        'variantes': len(variantes),
+        'variantes_sin_resolver': sin_resolver,
+        'lineas_actualizadas': lineas_actualizadas
+    }
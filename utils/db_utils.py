@@ -0,0 +1,43 @@
+import time
+from datetime import date
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from utils.metrics_utils import registrar_tiempo
+
+# ===============================================
+# ADVISORY LOCKS (POSTGRESQL)
+# ===============================================
+# Los locks se toman con pg_advisory_xact_lock, por lo que se liberan
+# solos al hacer commit o rollback de la transacción actual.
+
+# Espacios de nombres para que locks de distinto tipo no colisionen
+LOCK_NS_AGENDA_EMPLEADO = 1
+LOCK_NS_EVENTOS_STOCK = 2
+
+def _clave_lock(namespace: int, id_entidad: int, dia: date) -> int:
+    """Construir la clave bigint de un advisory lock: namespace | entidad | día"""
+    return (namespace << 56) | ((id_entidad & 0xFFFFFFFF) << 24) | (dia.toordinal() & 0xFFFFFF)
+
+def lock_agenda_empleado(db: Session, id_emp: int, fecha: date):
+    """Serializar operaciones sobre la agenda de un empleado en un día.
+
+    Solo bloquea a otras transacciones que tocan el mismo (id_emp, fecha);
+    las reservas de otros médicos o días avanzan en paralelo.
+    """
+    inicio = time.perf_counter()
+    db.execute(
+        text("SELECT pg_advisory_xact_lock(:clave)"),
+        {"clave": _clave_lock(LOCK_NS_AGENDA_EMPLEADO, id_emp, fecha)}
+    )
+    registrar_tiempo("citas.lock_agenda_espera", time.perf_counter() - inicio)
+
+def lock_eventos_stock(db: Session):
+    """Serializar hasta el commit las transacciones que escriben en evento_stock.
+
+    Así los id_evento se asignan en orden de commit y un lector que avanza por
+    id nunca salta un evento que aún no se había confirmado.
+    """
+    inicio = time.perf_counter()
+    db.execute(text("SELECT pg_advisory_xact_lock(:clave)"), {"clave": LOCK_NS_EVENTOS_STOCK << 56})
+    registrar_tiempo("stock.lock_eventos_espera", time.perf_counter() - inicio)
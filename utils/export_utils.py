@@ -0,0 +1,257 @@
+import json
+import os
+import uuid
+from datetime import datetime
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import (
+    Boolean, Date, DateTime, Float, Integer, Numeric, String, Text, Time,
+    cast, extract, func, literal, select
+)
+
+from database import central_engine, dept_engine
+from central_models import Paciente
+from dept_models import Cita, Interconsulta, SolicitudPrescripcion, DetalleSolicitudMedicamento
+
+# ===============================================
+# EXPORTACIÓN ANALÍTICA A PARQUET
+# ===============================================
+# Cada tabla se lee con un cursor del lado del servidor y se escribe por
+# lotes (record batches) en archivos Parquet particionados por la fecha de
+# su marca de actualización:
+#
+#   <salida>/<tabla>/fecha=YYYY-MM-DD/part-<ejecucion>.parquet
+#
+# Las ejecuciones son incrementales: _estado.json guarda por tabla la mayor
+# marca exportada y la siguiente ejecución solo lee filas posteriores. Una
+# fila modificada vuelve a aparecer en una partición más reciente; los
+# consumidores deben quedarse con la versión de mayor marca por id.
+
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "50000"))
+ARCHIVO_ESTADO = "_estado.json"
+PARTICION_SIN_FECHA = "sin_fecha"
+
+_TIPOS_ARROW = [
+    (Boolean, pa.bool_()),
+    (Integer, pa.int64()),
+    (Float, pa.float64()),
+    (DateTime, pa.timestamp("us")),
+    (Date, pa.date32()),
+    (Time, pa.time64("us")),
+    (String, pa.string()),
+    (Text, pa.string()),
+]
+
+def _tipo_arrow(tipo_sql):
+    # Numeric llega como Decimal: se exporta como decimal con la precisión y
+    # escala de la columna (Float es subclase de Numeric y sigue en float64)
+    if isinstance(tipo_sql, Numeric) and not isinstance(tipo_sql, Float):
+        if tipo_sql.precision is None:
+            return pa.decimal128(38, 10)
+        if tipo_sql.precision > 38:
+            return pa.decimal256(tipo_sql.precision, tipo_sql.scale or 0)
+        return pa.decimal128(tipo_sql.precision, tipo_sql.scale or 0)
+    for tipo, tipo_arrow in _TIPOS_ARROW:
+        if isinstance(tipo_sql, tipo):
+            return tipo_arrow
+    return pa.string()
+
+def _seudonimo(columna, salt: str):
+    """Identificador estable y no reversible (md5 con salt) calculado en la BD"""
+    return func.md5(literal(salt) + cast(columna, String))
+
+def definir_exportaciones(salt: str) -> dict:
+    """Consultas de exportación por tabla: (engine, select, columna de marca)"""
+    marca_cita = func.coalesce(Cita.updated_at, Cita.created_at)
+    marca_ic = func.coalesce(Interconsulta.updated_at, Interconsulta.created_at)
+    marca_sol = func.coalesce(SolicitudPrescripcion.updated_at, SolicitudPrescripcion.created_at)
+    marca_pac = func.coalesce(Paciente.updated_at, Paciente.created_at)
+
+    return {
+        "cita": (dept_engine, select(
+            Cita.id_cita,
+            _seudonimo(Cita.cod_pac, salt).label("paciente_id"),
+            Cita.id_emp,
+            Cita.id_tipo_cita,
+            Cita.id_dept,
+            Cita.fecha_cita,
+            Cita.hora_inicio,
+            Cita.hora_fin,
+            Cita.duracion_real_min,
+            Cita.requiere_seguimiento,
+            Cita.prioridad,
+            cast(Cita.estado_cita, String).label("estado_cita"),
+            Cita.created_at,
+            marca_cita.label("marca")
+        ), marca_cita),
+        "interconsulta": (dept_engine, select(
+            Interconsulta.id_interconsulta,
+            _seudonimo(Interconsulta.cod_pac, salt).label("paciente_id"),
+            Interconsulta.id_cita_origen,
+            Interconsulta.id_emp_solicitante,
+            Interconsulta.id_dept_solicitante,
+            Interconsulta.dept_destino_nombre,
+            Interconsulta.urgente,
+            Interconsulta.fecha_solicitud,
+            Interconsulta.fecha_respuesta_esperada,
+            Interconsulta.fecha_respuesta_recibida,
+            Interconsulta.estado_interconsulta,
+            Interconsulta.created_at,
+            marca_ic.label("marca")
+        ), marca_ic),
+        "solicitud_prescripcion": (dept_engine, select(
+            SolicitudPrescripcion.id_solicitud,
+            _seudonimo(SolicitudPrescripcion.cod_pac, salt).label("paciente_id"),
+            SolicitudPrescripcion.id_cita,
+            SolicitudPrescripcion.id_emp_prescriptor,
+            SolicitudPrescripcion.diagnostico,
+            SolicitudPrescripcion.urgente,
+            SolicitudPrescripcion.fecha_solicitud,
+            SolicitudPrescripcion.estado_solicitud,
+            SolicitudPrescripcion.fecha_respuesta_farmacia,
+            SolicitudPrescripcion.created_at,
+            marca_sol.label("marca")
+        ), marca_sol),
+        "detalle_solicitud_medicamento": (dept_engine, select(
+            DetalleSolicitudMedicamento.id_detalle_solicitud,
+            DetalleSolicitudMedicamento.id_solicitud,
+            DetalleSolicitudMedicamento.nombre_medicamento,
+            DetalleSolicitudMedicamento.principio_activo,
+            DetalleSolicitudMedicamento.concentracion,
+            DetalleSolicitudMedicamento.forma_farmaceutica,
+            DetalleSolicitudMedicamento.duracion_dias,
+            DetalleSolicitudMedicamento.cantidad_solicitada,
+            DetalleSolicitudMedicamento.via_administracion,
+            DetalleSolicitudMedicamento.created_at.label("marca")
+        ), DetalleSolicitudMedicamento.created_at),
+        # Solo datos demográficos: sin nombre, cédula, contacto ni dirección
+        "paciente": (central_engine, select(
+            _seudonimo(Paciente.cod_pac, salt).label("paciente_id"),
+            cast(extract("year", Paciente.fecha_nac), Integer).label("anio_nacimiento"),
+            cast(Paciente.genero, String).label("genero"),
+            Paciente.id_tipo_sangre,
+            cast(Paciente.estado_paciente, String).label("estado_paciente"),
+            Paciente.id_dept_principal,
+            Paciente.fecha_ultima_atencion,
+            marca_pac.label("marca")
+        ), marca_pac),
+    }
+
+def _leer_estado(salida: str) -> dict:
+    ruta = os.path.join(salida, ARCHIVO_ESTADO)
+    if not os.path.exists(ruta):
+        return {}
+    with open(ruta) as f:
+        return json.load(f)
+
+def _guardar_estado(salida: str, estado: dict):
+    ruta = os.path.join(salida, ARCHIVO_ESTADO)
+    temporal = f"{ruta}.tmp"
+    with open(temporal, "w") as f:
+        json.dump(estado, f, indent=2)
+    os.replace(temporal, ruta)
+
+class _EscritorParticionado:
+    """Mantiene abierto un único ParquetWriter: las filas llegan ordenadas por marca"""
+
+    def __init__(self, directorio: str, schema: pa.Schema, ejecucion: str):
+        self.directorio = directorio
+        self.schema = schema
+        self.ejecucion = ejecucion
+        self._particion = None
+        self._writer = None
+
+    def escribir(self, particion: str, tabla: pa.Table):
+        if particion != self._particion:
+            self.cerrar()
+            ruta = os.path.join(self.directorio, f"fecha={particion}")
+            os.makedirs(ruta, exist_ok=True)
+            self._writer = pq.ParquetWriter(
+                os.path.join(ruta, f"part-{self.ejecucion}.parquet"), self.schema
+            )
+            self._particion = particion
+        self._writer.write_table(tabla)
+
+    def cerrar(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            self._particion = None
+
+def _lote_a_tabla(filas, nombres, tipos) -> pa.Table:
+    """Convertir un lote de filas a tabla Arrow columna por columna"""
+    columnas = list(zip(*filas))
+    arrays = [pa.array(col, type=tipo) for col, tipo in zip(columnas, tipos)]
+    return pa.Table.from_arrays(arrays, names=nombres)
+
+def exportar_tabla(nombre: str, engine, consulta, marca, salida: str, desde=None,
+                   batch_size: int = EXPORT_BATCH_SIZE) -> dict:
+    """Exportar una tabla a Parquet de forma incremental y con memoria acotada"""
+    nombres = [c.name for c in consulta.selected_columns]
+    tipos = [_tipo_arrow(c.type) for c in consulta.selected_columns]
+    schema = pa.schema(list(zip(nombres, tipos)))
+    indice_marca = nombres.index("marca")
+
+    if desde is not None:
+        consulta = consulta.where(marca > desde)
+    consulta = consulta.order_by(marca.asc().nulls_first())
+
+    escritor = _EscritorParticionado(
+        os.path.join(salida, nombre), schema,
+        f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+    )
+    total = 0
+    maxima = desde
+    try:
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=batch_size).execute(consulta)
+            for filas in result.partitions(batch_size):
+                tabla = _lote_a_tabla(filas, nombres, tipos)
+                fechas = pc.cast(tabla.column(indice_marca), pa.date32())
+
+                # Filas sin marca: solo aparecen en la exportación completa
+                sin_fecha = pc.is_null(fechas)
+                if pc.any(sin_fecha).as_py():
+                    escritor.escribir(PARTICION_SIN_FECHA, tabla.filter(sin_fecha))
+                    tabla = tabla.filter(pc.invert(sin_fecha))
+                    fechas = fechas.filter(pc.invert(sin_fecha))
+
+                for fecha in pc.unique(fechas).to_pylist():
+                    escritor.escribir(fecha.isoformat(), tabla.filter(pc.equal(fechas, fecha)))
+
+                total += len(filas)
+                ultima = filas[-1][indice_marca]
+                if ultima is not None:
+                    maxima = ultima
+    finally:
+        escritor.cerrar()
+
+    return {"filas": total, "marca_maxima": maxima}
+
+def exportar_analitica(salida: str, tablas=None, completo: bool = False) -> dict:
+    """Exportar las tablas pedidas (todas por defecto) y actualizar el estado"""
+    salt = os.getenv("EXPORT_ANON_SALT")
+    if not salt:
+        raise ValueError("Defina EXPORT_ANON_SALT para seudonimizar pacientes de forma estable")
+
+    os.makedirs(salida, exist_ok=True)
+    estado = {} if completo else _leer_estado(salida)
+    exportaciones = definir_exportaciones(salt)
+
+    resumen = {}
+    for nombre in tablas or exportaciones.keys():
+        engine, consulta, marca = exportaciones[nombre]
+        desde = estado.get(nombre)
+        resultado = exportar_tabla(
+            nombre, engine, consulta, marca, salida,
+            desde=datetime.fromisoformat(desde) if desde else None
+        )
+        if resultado["marca_maxima"] is not None:
+            estado[nombre] = resultado["marca_maxima"].isoformat()
+        # Se guarda tras cada tabla para no repetir trabajo si algo falla después
+        _guardar_estado(salida, estado)
+        resumen[nombre] = resultado["filas"]
+
+    return resumen
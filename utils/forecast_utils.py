@@ -0,0 +1,168 @@
+import math
+import os
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import Date, Integer, and_, case, cast, func, or_
+from sqlalchemy.orm import Session
+
+from central_models import Medicamento, EstadoMedicamento
+from dept_models import SolicitudPrescripcion, DetalleSolicitudMedicamento
+
+# ===============================================
+# PRONÓSTICO DE DEMANDA Y PUNTO DE REORDEN
+# ===============================================
+# Una consulta agrega la demanda diaria por cod_med (resuelto al crear cada
+# línea, ver utils/catalogo_utils.py) y otra trae el catálogo completo; el
+# resto (tasas móviles, días de cobertura, stock de seguridad y cantidades
+# sugeridas) se calcula en bloque con NumPy.
+
+HISTORIA_DIAS_DEFAULT = 90
+VENTANA_CORTA_DIAS = 7
+VENTANA_LARGA_DIAS = 28
+# Peso de la ventana corta en la tasa de consumo combinada
+PESO_VENTANA_CORTA = 0.6
+LEAD_TIME_DIAS_DEFAULT = int(os.getenv("FARMACIA_LEAD_TIME_DIAS", "7"))
+# Días de consumo que debe cubrir un pedido además del lead time
+DIAS_REVISION = int(os.getenv("FARMACIA_DIAS_REVISION", "7"))
+# z para ~95% de nivel de servicio
+Z_NIVEL_SERVICIO = 1.65
+ESTADOS_SOLICITUD_EXCLUIDOS = ['CANCELADA', 'RECHAZADA']
+
+def _demanda_diaria(dept_db: Session, fecha_desde: date, fecha_hasta: date):
+    """Filas (cod_med, nombre, día, cantidad) agregadas en la BD; nombre solo si no hay cod_med"""
+    dia = cast(cast(SolicitudPrescripcion.fecha_solicitud, Date) - fecha_desde, Integer)
+    cod_med = DetalleSolicitudMedicamento.cod_med
+    nombre = case(
+        (cod_med.is_(None), func.lower(func.trim(DetalleSolicitudMedicamento.nombre_medicamento)))
+    )
+    return dept_db.query(
+        cod_med.label("cod_med"),
+        nombre.label("nombre"),
+        dia.label("dia"),
+        func.sum(DetalleSolicitudMedicamento.cantidad_solicitada).label("cantidad")
+    ).join(
+        SolicitudPrescripcion,
+        SolicitudPrescripcion.id_solicitud == DetalleSolicitudMedicamento.id_solicitud
+    ).filter(
+        and_(
+            cast(SolicitudPrescripcion.fecha_solicitud, Date) >= fecha_desde,
+            cast(SolicitudPrescripcion.fecha_solicitud, Date) <= fecha_hasta,
+            SolicitudPrescripcion.estado_solicitud.notin_(ESTADOS_SOLICITUD_EXCLUIDOS)
+        )
+    ).group_by(cod_med, nombre, dia).all()
+
+def calcular_sugerencias_reorden(
+    central_db: Session,
+    dept_db: Session,
+    historia_dias: int = HISTORIA_DIAS_DEFAULT,
+    lead_time_dias: int = LEAD_TIME_DIAS_DEFAULT,
+    solo_sugeridos: bool = True
+) -> dict:
+    """Tasas de consumo, cobertura y sugerencias de reorden para todo el catálogo"""
+    hoy = date.today()
+    fecha_desde = hoy - timedelta(days=historia_dias - 1)
+
+    catalogo = central_db.query(
+        Medicamento.cod_med,
+        Medicamento.nom_med,
+        Medicamento.principio_activo,
+        Medicamento.concentracion,
+        Medicamento.stock_actual,
+        Medicamento.stock_minimo,
+        Medicamento.stock_maximo
+    ).filter(
+        # Sin estado cuenta como dispensable (igual que en catalogo_utils)
+        or_(
+            Medicamento.estado_medicamento.is_(None),
+            Medicamento.estado_medicamento != EstadoMedicamento.RETIRADO
+        )
+    ).order_by(Medicamento.cod_med).all()
+    n_meds = len(catalogo)
+
+    indice_por_cod = {med.cod_med: i for i, med in enumerate(catalogo)}
+
+    demanda = _demanda_diaria(dept_db, fecha_desde, hoy)
+    codigos, nombres, dias, cantidades = (list(col) for col in zip(*demanda)) if demanda else ([], [], [], [])
+
+    med_idx = np.fromiter((indice_por_cod.get(c, -1) for c in codigos), dtype=np.int64, count=len(codigos))
+    dia_idx = np.array(dias, dtype=np.int64)
+    cantidad = np.array(cantidades, dtype=np.float64)
+
+    resueltos = med_idx >= 0
+    # Líneas sin cod_med (ver resolver_cod_med.py) o de medicamentos retirados
+    sin_resolver = sorted({
+        n if c is None else f"cod_med {c}"
+        for c, n, ok in zip(codigos, nombres, resueltos.tolist()) if not ok
+    })
+
+    # Matriz medicamentos x días
+    matriz = np.bincount(
+        med_idx[resueltos] * historia_dias + dia_idx[resueltos],
+        weights=cantidad[resueltos],
+        minlength=n_meds * historia_dias
+    ).reshape(n_meds, historia_dias)
+
+    corta = min(VENTANA_CORTA_DIAS, historia_dias)
+    larga = min(VENTANA_LARGA_DIAS, historia_dias)
+    tasa_corta = matriz[:, -corta:].mean(axis=1)
+    tasa_larga = matriz[:, -larga:].mean(axis=1)
+    desviacion = matriz[:, -larga:].std(axis=1)
+    tasa = PESO_VENTANA_CORTA * tasa_corta + (1 - PESO_VENTANA_CORTA) * tasa_larga
+
+    stock = np.array([m.stock_actual or 0 for m in catalogo], dtype=np.float64)
+    stock_minimo = np.array([m.stock_minimo or 0 for m in catalogo], dtype=np.float64)
+    stock_maximo = np.array([m.stock_maximo or 0 for m in catalogo], dtype=np.float64)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dias_cobertura = np.where(tasa > 0, stock / tasa, np.inf)
+
+    stock_seguridad = Z_NIVEL_SERVICIO * desviacion * math.sqrt(lead_time_dias)
+    punto_reorden = np.maximum(tasa * lead_time_dias + stock_seguridad, stock_minimo)
+    objetivo = np.where(
+        stock_maximo > 0,
+        stock_maximo,
+        punto_reorden + tasa * DIAS_REVISION
+    )
+    faltante = np.ceil(np.clip(objetivo - stock, 0, None))
+    # Sin nada que pedir no hay sugerencia (p. ej. stock, mínimo, máximo y demanda en 0)
+    sugerir = (stock <= punto_reorden) & (faltante > 0)
+    cantidad_sugerida = np.where(sugerir, faltante, 0)
+
+    indices = np.flatnonzero(sugerir) if solo_sugeridos else np.arange(n_meds)
+    # Primero los que antes se quedan sin stock
+    indices = indices[np.argsort(dias_cobertura[indices], kind="stable")]
+
+    medicamentos = [{
+        'cod_med': catalogo[i].cod_med,
+        'nom_med': catalogo[i].nom_med,
+        'principio_activo': catalogo[i].principio_activo,
+        'concentracion': catalogo[i].concentracion,
+        'stock_actual': int(stock[i]),
+        'stock_minimo': catalogo[i].stock_minimo,
+        'stock_maximo': catalogo[i].stock_maximo,
+        'consumo_diario': {
+            f'{corta}d': round(float(tasa_corta[i]), 3),
+            f'{larga}d': round(float(tasa_larga[i]), 3),
+            'combinado': round(float(tasa[i]), 3)
+        },
+        'dias_cobertura': round(float(dias_cobertura[i]), 1) if np.isfinite(dias_cobertura[i]) else None,
+        'stock_seguridad': round(float(stock_seguridad[i]), 1),
+        'punto_reorden': round(float(punto_reorden[i]), 1),
+        'reordenar': bool(sugerir[i]),
+        'cantidad_sugerida': int(cantidad_sugerida[i])
+    } for i in indices.tolist()]
+
+    return {
+        'generado_para': hoy.isoformat(),
+        'parametros': {
+            'historia_dias': historia_dias,
+            'lead_time_dias': lead_time_dias,
+            'dias_revision': DIAS_REVISION,
+            'z_nivel_servicio': Z_NIVEL_SERVICIO
+        },
+        'total_catalogo': n_meds,
+        'total_sugeridos': int(sugerir.sum()),
+        'medicamentos': medicamentos,
+        'nombres_sin_resolver': sin_resolver
+    }
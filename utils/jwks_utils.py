@@ -0,0 +1,174 @@
+import json
+import os
+import threading
+import time
+import urllib.request
+from datetime import datetime
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk, jwt
+from jose.exceptions import JWTError
+
+from utils.metrics_utils import incrementar
+
+# ===============================================
+# FIRMA RS256 CON ROTACIÓN DE LLAVES (JWKS)
+# ===============================================
+# Las llaves viven en JWT_KEYS_DIR:
+#
+#   <kid>.pem      llave privada: firma y verifica
+#   <kid>.pub.pem  solo llave pública: verifica (llaves retiradas o nodos
+#                  que no emiten tokens)
+#
+# Se firma con JWT_ACTIVE_KID o, si no está definido, con la llave privada
+# de kid mayor (p. ej. kids con fecha: 2026-10-18). Para rotar se agrega la
+# llave nueva y se mantiene la anterior (o su .pub.pem) mientras existan
+# tokens firmados con ella. Los nodos sin llaves locales verifican con el
+# JWKS publicado en JWT_JWKS_URL (/auth/jwks del servicio de autenticación),
+# cacheado y recargado cuando aparece un kid desconocido.
+
+JWT_ALGORITHM = "RS256"
+JWT_KEYS_DIR = os.getenv("JWT_KEYS_DIR", "keys")
+JWT_ACTIVE_KID = os.getenv("JWT_ACTIVE_KID")
+JWT_JWKS_URL = os.getenv("JWT_JWKS_URL")
+JWT_JWKS_CACHE_SECONDS = float(os.getenv("JWT_JWKS_CACHE_SECONDS", "300"))
+# Intervalo mínimo entre recargas provocadas por kids desconocidos
+RECARGA_MIN_SECONDS = 30
+
+_lock = threading.Lock()
+_firma = None            # (kid, Key privada)
+_verificacion = {}       # kid -> Key pública
+_jwks_locales = []       # JWKs públicos publicados en /auth/jwks
+_cargado_en = None
+_remoto_cargado_en = None
+
+def _jwk_publico(kid: str, llave_publica) -> dict:
+    pem = llave_publica.public_bytes(
+        serialization.Encoding.PEM, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    datos = jwk.construct(pem, JWT_ALGORITHM).to_dict()
+    datos.update({"kid": kid, "use": "sig", "alg": JWT_ALGORITHM})
+    return datos
+
+def _generar_llave_local():
+    """Crear una llave para desarrollo si el directorio no tiene ninguna"""
+    os.makedirs(JWT_KEYS_DIR, exist_ok=True)
+    kid = f"{datetime.utcnow():%Y-%m-%d}-auto"
+    privada = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = privada.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    )
+    try:
+        # "x": si otro worker la creó primero, se usa la suya
+        with open(os.path.join(JWT_KEYS_DIR, f"{kid}.pem"), "xb") as f:
+            f.write(pem)
+        os.chmod(os.path.join(JWT_KEYS_DIR, f"{kid}.pem"), 0o600)
+        print(f"⚠️ JWT: se generó la llave {kid} en {JWT_KEYS_DIR}; defina llaves propias en producción")
+    except FileExistsError:
+        pass
+
+def _cargar_locales():
+    privadas, publicas = {}, {}
+    if os.path.isdir(JWT_KEYS_DIR):
+        for nombre in sorted(os.listdir(JWT_KEYS_DIR)):
+            if not nombre.endswith(".pem"):
+                continue
+            with open(os.path.join(JWT_KEYS_DIR, nombre), "rb") as f:
+                contenido = f.read()
+            if nombre.endswith(".pub.pem"):
+                publicas[nombre[:-len(".pub.pem")]] = serialization.load_pem_public_key(contenido)
+            else:
+                privada = serialization.load_pem_private_key(contenido, password=None)
+                privadas[nombre[:-len(".pem")]] = privada
+                publicas[nombre[:-len(".pem")]] = privada.public_key()
+    return privadas, publicas
+
+def _cargar_remotas() -> dict:
+    with urllib.request.urlopen(JWT_JWKS_URL, timeout=5) as respuesta:
+        datos = json.load(respuesta)
+    return {
+        llave["kid"]: jwk.construct(llave, JWT_ALGORITHM)
+        for llave in datos.get("keys", [])
+        if llave.get("kid") and llave.get("alg", JWT_ALGORITHM) == JWT_ALGORITHM
+    }
+
+def recargar_llaves(forzar_remoto: bool = False):
+    """Releer las llaves locales y, si corresponde, el JWKS remoto"""
+    global _firma, _verificacion, _jwks_locales, _cargado_en, _remoto_cargado_en
+    with _lock:
+        privadas, publicas = _cargar_locales()
+        if not privadas and not publicas and not JWT_JWKS_URL:
+            _generar_llave_local()
+            privadas, publicas = _cargar_locales()
+
+        verificacion = {}
+        remoto_vencido = (
+            _remoto_cargado_en is None
+            or time.monotonic() - _remoto_cargado_en >= JWT_JWKS_CACHE_SECONDS
+        )
+        if JWT_JWKS_URL and (forzar_remoto or remoto_vencido):
+            try:
+                verificacion.update(_cargar_remotas())
+                _remoto_cargado_en = time.monotonic()
+                incrementar("jwks.recargas_remotas")
+            except Exception as e:
+                incrementar("jwks.errores_remotos")
+                print(f"⚠️ JWT: no se pudo leer {JWT_JWKS_URL}: {e}")
+                # Conservar las llaves remotas anteriores
+                verificacion.update({k: v for k, v in _verificacion.items() if k not in publicas})
+        elif JWT_JWKS_URL:
+            verificacion.update({k: v for k, v in _verificacion.items() if k not in publicas})
+
+        jwks_locales = []
+        for kid, publica in publicas.items():
+            datos = _jwk_publico(kid, publica)
+            jwks_locales.append(datos)
+            verificacion[kid] = jwk.construct(datos, JWT_ALGORITHM)
+
+        if privadas:
+            kid = JWT_ACTIVE_KID if JWT_ACTIVE_KID in privadas else max(privadas)
+            pem = privadas[kid].private_bytes(
+                serialization.Encoding.PEM,
+                serialization.PrivateFormat.PKCS8,
+                serialization.NoEncryption()
+            )
+            _firma = (kid, jwk.construct(pem, JWT_ALGORITHM))
+        else:
+            _firma = None
+
+        _verificacion = verificacion
+        _jwks_locales = jwks_locales
+        _cargado_en = time.monotonic()
+
+def _asegurar_cargado():
+    if _cargado_en is None:
+        recargar_llaves()
+
+def firmar_jwt(claims: dict) -> str:
+    """Firmar claims con la llave activa (header con kid)"""
+    _asegurar_cargado()
+    if _firma is None:
+        raise RuntimeError("Este nodo no tiene llave privada para firmar tokens")
+    kid, llave = _firma
+    return jwt.encode(claims, llave, algorithm=JWT_ALGORITHM, headers={"kid": kid})
+
+def verificar_jwt(token: str) -> dict:
+    """Verificar firma y expiración con la llave pública del kid del token"""
+    _asegurar_cargado()
+    kid = jwt.get_unverified_header(token).get("kid")
+    llave = _verificacion.get(kid)
+    if llave is None and time.monotonic() - _cargado_en >= RECARGA_MIN_SECONDS:
+        # Llave nueva (rotación en otro nodo) o JWKS remoto desactualizado
+        recargar_llaves(forzar_remoto=True)
+        llave = _verificacion.get(kid)
+    if llave is None:
+        raise JWTError(f"Llave de firma desconocida: {kid}")
+    return jwt.decode(token, llave, algorithms=[JWT_ALGORITHM])
+
+def obtener_jwks() -> dict:
+    """JWKS con las llaves públicas locales vigentes"""
+    _asegurar_cargado()
+    return {"keys": list(_jwks_locales)}
@@ -0,0 +1,31 @@
+import asyncio
+import time
+
+from fastapi.concurrency import run_in_threadpool
+
+from utils.metrics_utils import incrementar, medir_tiempo
+
+# ===============================================
+# TAREAS PERIÓDICAS EN SEGUNDO PLANO
+# ===============================================
+# Un único bucle por worker, lanzado desde el lifespan de main.py. Cada
+# tarea es una función síncrona (abre su propia sesión) que se ejecuta en
+# el threadpool cada `intervalo` segundos; un fallo no detiene al resto.
+
+TICK_SECONDS = 1.0
+
+async def bucle_mantenimiento(tareas):
+    """Ejecutar periódicamente las tareas [(nombre, funcion, intervalo_segundos)]"""
+    proxima = {nombre: 0.0 for nombre, _, _ in tareas}
+    while True:
+        for nombre, funcion, intervalo in tareas:
+            if time.monotonic() < proxima[nombre]:
+                continue
+            try:
+                with medir_tiempo(f"mantenimiento.{nombre}"):
+                    await run_in_threadpool(funcion)
+            except Exception as e:
+                incrementar(f"mantenimiento.{nombre}.errores")
+                print(f"⚠️ Error en tarea de mantenimiento {nombre}: {e}")
+            proxima[nombre] = time.monotonic() + intervalo
+        await asyncio.sleep(TICK_SECONDS)
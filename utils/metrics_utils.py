@@ -0,0 +1,63 @@
+import threading
+import time
+from contextlib import contextmanager
+
+# ===============================================
+# MÉTRICAS EN PROCESO
+# ===============================================
+# Registro sencillo de contadores y tiempos, expuesto en /metrics.
+# Cada worker de uvicorn mantiene sus propios valores.
+
+_lock = threading.Lock()
+_contadores = {}
+_tiempos = {}
+_medidores = {}
+
+def incrementar(nombre: str, valor: int = 1):
+    """Incrementar un contador"""
+    with _lock:
+        _contadores[nombre] = _contadores.get(nombre, 0) + valor
+
+def registrar_tiempo(nombre: str, segundos: float):
+    """Registrar una duración (en segundos) para un nombre de métrica"""
+    with _lock:
+        stats = _tiempos.get(nombre)
+        if stats is None:
+            stats = _tiempos[nombre] = {"count": 0, "total_ms": 0.0, "max_ms": 0.0}
+        ms = segundos * 1000
+        stats["count"] += 1
+        stats["total_ms"] += ms
+        if ms > stats["max_ms"]:
+            stats["max_ms"] = ms
+
+def fijar_medidor(nombre: str, valor):
+    """Fijar el valor actual de un medidor (gauge)"""
+    with _lock:
+        _medidores[nombre] = valor
+
+@contextmanager
+def medir_tiempo(nombre: str):
+    """Context manager que registra la duración del bloque"""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        registrar_tiempo(nombre, time.perf_counter() - inicio)
+
+def obtener_metricas() -> dict:
+    """Foto de todas las métricas registradas"""
+    with _lock:
+        tiempos = {
+            nombre: {
+                "count": s["count"],
+                "total_ms": round(s["total_ms"], 3),
+                "avg_ms": round(s["total_ms"] / s["count"], 3) if s["count"] else 0.0,
+                "max_ms": round(s["max_ms"], 3)
+            }
+            for nombre, s in _tiempos.items()
+        }
+        return {
+            "contadores": dict(_contadores),
+            "tiempos": tiempos,
+            "medidores": dict(_medidores)
+        }
@@ -0,0 +1,109 @@
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeout
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+
+from auth import pwd_context
+from utils.metrics_utils import fijar_medidor, incrementar, registrar_tiempo
+
+# ===============================================
+# HASHING DE CONTRASEÑAS EN POOL DE PROCESOS
+# ===============================================
+# bcrypt consume CPU a propósito. Los hashes y verificaciones se ejecutan en
+# un pool de procesos dedicado y acotado para que una ráfaga de logins no
+# ocupe los workers que atienden el resto de peticiones. Si ya hay
+# PASSWORD_MAX_PENDIENTES operaciones en curso o en cola, se responde 429.
+
+PASSWORD_WORKERS = int(os.getenv("PASSWORD_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+PASSWORD_MAX_PENDIENTES = int(os.getenv("PASSWORD_MAX_PENDIENTES", str(PASSWORD_WORKERS * 8)))
+PASSWORD_TIMEOUT_SECONDS = float(os.getenv("PASSWORD_TIMEOUT_SECONDS", "10"))
+RETRY_AFTER_SECONDS = 1
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+_cupos = threading.BoundedSemaphore(PASSWORD_MAX_PENDIENTES)
+_pendientes = 0
+_pendientes_lock = threading.Lock()
+
+def _hashear_en_worker(password: str) -> str:
+    return pwd_context.hash(password)
+
+def _verificar_en_worker(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    return pwd_context.verify_and_update(password, password_hash)
+
+def _medir_en_worker(funcion, encolado: float, *args):
+    """Devuelve el tiempo que la tarea esperó en cola junto con su resultado"""
+    return time.perf_counter() - encolado, funcion(*args)
+
+def _obtener_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ProcessPoolExecutor(max_workers=PASSWORD_WORKERS)
+    return _pool
+
+def _actualizar_pendientes(delta: int):
+    global _pendientes
+    with _pendientes_lock:
+        _pendientes += delta
+        fijar_medidor("password.pendientes", _pendientes)
+
+def _liberar_cupo():
+    _actualizar_pendientes(-1)
+    _cupos.release()
+
+def _ejecutar(funcion, *args):
+    """Ejecutar en el pool respetando el límite de operaciones pendientes"""
+    if not _cupos.acquire(blocking=False):
+        incrementar("password.rechazadas")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Servicio de autenticación saturado, intente nuevamente",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+
+    _actualizar_pendientes(1)
+    encolado = time.perf_counter()
+    try:
+        future = _obtener_pool().submit(_medir_en_worker, funcion, encolado, *args)
+    except Exception:
+        _liberar_cupo()
+        raise
+    # El cupo se libera cuando termina la tarea, aunque quien espera haya desistido
+    future.add_done_callback(lambda _: _liberar_cupo())
+
+    try:
+        espera, resultado = future.result(timeout=PASSWORD_TIMEOUT_SECONDS)
+    except FuturesTimeout:
+        incrementar("password.timeouts")
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Tiempo de espera agotado verificando credenciales",
+            headers={"Retry-After": str(RETRY_AFTER_SECONDS)}
+        )
+    registrar_tiempo("password.espera_cola", espera)
+    registrar_tiempo("password.total", time.perf_counter() - encolado)
+    return resultado
+
+def hashear_password(password: str) -> str:
+    """Hash bcrypt calculado en el pool de procesos"""
+    return _ejecutar(_hashear_en_worker, password)
+
+def verificar_password(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """Verificar contraseña en el pool; devuelve (válida, nuevo_hash si la política cambió)"""
+    valida, nuevo_hash = _ejecutar(_verificar_en_worker, password, password_hash)
+    if nuevo_hash:
+        incrementar("password.rehash")
+    return valida, nuevo_hash
+
+def cerrar_pool():
+    """Detener el pool de procesos (shutdown de la aplicación)"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True, cancel_futures=True)
+            _pool = None
@@ -0,0 +1,86 @@
+import os
+import threading
+import zlib
+
+from database import DeptSessionLocal
+from dept_models import RolEmpleado
+from utils.cache_utils import invalidar_perfiles
+from utils.metrics_utils import fijar_medidor
+
+# ===============================================
+# PERMISOS COMPILADOS A BITS
+# ===============================================
+# Cada rol se compila a un entero donde cada bit es un permiso (columnas
+# puede_* de rol_empleado o claves verdaderas de permisos_sistema). El token
+# lleva ese entero ("perm") y la versión del mapa con que se calculó ("pv");
+# si los roles cambiaron después de emitirlo, se usa el mapa vigente del
+# worker por nombre de rol. Ninguna comprobación consulta la BD.
+
+# El orden define el bit de cada permiso: agregar solo al final
+PERMISOS = [
+    "puede_prescribir",
+    "puede_ver_historias",
+    "puede_modificar_historias",
+    "puede_agendar_citas",
+    "puede_generar_reportes",
+    "es_administrador",
+    "puede_gestionar_empleados",
+    "puede_ver_finanzas",
+]
+BIT_PERMISO = {nombre: 1 << i for i, nombre in enumerate(PERMISOS)}
+COLUMNAS_PERMISO = [n for n in PERMISOS if hasattr(RolEmpleado, n)]
+
+PERMISOS_RECARGA_SECONDS = float(os.getenv("PERMISOS_RECARGA_SECONDS", "60"))
+
+_lock = threading.Lock()
+_permisos_por_rol = {}
+_version = 0
+
+def mascara(*permisos: str) -> int:
+    """Máscara con los bits de los permisos indicados"""
+    try:
+        return sum(BIT_PERMISO[p] for p in set(permisos))
+    except KeyError as e:
+        raise ValueError(f"Permiso desconocido: {e.args[0]}")
+
+def compilar_permisos_dict(permisos: dict) -> int:
+    """Bits de un diccionario {permiso: bool}; las claves desconocidas se ignoran"""
+    return sum(bit for nombre, bit in BIT_PERMISO.items() if (permisos or {}).get(nombre))
+
+def compilar_permisos(rol: RolEmpleado) -> int:
+    """Bits de un rol: columnas puede_* más permisos_sistema"""
+    bits = compilar_permisos_dict(rol.permisos_sistema if isinstance(rol.permisos_sistema, dict) else {})
+    for columna in COLUMNAS_PERMISO:
+        if getattr(rol, columna):
+            bits |= BIT_PERMISO[columna]
+    return bits
+
+def recargar_permisos():
+    """Recompilar todos los roles; si algo cambió se publica una nueva versión"""
+    global _permisos_por_rol, _version
+    db = DeptSessionLocal()
+    try:
+        roles = db.query(RolEmpleado).all()
+        compilados = {rol.nombre_rol: compilar_permisos(rol) for rol in roles}
+    finally:
+        db.close()
+
+    version = zlib.crc32(repr(sorted(compilados.items())).encode())
+    with _lock:
+        cambio = version != _version
+        _permisos_por_rol = compilados
+        _version = version
+    fijar_medidor("permisos.version", version)
+    if cambio:
+        # /auth/me muestra los permisos del rol
+        invalidar_perfiles()
+
+def version_permisos() -> int:
+    return _version
+
+def permisos_de_token(payload: dict) -> int:
+    """Bits efectivos del token: los embebidos si la versión sigue vigente"""
+    perm = payload.get("perm")
+    if perm is not None and payload.get("pv") == _version:
+        return perm
+    return _permisos_por_rol.get(payload.get("role"), perm or 0)
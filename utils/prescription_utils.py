@@ -0,0 +1,117 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from typing import Dict, Iterable, List, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import insert, literal, select
+from sqlalchemy.orm import Session
+
+from central_models import HistoriaClinica, Paciente
+from dept_models import DetalleSolicitudMedicamento, Empleado, SolicitudPrescripcion
+from schemas import SolicitudPrescripcionCreate
+from utils.catalogo_utils import resolver_lineas
+from utils.metrics_utils import incrementar
+
+# ===============================================
+# CREACIÓN DE SOLICITUDES DE PRESCRIPCIÓN POR LOTES
+# ===============================================
+# Las referencias de todas las solicitudes se validan con una consulta por
+# BD: la de la BD Central corre en un hilo mientras la de la BD
+# Departamento corre en el hilo de la petición (cada sesión la usa un solo
+# hilo). Las cabeceras se insertan en un INSERT ... RETURNING y los
+# detalles de todas ellas, ya con su cod_med resuelto, en un único INSERT
+# multi-fila.
+
+VALIDACION_WORKERS = int(os.getenv("VALIDACION_WORKERS", "4"))
+
+_validaciones = ThreadPoolExecutor(max_workers=VALIDACION_WORKERS, thread_name_prefix="validacion")
+
+def _referencias_centrales(central_db: Session, pacientes: Set[int], historias: Set[int]) -> Set[Tuple[str, int]]:
+    consulta = select(literal("paciente"), Paciente.cod_pac).where(
+        Paciente.cod_pac.in_(pacientes)
+    ).union_all(
+        select(literal("historia"), HistoriaClinica.cod_hist).where(HistoriaClinica.cod_hist.in_(historias))
+    )
+    return {(tipo, valor) for tipo, valor in central_db.execute(consulta).all()}
+
+def validar_referencias(central_db: Session, dept_db: Session, solicitudes: Iterable[SolicitudPrescripcionCreate]):
+    """Verificar pacientes, historias y prescriptores de todas las solicitudes (404 si falta alguno)"""
+    solicitudes = list(solicitudes)
+    pacientes = {s.cod_pac for s in solicitudes}
+    historias = {s.cod_hist for s in solicitudes}
+    empleados = {s.id_emp_prescriptor for s in solicitudes}
+
+    centrales = _validaciones.submit(_referencias_centrales, central_db, pacientes, historias)
+    try:
+        encontrados = set(dept_db.execute(
+            select(Empleado.id_emp).where(Empleado.id_emp.in_(empleados))
+        ).scalars().all())
+    finally:
+        # Aunque falle la consulta de la BD Departamento, el hilo debe soltar
+        # central_db antes de que la petición haga rollback y la cierre
+        wait([centrales])
+    existentes = centrales.result()
+
+    for s in solicitudes:
+        if ("paciente", s.cod_pac) not in existentes:
+            raise HTTPException(status_code=404, detail=f'Paciente no encontrado: {s.cod_pac}')
+        if ("historia", s.cod_hist) not in existentes:
+            raise HTTPException(status_code=404, detail=f'Historia clínica no encontrada: {s.cod_hist}')
+        if s.id_emp_prescriptor not in encontrados:
+            raise HTTPException(status_code=404, detail=f'Empleado no encontrado: {s.id_emp_prescriptor}')
+
+def insertar_solicitudes(central_db: Session, dept_db: Session,
+                         solicitudes: List[SolicitudPrescripcionCreate]) -> List[Dict]:
+    """Insertar solicitudes y detalles con una sentencia cada uno (no hace commit)"""
+    ahora = datetime.utcnow()
+    # Inserts sobre la tabla (Core): el bulk del ORM separa en lotes las filas
+    # que difieren en qué columnas son NULL
+    ids = dept_db.execute(
+        insert(SolicitudPrescripcion.__table__).returning(
+            SolicitudPrescripcion.id_solicitud, sort_by_parameter_order=True
+        ),
+        [{
+            'cod_pac': s.cod_pac,
+            'cod_hist': s.cod_hist,
+            'id_cita': s.id_cita,
+            'id_emp_prescriptor': s.id_emp_prescriptor,
+            'diagnostico': s.diagnostico,
+            'observaciones_medicas': s.observaciones_medicas,
+            'urgente': s.urgente,
+            'estado_solicitud': 'ENVIADA',
+            'fecha_solicitud': ahora,
+            'created_at': ahora,
+            'updated_at': ahora
+        } for s in solicitudes]
+    ).scalars().all()
+
+    lineas = [(id_solicitud, med) for id_solicitud, s in zip(ids, solicitudes) for med in s.medicamentos]
+    codigos = resolver_lineas(
+        central_db, dept_db,
+        [(med.nombre_medicamento, med.principio_activo, med.concentracion) for _, med in lineas]
+    )
+
+    detalles = [{
+        'id_solicitud': id_solicitud,
+        'nombre_medicamento': med.nombre_medicamento,
+        'principio_activo': med.principio_activo,
+        'concentracion': med.concentracion,
+        'forma_farmaceutica': med.forma_farmaceutica,
+        'dosis': med.dosis,
+        'frecuencia': med.frecuencia,
+        'duracion_dias': med.duracion_dias,
+        'cantidad_solicitada': med.cantidad_solicitada,
+        'instrucciones_especiales': med.instrucciones_especiales,
+        'via_administracion': med.via_administracion,
+        'justificacion_medica': med.justificacion_medica,
+        'cod_med': cod_med,
+        'created_at': ahora
+    } for (id_solicitud, med), cod_med in zip(lineas, codigos)]
+    dept_db.execute(insert(DetalleSolicitudMedicamento.__table__), detalles)
+
+    incrementar("farmacia.solicitudes_creadas", len(ids))
+    return [{
+        'id_solicitud': id_solicitud,
+        'medicamentos': [med.nombre_medicamento for med in s.medicamentos]
+    } for id_solicitud, s in zip(ids, solicitudes)]
@@ -0,0 +1,122 @@
+import hashlib
+import os
+import secrets
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy.orm import Session
+
+from database import DeptSessionLocal
+from dept_models import RefreshToken, UsuarioSistema
+from utils.metrics_utils import incrementar
+
+# ===============================================
+# REFRESH TOKENS ROTATIVOS
+# ===============================================
+# El login entrega un access token corto y un refresh token opaco. Cada uso
+# del refresh token lo marca como usado y emite uno nuevo de la misma
+# familia con los mismos claims, sin bcrypt y con una sola consulta por
+# clave primaria. Presentar un refresh token ya usado o revocado indica que
+# fue robado: se revoca la familia completa y hay que volver a iniciar sesión.
+
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "7"))
+# Claims del access token que no se copian al refrescar
+_CLAIMS_EFIMEROS = ("exp", "jti", "iat")
+
+def _hash_token(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def _error_refresh(detalle: str):
+    return HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail=detalle,
+        headers={"WWW-Authenticate": "Bearer"}
+    )
+
+def emitir_refresh_token(db: Session, claims: dict, id_emp: Optional[int] = None,
+                         family_id: Optional[str] = None) -> str:
+    """Crear un refresh token (no hace commit) y devolverlo en claro"""
+    token = secrets.token_urlsafe(48)
+    ahora = datetime.utcnow()
+    db.add(RefreshToken(
+        token_hash=_hash_token(token),
+        family_id=family_id or uuid.uuid4().hex,
+        id_emp=id_emp,
+        claims={k: v for k, v in claims.items() if k not in _CLAIMS_EFIMEROS},
+        expira_en=ahora + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        revocado=False,
+        created_at=ahora
+    ))
+    return token
+
+def rotar_refresh_token(db: Session, token: str) -> Tuple[dict, str]:
+    """Consumir un refresh token y emitir su reemplazo: (claims, nuevo_token). Hace commit."""
+    fila = db.query(RefreshToken, UsuarioSistema.cuenta_activa).outerjoin(
+        UsuarioSistema, UsuarioSistema.id_emp == RefreshToken.id_emp
+    ).filter(
+        RefreshToken.token_hash == _hash_token(token)
+    ).with_for_update(of=RefreshToken).first()
+
+    if not fila:
+        raise _error_refresh("Refresh token inválido")
+
+    registro, cuenta_activa = fila
+    if registro.revocado or registro.usado_en is not None:
+        # Reutilización: alguien más tiene una copia del token
+        revocar_familia(db, registro.family_id)
+        db.commit()
+        incrementar("refresh.reutilizados")
+        raise _error_refresh("Refresh token reutilizado; la sesión fue cerrada")
+
+    if registro.expira_en <= datetime.utcnow():
+        raise _error_refresh("Refresh token expirado")
+
+    if registro.id_emp is not None and not cuenta_activa:
+        revocar_familia(db, registro.family_id)
+        db.commit()
+        raise _error_refresh("Cuenta inactiva")
+
+    # Capturar antes del commit: expire_on_commit recargaría la fila con otro SELECT
+    claims = registro.claims
+    registro.usado_en = datetime.utcnow()
+    nuevo = emitir_refresh_token(db, claims, registro.id_emp, registro.family_id)
+    db.commit()
+    incrementar("refresh.rotados")
+    return claims, nuevo
+
+def revocar_familia(db: Session, family_id: str):
+    """Revocar todos los refresh tokens de una familia (no hace commit)"""
+    db.query(RefreshToken).filter(
+        RefreshToken.family_id == family_id,
+        RefreshToken.revocado == False
+    ).update({"revocado": True}, synchronize_session=False)
+
+def revocar_refresh_token(db: Session, token: str):
+    """Cerrar la sesión asociada a un refresh token (no hace commit)"""
+    registro = db.query(RefreshToken.family_id).filter(
+        RefreshToken.token_hash == _hash_token(token)
+    ).first()
+    if registro:
+        revocar_familia(db, registro.family_id)
+
+def revocar_refresh_tokens_empleado(db: Session, id_emp: int):
+    """Revocar todas las sesiones de un empleado (no hace commit)"""
+    db.query(RefreshToken).filter(
+        RefreshToken.id_emp == id_emp,
+        RefreshToken.revocado == False
+    ).update({"revocado": True}, synchronize_session=False)
+
+def purgar_refresh_tokens():
+    """Tarea de mantenimiento: borrar refresh tokens expirados"""
+    db = DeptSessionLocal()
+    try:
+        borrados = db.query(RefreshToken).filter(
+            RefreshToken.expira_en <= datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.commit()
+        if borrados:
+            incrementar("refresh.purgados", borrados)
+    finally:
+        db.close()
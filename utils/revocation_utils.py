@@ -0,0 +1,154 @@
+import hashlib
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from database import DeptSessionLocal
+from dept_models import TokenRevocado
+from utils.cache_utils import TTLCache
+from utils.metrics_utils import fijar_medidor, incrementar
+
+# ===============================================
+# REVOCACIÓN DE TOKENS (LOGOUT)
+# ===============================================
+# La tabla token_revocado es la fuente de verdad y la comparten todos los
+# workers. Cada worker mantiene un filtro de Bloom con los jti revocados
+# vigentes: si el jti no está en el filtro el token no fue revocado y no se
+# consulta la BD. Solo los positivos (revocados reales o falsos positivos)
+# se confirman contra la tabla, y el resultado se cachea.
+#
+# El filtro se sincroniza de forma incremental cada REVOCACION_SYNC_SECONDS
+# y se reconstruye desde cero cada REVOCACION_RECONSTRUIR_SECONDS para
+# descartar los tokens ya expirados. Un logout hecho en otro worker se
+# aplica aquí en la siguiente sincronización.
+
+REVOCACION_CAPACIDAD = int(os.getenv("REVOCACION_CAPACIDAD", "100000"))
+REVOCACION_TASA_FALSOS_POSITIVOS = 0.001
+REVOCACION_SYNC_SECONDS = float(os.getenv("REVOCACION_SYNC_SECONDS", "5"))
+REVOCACION_RECONSTRUIR_SECONDS = float(os.getenv("REVOCACION_RECONSTRUIR_SECONDS", "3600"))
+# Margen al releer filas recientes: cubre transacciones que confirman tarde
+MARGEN_SINCRONIZACION = timedelta(seconds=60)
+
+class BloomFilter:
+    """Filtro de Bloom sobre un bytearray con doble hashing (blake2b)"""
+
+    def __init__(self, capacidad: int, tasa_falsos_positivos: float):
+        capacidad = max(capacidad, 1)
+        self.m = max(8, math.ceil(-capacidad * math.log(tasa_falsos_positivos) / math.log(2) ** 2))
+        self.k = max(1, round(self.m / capacidad * math.log(2)))
+        self.bits = bytearray((self.m + 7) // 8)
+        self.elementos = 0
+
+    def _posiciones(self, clave: str):
+        digest = hashlib.blake2b(clave.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        return [(h1 + i * h2) % self.m for i in range(self.k)]
+
+    def agregar(self, clave: str):
+        for pos in self._posiciones(clave):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.elementos += 1
+
+    def __contains__(self, clave: str) -> bool:
+        bits = self.bits
+        return all(bits[pos >> 3] & (1 << (pos & 7)) for pos in self._posiciones(clave))
+
+_bloom = BloomFilter(REVOCACION_CAPACIDAD, REVOCACION_TASA_FALSOS_POSITIVOS)
+_lock = threading.Lock()
+_ultima_marca: Optional[datetime] = None
+_ultima_reconstruccion: Optional[float] = None
+# Resultado de confirmar un positivo del filtro contra la BD
+_confirmados = TTLCache("token_revocado", ttl_seconds=300, max_entries=10000)
+
+def esta_revocado(jti: str) -> bool:
+    """Comprobar si un jti fue revocado (sin BD en el caso habitual)"""
+    if jti not in _bloom:
+        return False
+
+    confirmado = _confirmados.get(jti)
+    if confirmado is not None:
+        return confirmado
+
+    db = DeptSessionLocal()
+    try:
+        revocado = db.query(TokenRevocado.jti).filter(TokenRevocado.jti == jti).first() is not None
+    finally:
+        db.close()
+    if not revocado:
+        incrementar("revocacion.falsos_positivos")
+    _confirmados.set(jti, revocado)
+    return revocado
+
+def revocar_token(db: Session, jti: str, expira_en: datetime, id_emp: Optional[int] = None,
+                  motivo: str = "LOGOUT"):
+    """Registrar la revocación (hace commit) y aplicarla de inmediato en este worker"""
+    db.execute(
+        pg_insert(TokenRevocado).values(
+            jti=jti,
+            id_emp=id_emp,
+            motivo=motivo,
+            expira_en=expira_en,
+            revocado_en=datetime.utcnow()
+        ).on_conflict_do_nothing(index_elements=[TokenRevocado.jti])
+    )
+    db.commit()
+    _bloom.agregar(jti)
+    _confirmados.set(jti, True)
+    incrementar("revocacion.revocados")
+
+def _reconstruir(db: Session):
+    """Cargar todos los jti vigentes en un filtro nuevo y purgar los expirados"""
+    global _bloom, _ultima_marca, _ultima_reconstruccion
+    ahora = datetime.utcnow()
+    db.query(TokenRevocado).filter(TokenRevocado.expira_en <= ahora).delete(synchronize_session=False)
+    db.commit()
+
+    filas = db.query(TokenRevocado.jti, TokenRevocado.revocado_en).filter(
+        TokenRevocado.expira_en > ahora
+    ).all()
+    nuevo = BloomFilter(max(REVOCACION_CAPACIDAD, 2 * len(filas)), REVOCACION_TASA_FALSOS_POSITIVOS)
+    for jti, _ in filas:
+        nuevo.agregar(jti)
+
+    with _lock:
+        _bloom = nuevo
+        _ultima_marca = max((r for _, r in filas), default=ahora)
+        _ultima_reconstruccion = time.monotonic()
+    _confirmados.clear()
+    fijar_medidor("revocacion.jti_en_filtro", nuevo.elementos)
+
+def _sincronizar_incremental(db: Session):
+    """Agregar al filtro las revocaciones hechas por otros workers"""
+    global _ultima_marca
+    filas = db.query(TokenRevocado.jti, TokenRevocado.revocado_en).filter(
+        TokenRevocado.revocado_en >= _ultima_marca - MARGEN_SINCRONIZACION,
+        TokenRevocado.expira_en > datetime.utcnow()
+    ).all()
+
+    with _lock:
+        for jti, revocado_en in filas:
+            _bloom.agregar(jti)
+            # Un "no revocado" cacheado por falso positivo ya no es válido
+            _confirmados.invalidate(jti)
+            if revocado_en > _ultima_marca:
+                _ultima_marca = revocado_en
+    fijar_medidor("revocacion.jti_en_filtro", _bloom.elementos)
+
+def sincronizar_revocaciones():
+    """Tarea de mantenimiento: sincronizar o reconstruir el filtro"""
+    db = DeptSessionLocal()
+    try:
+        if (_ultima_reconstruccion is None
+                or time.monotonic() - _ultima_reconstruccion >= REVOCACION_RECONSTRUIR_SECONDS):
+            _reconstruir(db)
+        else:
+            _sincronizar_incremental(db)
+    finally:
+        db.close()
@@ -0,0 +1,132 @@
+from datetime import date, datetime, timedelta
+from typing import Optional
+from sqlalchemy import String, cast, delete, func, insert, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from dept_models import Cita, CitaDailyStats
+
+# ===============================================
+# ROLLUP DIARIO DE CITAS (cita_daily_stats)
+# ===============================================
+
+def clave_stats_cita(cita: Cita):
+    """Clave del rollup para el estado actual de una cita"""
+    return (
+        cita.fecha_cita,
+        cita.id_dept,
+        cita.id_emp,
+        cita.id_tipo_cita,
+        cita.estado_cita.value if cita.estado_cita else 'SIN_ESTADO'
+    )
+
+def registrar_cambio_cita(db: Session, clave_antes=None, clave_despues=None):
+    """Aplicar al rollup el paso de una cita de clave_antes a clave_despues.
+
+    Debe llamarse dentro de la misma transacción que modifica la cita para
+    que el rollup y la tabla cita queden consistentes al hacer commit.
+    Creación: (None, clave). Cambio de estado o reprogramación: (antes, después).
+    """
+    if clave_antes == clave_despues:
+        return
+    
+    ahora = datetime.utcnow()
+    filas = []
+    if clave_antes is not None:
+        filas.append(_fila_rollup(clave_antes, -1, ahora))
+    if clave_despues is not None:
+        filas.append(_fila_rollup(clave_despues, 1, ahora))
+    
+    stmt = pg_insert(CitaDailyStats).values(filas)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[
+            CitaDailyStats.fecha,
+            CitaDailyStats.id_dept,
+            CitaDailyStats.id_emp,
+            CitaDailyStats.id_tipo_cita,
+            CitaDailyStats.estado
+        ],
+        set_={
+            'total': CitaDailyStats.total + stmt.excluded.total,
+            'updated_at': stmt.excluded.updated_at
+        }
+    )
+    db.execute(stmt)
+
+def _fila_rollup(clave, delta: int, ahora: datetime) -> dict:
+    fecha, id_dept, id_emp, id_tipo_cita, estado = clave
+    return {
+        'fecha': fecha,
+        'id_dept': id_dept,
+        'id_emp': id_emp,
+        'id_tipo_cita': id_tipo_cita,
+        'estado': estado,
+        'total': delta,
+        'updated_at': ahora
+    }
+
+def backfill_cita_daily_stats(
+    db: Session,
+    fecha_desde: Optional[date] = None,
+    fecha_hasta: Optional[date] = None,
+    dias_por_lote: int = 31
+) -> int:
+    """Recalcular el rollup desde la tabla cita, por lotes de días.
+
+    Cada lote corre en su propia transacción y bloquea escrituras sobre
+    cita (LOCK ... IN SHARE MODE) mientras se recalcula, para que ningún
+    cambio concurrente se cuente dos veces o se pierda. Las lecturas no
+    se bloquean. Devuelve el número de filas escritas en el rollup.
+    """
+    if fecha_desde is None or fecha_hasta is None:
+        minimo, maximo = db.query(func.min(Cita.fecha_cita), func.max(Cita.fecha_cita)).one()
+        db.commit()
+        if minimo is None:
+            return 0
+        fecha_desde = fecha_desde or minimo
+        fecha_hasta = fecha_hasta or maximo
+    
+    escritas = 0
+    inicio = fecha_desde
+    while inicio <= fecha_hasta:
+        fin = min(inicio + timedelta(days=dias_por_lote - 1), fecha_hasta)
+        try:
+            db.execute(text("LOCK TABLE cita IN SHARE MODE"))
+            db.execute(
+                delete(CitaDailyStats).where(
+                    CitaDailyStats.fecha >= inicio,
+                    CitaDailyStats.fecha <= fin
+                )
+            )
+            agregados = select(
+                Cita.fecha_cita,
+                Cita.id_dept,
+                Cita.id_emp,
+                Cita.id_tipo_cita,
+                func.coalesce(cast(Cita.estado_cita, String), 'SIN_ESTADO'),
+                func.count(),
+                func.now()
+            ).where(
+                Cita.fecha_cita >= inicio,
+                Cita.fecha_cita <= fin
+            ).group_by(
+                Cita.fecha_cita,
+                Cita.id_dept,
+                Cita.id_emp,
+                Cita.id_tipo_cita,
+                Cita.estado_cita
+            )
+            result = db.execute(
+                insert(CitaDailyStats).from_select(
+                    ['fecha', 'id_dept', 'id_emp', 'id_tipo_cita', 'estado', 'total', 'updated_at'],
+                    agregados
+                )
+            )
+            db.commit()
+            escritas += result.rowcount or 0
+        except Exception:
+            db.rollback()
+            raise
+        inicio = fin + timedelta(days=1)
+    
+    return escritas
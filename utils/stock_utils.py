@@ -0,0 +1,294 @@
+import os
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import Integer, and_, case, column, func, insert, literal, or_, select, update, values
+from sqlalchemy.orm import Session
+
+from central_models import EstadoMedicamento, EventoStock, Medicamento, ReservaStock, ReservaStockDetalle
+from database import CentralSessionLocal
+from utils.db_utils import lock_eventos_stock
+from utils.metrics_utils import incrementar
+
+# ===============================================
+# RESERVA Y DISPENSACIÓN ATÓMICA DE STOCK
+# ===============================================
+# Todo cambio de medicamento.stock_actual pasa por ajustar_stock: un único
+# UPDATE condicional (stock_actual + delta >= 0) para todas las líneas, sin
+# leer el stock antes. Las filas se bloquean en orden de cod_med para que dos
+# farmaceutas con líneas cruzadas no entren en deadlock; si alguna línea no
+# alcanza se lanza StockInsuficiente y el llamador hace rollback.
+#
+# Reservar descuenta el stock y deja una reserva ACTIVA con vencimiento;
+# confirmarla la deja dispensada y liberarla o dejarla expirar devuelve las
+# cantidades.
+#
+# Cuando un cambio cruza stock_minimo, ajustar_stock escribe un evento en
+# evento_stock dentro de la misma transacción (feed de /farmacia/stock-bajo).
+# Antes de escribirlo toma lock_eventos_stock, que se suelta al confirmar: los
+# id_evento quedan en orden de commit. Solo las transiciones lo toman.
+
+RESERVA_TTL_MINUTOS_DEFAULT = int(os.getenv("RESERVA_TTL_MINUTOS", "15"))
+RESERVAS_EXPIRAR_SECONDS = float(os.getenv("RESERVAS_EXPIRAR_SECONDS", "60"))
+VENCIMIENTO_BARRIDO_SECONDS = float(os.getenv("VENCIMIENTO_BARRIDO_SECONDS", "3600"))
+EVENTOS_STOCK_RETENCION_DIAS = int(os.getenv("EVENTOS_STOCK_RETENCION_DIAS", "30"))
+
+ESTADOS_DISPENSABLES = [EstadoMedicamento.DISPONIBLE, EstadoMedicamento.AGOTADO]
+
+ESTADO_ACTIVA = "ACTIVA"
+ESTADO_CONFIRMADA = "CONFIRMADA"
+ESTADO_LIBERADA = "LIBERADA"
+ESTADO_EXPIRADA = "EXPIRADA"
+
+EVENTO_STOCK_BAJO = "STOCK_BAJO"
+EVENTO_STOCK_NORMAL = "STOCK_NORMAL"
+
+MOTIVO_RESERVA = "RESERVA"
+MOTIVO_LIBERACION = "LIBERACION"
+MOTIVO_EXPIRACION = "EXPIRACION"
+
+class StockInsuficiente(Exception):
+    """Alguna línea no tiene stock suficiente (o el medicamento no se puede dispensar)"""
+
+    def __init__(self, faltantes: List[int]):
+        self.faltantes = faltantes
+        super().__init__(f"Stock insuficiente para: {', '.join(map(str, faltantes))}")
+
+def _agrupar(lineas: Iterable[Tuple[int, int]]) -> Dict[int, int]:
+    cantidades = defaultdict(int)
+    for cod_med, cantidad in lineas:
+        cantidades[cod_med] += cantidad
+    return dict(cantidades)
+
+def _estado(valor: EstadoMedicamento):
+    return literal(valor, Medicamento.estado_medicamento.type)
+
+def _eventos_stock_bajo(filas, motivo: Optional[str], referencia: Optional[str]) -> List[dict]:
+    ahora = datetime.utcnow()
+    eventos = []
+    for cod_med, stock_nuevo, stock_minimo, delta in filas:
+        if stock_minimo is None:
+            continue
+        stock_anterior = stock_nuevo - delta
+        if (stock_anterior <= stock_minimo) == (stock_nuevo <= stock_minimo):
+            continue
+        eventos.append({
+            'cod_med': cod_med,
+            'tipo': EVENTO_STOCK_BAJO if stock_nuevo <= stock_minimo else EVENTO_STOCK_NORMAL,
+            'stock_anterior': stock_anterior,
+            'stock_nuevo': stock_nuevo,
+            'stock_minimo': stock_minimo,
+            'motivo': motivo,
+            'referencia': referencia,
+            'created_at': ahora
+        })
+    return eventos
+
+def ajustar_stock(db: Session, cambios: Dict[int, int], motivo: Optional[str] = None,
+                  referencia: Optional[str] = None) -> Dict[int, int]:
+    """Aplicar {cod_med: delta} en un solo UPDATE condicional; devuelve el stock resultante (no hace commit)"""
+    cambios = {cod: delta for cod, delta in cambios.items() if delta}
+    if not cambios:
+        return {}
+
+    deltas = values(
+        column("cod_med", Integer), column("delta", Integer), name="deltas"
+    ).data(sorted(cambios.items()))
+
+    # Bloqueo en orden de clave antes de evaluar las condiciones
+    bloqueados = select(Medicamento.cod_med).where(
+        Medicamento.cod_med.in_(list(cambios))
+    ).order_by(Medicamento.cod_med).with_for_update()
+
+    stock = func.coalesce(Medicamento.stock_actual, 0)
+    nuevo_stock = stock + deltas.c.delta
+
+    stmt = update(Medicamento).where(
+        Medicamento.cod_med == deltas.c.cod_med,
+        Medicamento.cod_med.in_(bloqueados.scalar_subquery()),
+        nuevo_stock >= 0,
+        # Solo se descuenta de medicamentos dispensables y no vencidos (aunque
+        # el barrido aún no los haya marcado); devolver siempre se permite
+        or_(
+            deltas.c.delta > 0,
+            and_(
+                or_(
+                    Medicamento.estado_medicamento.is_(None),
+                    Medicamento.estado_medicamento.in_(ESTADOS_DISPENSABLES)
+                ),
+                or_(
+                    Medicamento.fecha_vencimiento.is_(None),
+                    Medicamento.fecha_vencimiento >= date.today()
+                )
+            )
+        )
+    ).values(
+        stock_actual=nuevo_stock,
+        estado_medicamento=case(
+            (nuevo_stock <= 0, _estado(EstadoMedicamento.AGOTADO)),
+            (Medicamento.estado_medicamento == EstadoMedicamento.AGOTADO, _estado(EstadoMedicamento.DISPONIBLE)),
+            else_=Medicamento.estado_medicamento
+        ),
+        updated_at=datetime.utcnow()
+    ).returning(Medicamento.cod_med, Medicamento.stock_actual, Medicamento.stock_minimo, deltas.c.delta)
+
+    filas = db.execute(stmt, execution_options={"synchronize_session": False}).all()
+    resultado = {fila.cod_med: fila.stock_actual for fila in filas}
+
+    faltantes = sorted(cod for cod in cambios if cod not in resultado)
+    if faltantes:
+        incrementar("stock.insuficiente")
+        raise StockInsuficiente(faltantes)
+
+    eventos = _eventos_stock_bajo(filas, motivo, referencia)
+    if eventos:
+        lock_eventos_stock(db)
+        db.execute(insert(EventoStock.__table__), eventos)
+        incrementar("stock.eventos_stock_bajo", len(eventos))
+    return resultado
+
+def reservar_stock(db: Session, lineas: Iterable[Tuple[int, int]], id_solicitud: Optional[int] = None,
+                   id_emp: Optional[int] = None, ttl_minutos: Optional[int] = None) -> ReservaStock:
+    """Descontar todas las líneas [(cod_med, cantidad)] y registrar la reserva (no hace commit)"""
+    cantidades = _agrupar(lineas)
+
+    ahora = datetime.utcnow()
+    reserva = ReservaStock(
+        id_solicitud=id_solicitud,
+        id_emp=id_emp,
+        estado=ESTADO_ACTIVA,
+        expira_en=ahora + timedelta(minutes=ttl_minutos or RESERVA_TTL_MINUTOS_DEFAULT),
+        created_at=ahora,
+        updated_at=ahora
+    )
+    db.add(reserva)
+    db.flush()  # id para la referencia de los eventos
+
+    ajustar_stock(
+        db, {cod: -cantidad for cod, cantidad in cantidades.items()},
+        motivo=MOTIVO_RESERVA, referencia=f"reserva:{reserva.id_reserva}"
+    )
+    reserva.detalles = [ReservaStockDetalle(cod_med=cod, cantidad=cantidad) for cod, cantidad in cantidades.items()]
+    db.flush()
+    incrementar("stock.reservas")
+    return reserva
+
+def _cambiar_estado(db: Session, id_reserva: int, nuevo_estado: str, vigente: bool) -> bool:
+    ahora = datetime.utcnow()
+    condiciones = [ReservaStock.id_reserva == id_reserva, ReservaStock.estado == ESTADO_ACTIVA]
+    if vigente:
+        condiciones.append(ReservaStock.expira_en > ahora)
+    valores = {"estado": nuevo_estado, "updated_at": ahora}
+    if nuevo_estado == ESTADO_CONFIRMADA:
+        valores["confirmada_en"] = ahora
+    fila = db.execute(
+        update(ReservaStock).where(*condiciones).values(**valores).returning(ReservaStock.id_reserva),
+        execution_options={"synchronize_session": False}
+    ).first()
+    return fila is not None
+
+def _devolver_stock(db: Session, ids_reserva: List[int], motivo: str):
+    filas = db.query(ReservaStockDetalle.cod_med, ReservaStockDetalle.cantidad).filter(
+        ReservaStockDetalle.id_reserva.in_(ids_reserva)
+    ).all()
+    referencia = f"reserva:{ids_reserva[0]}" if len(ids_reserva) == 1 else None
+    ajustar_stock(db, _agrupar(filas), motivo=motivo, referencia=referencia)
+
+def confirmar_reserva(db: Session, id_reserva: int) -> bool:
+    """Marcar como dispensada una reserva activa y vigente (no hace commit)"""
+    confirmada = _cambiar_estado(db, id_reserva, ESTADO_CONFIRMADA, vigente=True)
+    if confirmada:
+        incrementar("stock.reservas_confirmadas")
+    return confirmada
+
+def liberar_reserva(db: Session, id_reserva: int) -> bool:
+    """Cancelar una reserva activa y devolver su stock (no hace commit)"""
+    liberada = _cambiar_estado(db, id_reserva, ESTADO_LIBERADA, vigente=False)
+    if liberada:
+        _devolver_stock(db, [id_reserva], MOTIVO_LIBERACION)
+        incrementar("stock.reservas_liberadas")
+    return liberada
+
+def expirar_reservas(limite: int = 500):
+    """Tarea de mantenimiento: expirar reservas vencidas y devolver su stock por lotes"""
+    db = CentralSessionLocal()
+    try:
+        while True:
+            # SKIP LOCKED: las reservas que un farmaceuta está confirmando se
+            # revisan en la siguiente pasada
+            vencidas = select(ReservaStock.id_reserva).where(
+                ReservaStock.estado == ESTADO_ACTIVA,
+                ReservaStock.expira_en <= datetime.utcnow()
+            ).order_by(ReservaStock.expira_en).limit(limite).with_for_update(skip_locked=True)
+
+            ids = db.execute(
+                update(ReservaStock).where(
+                    ReservaStock.id_reserva.in_(vencidas.scalar_subquery())
+                ).values(
+                    estado=ESTADO_EXPIRADA, updated_at=datetime.utcnow()
+                ).returning(ReservaStock.id_reserva),
+                execution_options={"synchronize_session": False}
+            ).scalars().all()
+
+            if not ids:
+                break
+            _devolver_stock(db, ids, MOTIVO_EXPIRACION)
+            db.commit()
+            incrementar("stock.reservas_expiradas", len(ids))
+            if len(ids) < limite:
+                break
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def vencer_medicamentos(limite: int = 500):
+    """Tarea de mantenimiento: pasar a VENCIDO, por lotes, los medicamentos con fecha vencida"""
+    db = CentralSessionLocal()
+    try:
+        while True:
+            # Rango sobre ix_medicamento_vencimiento_pendiente (mismo predicado de
+            # estado que el índice parcial); SKIP LOCKED para no
+            # esperar a las dispensaciones en curso
+            vencidos = select(Medicamento.cod_med).where(
+                Medicamento.fecha_vencimiento < date.today(),
+                or_(
+                    Medicamento.estado_medicamento.is_(None),
+                    Medicamento.estado_medicamento.in_(ESTADOS_DISPENSABLES)
+                )
+            ).order_by(Medicamento.fecha_vencimiento).limit(limite).with_for_update(skip_locked=True)
+
+            codigos = db.execute(
+                update(Medicamento).where(
+                    Medicamento.cod_med.in_(vencidos.scalar_subquery())
+                ).values(
+                    estado_medicamento=EstadoMedicamento.VENCIDO, updated_at=datetime.utcnow()
+                ).returning(Medicamento.cod_med),
+                execution_options={"synchronize_session": False}
+            ).scalars().all()
+            db.commit()
+
+            if codigos:
+                incrementar("stock.medicamentos_vencidos", len(codigos))
+            if len(codigos) < limite:
+                break
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def purgar_eventos_stock():
+    """Tarea de mantenimiento: borrar eventos de stock más antiguos que la retención"""
+    db = CentralSessionLocal()
+    try:
+        borrados = db.query(EventoStock).filter(
+            EventoStock.created_at < datetime.utcnow() - timedelta(days=EVENTOS_STOCK_RETENCION_DIAS)
+        ).delete(synchronize_session=False)
+        db.commit()
+        if borrados:
+            incrementar("stock.eventos_purgados", borrados)
+    finally:
+        db.close()
@@ -0,0 +1,128 @@
+import ipaddress
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from fastapi import HTTPException, status
+
+from utils.metrics_utils import incrementar
+
+# ===============================================
+# LIMITACIÓN DE INTENTOS DE LOGIN EN MEMORIA
+# ===============================================
+# Token bucket por email y por IP: los intentos excedentes se rechazan con
+# 429 antes de consultar la BD o calcular bcrypt. Los fallos de contraseña
+# se cuentan en memoria y solo se escriben en la BD cuando se alcanza el
+# umbral de bloqueo. El estado es por worker.
+#
+# La IP del cliente solo se toma de X-Forwarded-For cuando la petición llega
+# desde un proxy de LOGIN_PROXIES_CONFIABLES. Aun así todas las estaciones
+# detrás del NAT del hospital comparten dirección, por eso la cuota por IP es
+# holgada (cambio de turno). LOGIN_LIMITE_IP=false la desactiva en
+# despliegues que no pueden configurar sus proxies.
+
+LOGIN_EMAIL_RAFAGA = int(os.getenv("LOGIN_EMAIL_RAFAGA", "5"))
+LOGIN_EMAIL_POR_MINUTO = float(os.getenv("LOGIN_EMAIL_POR_MINUTO", "5"))
+LOGIN_IP_RAFAGA = int(os.getenv("LOGIN_IP_RAFAGA", "200"))
+LOGIN_IP_POR_MINUTO = float(os.getenv("LOGIN_IP_POR_MINUTO", "120"))
+LOGIN_LIMITE_IP = os.getenv("LOGIN_LIMITE_IP", "true").lower() == "true"
+# IPs o redes (CIDR) separadas por comas, p. ej. "10.0.0.5,172.16.0.0/12"
+LOGIN_PROXIES_CONFIABLES = [
+    ipaddress.ip_network(red.strip(), strict=False)
+    for red in os.getenv("LOGIN_PROXIES_CONFIABLES", "").split(",") if red.strip()
+]
+MAX_INTENTOS_FALLIDOS = 5
+VENTANA_FALLOS_SECONDS = 15 * 60
+
+class LimitadorTokens:
+    """Token bucket por clave con número de claves acotado (LRU)"""
+
+    def __init__(self, nombre: str, capacidad: int, por_minuto: float, max_claves: int = 50000):
+        self.nombre = nombre
+        self.capacidad = capacidad
+        self.recarga_por_segundo = por_minuto / 60.0
+        self.max_claves = max_claves
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def consumir(self, clave) -> float:
+        """Consumir un token; devuelve 0 si se permite o los segundos hasta el próximo"""
+        ahora = time.monotonic()
+        with self._lock:
+            tokens, ultimo = self._buckets.get(clave, (self.capacidad, ahora))
+            tokens = min(self.capacidad, tokens + (ahora - ultimo) * self.recarga_por_segundo)
+            if tokens >= 1:
+                self._buckets[clave] = (tokens - 1, ahora)
+                espera = 0.0
+            else:
+                self._buckets[clave] = (tokens, ahora)
+                espera = (1 - tokens) / self.recarga_por_segundo
+            self._buckets.move_to_end(clave)
+            while len(self._buckets) > self.max_claves:
+                self._buckets.popitem(last=False)
+        if espera:
+            incrementar(f"login.limitado_{self.nombre}")
+        return espera
+
+_limitador_email = LimitadorTokens("email", LOGIN_EMAIL_RAFAGA, LOGIN_EMAIL_POR_MINUTO)
+_limitador_ip = LimitadorTokens("ip", LOGIN_IP_RAFAGA, LOGIN_IP_POR_MINUTO)
+
+_fallos = {}
+_fallos_lock = threading.Lock()
+
+def _es_proxy_confiable(ip: str) -> bool:
+    try:
+        direccion = ipaddress.ip_address(ip)
+    except ValueError:
+        return False
+    return any(direccion in red for red in LOGIN_PROXIES_CONFIABLES)
+
+def ip_cliente(request) -> str:
+    """IP del cliente: X-Forwarded-For solo si la conexión viene de un proxy confiable"""
+    ip = request.client.host if request.client else "desconocido"
+    if not _es_proxy_confiable(ip):
+        return ip
+    # Se recorre de derecha a izquierda saltando los proxies propios; el
+    # primer salto no confiable es el cliente (lo anterior lo puede falsear él)
+    saltos = [salto.strip() for salto in request.headers.get("x-forwarded-for", "").split(",") if salto.strip()]
+    for salto in reversed(saltos):
+        if not _es_proxy_confiable(salto):
+            return salto
+        ip = salto
+    return ip
+
+def verificar_limite_login(email: str, ip: str):
+    """Lanzar 429 con Retry-After si el email o la IP del cliente superaron su cuota"""
+    espera = _limitador_email.consumir(email.strip().lower())
+    if LOGIN_LIMITE_IP:
+        espera = max(espera, _limitador_ip.consumir(ip))
+    if espera:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Demasiados intentos de inicio de sesión, intente más tarde",
+            headers={"Retry-After": str(math.ceil(espera))}
+        )
+
+def registrar_fallo_login(email: str) -> int:
+    """Contar un fallo de contraseña dentro de la ventana; devuelve el total"""
+    clave = email.strip().lower()
+    ahora = time.monotonic()
+    with _fallos_lock:
+        cantidad, inicio = _fallos.get(clave, (0, ahora))
+        if ahora - inicio > VENTANA_FALLOS_SECONDS:
+            cantidad, inicio = 0, ahora
+        cantidad += 1
+        _fallos[clave] = (cantidad, inicio)
+        # Purga ocasional de ventanas vencidas
+        if len(_fallos) > 10000:
+            for k in [k for k, (_, i) in _fallos.items() if ahora - i > VENTANA_FALLOS_SECONDS]:
+                del _fallos[k]
+    incrementar("login.fallos")
+    return cantidad
+
+def limpiar_fallos_login(email: str):
+    """Olvidar los fallos tras un login exitoso"""
+    with _fallos_lock:
+        _fallos.pop(email.strip().lower(), None)